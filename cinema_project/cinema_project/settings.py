@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы время ответа включало и остальные middleware
+    'cinema_tickets.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,10 +76,48 @@ WSGI_APPLICATION = 'cinema_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Профиль SQLite для конкурентной записи (несколько потоков/процессов покупают билеты):
+# - WAL: читатели не блокируют писателя и наоборот, synchronous=NORMAL безопасен в режиме WAL;
+# - busy_timeout/timeout: ждать освобождения блокировки, а не падать сразу с "database is locked";
+# - BEGIN IMMEDIATE: транзакция сразу берет блокировку записи, поэтому не бывает
+#   взаимных блокировок при "повышении" чтения до записи (их SQLite не ждет по busy_timeout);
+# - CONN_MAX_AGE: соединение (и PRAGMA) переиспользуется между запросами.
+SQLITE_CONCURRENCY_OPTIONS = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA busy_timeout=5000;'
+        'PRAGMA temp_store=MEMORY;'
+    ),
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 5,
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': SQLITE_CONCURRENCY_OPTIONS,
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Повтор транзакции покупки при "database is locked": число попыток и
+# границы задержки (секунды) для экспоненциальной паузы со случайным разбросом
+DB_LOCK_RETRY_ATTEMPTS = 5
+DB_LOCK_RETRY_BASE_DELAY = 0.02
+DB_LOCK_RETRY_MAX_DELAY = 0.5
+
+
+# Кэш (карта мест по сеансам и т.п.)
+# Локальная память подходит для одного процесса; для нескольких процессов/серверов
+# используйте общий кэш, например 'django.core.cache.backends.redis.RedisCache' -
+# на нем держатся удержания мест (manage.py check --deploy проверяет это)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cinema-tickets',
     }
 }
 
@@ -128,6 +168,59 @@ MEDIA_ROOT = BASE_DIR / 'media'
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 DEFAULT_FROM_EMAIL = 'Кинотеатр <noreply@examplecinema.com>' # Отображаемое имя и адрес
 
+# --- Фоновая обработка билетов ---
+# False: PDF и email обрабатывает отдельный процесс manage.py run_ticket_worker.
+# True: задания билета выполняются сразу после коммита покупки в том же запросе
+# (удобно для разработки без воркера; ошибки не откатывают покупку).
+TICKET_JOBS_EAGER = False
+
+# Ленивая генерация PDF: при покупке PDF не создается, он генерируется один раз
+# при первом скачивании или отправке email и дальше отдается из хранилища
+TICKET_PDF_LAZY = False
+
+# Максимальное число мест в одном групповом заказе (api/orders/)
+TICKET_ORDER_MAX_SEATS = 10
+
+# Отрисовка QR-кода и штрихкода в PDF билета:
+# 'vector' - прямоугольниками прямо в PDF (быстрее, файлы меньше), 'image' - через PNG-картинки
+TICKET_CODES_RENDER = 'vector'
+
+# Профиль PDF билетов: 'standard' - настройки ReportLab по умолчанию, 'compact' -
+# шрифт без хинтинга, сжатые потоки, 1-битные картинки кодов (в 2-3 раза меньше
+# файлы и письма). 'compact' экспериментальный и работает только с проверенными
+# версиями ReportLab (см. pdfcompact.py)
+TICKET_PDF_PROFILE = 'standard'
+
+# Отдача PDF билетов через фронтовой сервер вместо Django:
+# None - Django стримит файл сам; 'x-accel-redirect' - nginx (internal-location
+# с префиксом TICKET_PDF_ACCEL_PREFIX, указывающий на MEDIA_ROOT); 'x-sendfile' - Apache mod_xsendfile
+TICKET_PDF_SENDFILE = None
+TICKET_PDF_ACCEL_PREFIX = '/protected-media/'
+
+# Сколько писем воркер отправляет через одно соединение с почтовым сервером
+TICKET_EMAIL_BATCH_SIZE = 50
+
+# Сколько секунд действует удержание мест (api/holds/) до подтверждения покупкой
+SEAT_HOLD_TTL = 5 * 60
+
+# Главная страница: сеансов на странице списка и сколько секунд хранится
+# готовый фрагмент страницы (продажи и изменения сеансов сбрасывают его сразу)
+HOME_SESSIONS_PAGE_SIZE = 20
+HOME_SESSIONS_CACHE_TIMEOUT = 60
+
+# Проход по билетам (api/checkin/): CHECKIN_API_TOKEN - если задан,
+# сканер передает его в заголовке X-Checkin-Token
+CHECKIN_API_TOKEN = None
+
+# QR-код билета - подписанный токен (qrtoken.py). TICKET_QR_SECRET - ключ подписи
+# (None - SECRET_KEY), TICKET_QR_GRACE - сколько секунд токен действует после конца сеанса
+TICKET_QR_SECRET = None
+TICKET_QR_GRACE = 6 * 60 * 60
+
+# Адреса, которым доступен /metrics (формат Prometheus). None или пустой список - не доступен никому;
+# для сборщика метрик с другой машины добавьте его адрес
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
 # --- Для реальной отправки через SMTP (например, Gmail) ---
 # РАСКОММЕНТИРУЙТЕ И ЗАПОЛНИТЕ ДЛЯ ПРОДАКШЕНА
 # EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -1,8 +1,78 @@
 # cinema_tickets/admin.py
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.html import format_html # Добавлен импорт
-from .models import ФизическиеЛица, СеансыФильмов, МестаВЗале, КупленныеБилеты
-from .utils import generate_ticket_pdf # Оставляем импорт
+from .models import ФизическиеЛица, Залы, СеансыФильмов, МестаВЗале, КупленныеБилеты, Заказы, ЗаданияОбработки, АрхивБилетов
+from .dbstats import estimated_row_count
+from .utils import render_ticket_sheets
+from .jobs import enqueue_pdf_regeneration, enqueue_session_notification
+from datetime import timedelta
+import tempfile
+from django.http import FileResponse
+
+
+class ОценочныйПагинатор(Paginator):
+    """
+    Пагинатор списков админки для больших таблиц. Вместо точного COUNT(*) по всей
+    таблице - оценка числа строк, а отфильтрованный список считается не дальше
+    MAX_EXACT_COUNT строк (COUNT по подзапросу с LIMIT): последние страницы
+    очень длинного результата не показываются, их сужают фильтрами или поиском.
+    Пока у таблицы нет статистики (ANALYZE), так же считается и полный список.
+    """
+    MAX_EXACT_COUNT = 10000
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.has_filters():
+            estimate = estimated_row_count(self.object_list.model)
+            if estimate is not None and estimate > self.MAX_EXACT_COUNT:
+                return estimate
+        return self.object_list.order_by()[:self.MAX_EXACT_COUNT].count()
+
+
+class СеансФильтр(admin.SimpleListFilter):
+    """
+    Фильтр по сеансу без перебора всех сеансов: предлагаются только ближайшие.
+    Любой другой сеанс можно выбрать параметром ?сеанс=<id> (например, ссылкой из списка сеансов).
+    """
+    title = 'сеанс'
+    parameter_name = 'сеанс'
+    LIMIT = 30
+
+    def lookups(self, request, model_admin):
+        сеансы = list(СеансыФильмов.objects.filter(время_начала__gte=timezone.now() - timedelta(days=1))
+                      .order_by('время_начала', 'pk')[:self.LIMIT])
+        выбранный = self._session_id()
+        if выбранный and выбранный not in {сеанс.pk for сеанс in сеансы}:
+            сеансы += list(СеансыФильмов.objects.filter(pk=выбранный))
+        return [(str(сеанс.pk), str(сеанс)) for сеанс in сеансы]
+
+    def _session_id(self):
+        try:
+            return int(self.value()) if self.value() else None
+        except ValueError:
+            return None
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        session_id = self._session_id()
+        return queryset.filter(сеанс_id=session_id) if session_id else queryset.none()
+
+
+def _print_tickets_response(tickets, file_name, per_page=4):
+    """Один PDF со всеми билетами (4 на лист A4) для кассы."""
+    output = tempfile.TemporaryFile()
+    render_ticket_sheets(tickets.select_related('сеанс', 'место', 'клиент')
+                         .order_by('сеанс__время_начала', 'место__номер_места').iterator(chunk_size=500),
+                         output, per_page=per_page)
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=file_name, content_type='application/pdf')
 
 @admin.register(ФизическиеЛица)
 class ФизическиеЛицаAdmin(admin.ModelAdmin):
@@ -10,42 +80,126 @@ class ФизическиеЛицаAdmin(admin.ModelAdmin):
     list_display = ('фамилия', 'имя', 'отчество', 'номер_телефона', 'email', 'дата_рождения')
     search_fields = ('фамилия', 'имя', 'номер_телефона', 'email') # <-- Добавляем email -->
 
+@admin.register(Залы)
+class ЗалыAdmin(admin.ModelAdmin):
+    list_display = ('название',)
+    search_fields = ('название',)
+
 @admin.register(СеансыФильмов)
 class СеансыФильмовAdmin(admin.ModelAdmin):
-    list_display = ('название_фильма', 'время_начала', 'время_окончания', 'продолжительность')
-    list_filter = ('название_фильма', 'время_начала')
+    list_display = ('название_фильма', 'зал', 'время_начала', 'время_окончания', 'продолжительность')
+    list_filter = ('зал', 'название_фильма', 'время_начала')
+    list_select_related = ('зал',)
     search_fields = ('название_фильма',)
+    actions = ['print_session_tickets']
+
+    @admin.action(description="Печать всех билетов выбранных сеансов (4 на лист A4)")
+    def print_session_tickets(self, request, queryset):
+        return _print_tickets_response(КупленныеБилеты.objects.filter(сеанс__in=queryset), 'session_tickets.pdf')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # При переносе сеанса держатели билетов получают письмо (рассылку выполнит воркер)
+        if change and {'время_начала', 'время_окончания'} & set(form.changed_data):
+            job = enqueue_session_notification(obj)
+            messages.info(request, f"Держателям билетов будет отправлено письмо об изменении сеанса (задание {job.id}).")
 
 @admin.register(МестаВЗале)
 class МестаВЗалеAdmin(admin.ModelAdmin):
-    list_display = ('номер_места',)
+    list_display = ('номер_места', 'зал', 'секция', 'ряд', 'место_в_ряду')
+    list_filter = ('зал', 'секция')
+    list_select_related = ('зал',)
 
 @admin.register(КупленныеБилеты)
 class КупленныеБилетыAdmin(admin.ModelAdmin):
     # <-- Добавляем email_получателя -->
-    list_display = ('id', 'клиент', 'сеанс', 'место', 'дата_покупки', 'email_получателя', 'pdf_файл_link')
-    list_filter = ('сеанс__название_фильма', 'сеанс__время_начала', 'дата_покупки', 'email_получателя')
-    search_fields = ('клиент__фамилия', 'клиент__имя', 'сеанс__название_фильма', 'email_получателя')
+    list_display = ('id', 'клиент', 'сеанс', 'место', 'дата_покупки', 'email_получателя', 'статус', 'pdf_файл_link')
+    # Билетов могут быть миллионы: клиент, сеанс и место - в том же запросе, что и страница,
+    # число строк - оценкой, фильтры - без выборки всех различных значений столбца
+    list_select_related = ('клиент', 'сеанс', 'место')
+    list_filter = ('статус', СеансФильтр, 'сеанс__время_начала', 'дата_покупки')
+    paginator = ОценочныйПагинатор
+    show_full_result_count = False
+    # Поиск только точным совпадением по индексированным полям (см. get_search_results)
+    search_fields = ('=id', '=email_получателя', '=клиент__email', '=клиент__номер_телефона', '=клиент__фамилия')
+    search_help_text = "Номер билета, email, телефон (+7...) или фамилия клиента - точное совпадение"
     raw_id_fields = ('клиент', 'сеанс', 'место')
     # <-- Добавляем email_получателя в readonly, т.к. он задается при покупке -->
-    readonly_fields = ('дата_покупки', 'pdf_файл', 'email_получателя',)
+    readonly_fields = ('дата_покупки', 'pdf_файл', 'email_получателя', 'ошибка_обработки', 'время_прохода')
+    actions = ['print_selected_tickets', 'regenerate_pdf']
+
+    def get_search_results(self, request, queryset, search_term):
+        # Вид запроса определяется по строке, и выполняется один поиск по индексу
+        # вместо OR по всем search_fields (с ним индексы не используются)
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        if '@' in term:
+            return queryset.filter(Q(email_получателя=term)
+                                   | Q(клиент__in=ФизическиеЛица.objects.filter(email=term))), False
+        if term.startswith('+'):
+            return queryset.filter(клиент__in=ФизическиеЛица.objects.filter(номер_телефона=term)), False
+        return queryset.filter(клиент__in=ФизическиеЛица.objects.filter(фамилия=term)), False
+
+    @admin.action(description="Печать выбранных билетов (4 на лист A4)")
+    def print_selected_tickets(self, request, queryset):
+        return _print_tickets_response(queryset, 'tickets.pdf')
+
+    @admin.action(description="Перегенерировать PDF выбранных билетов (в фоне)")
+    def regenerate_pdf(self, request, queryset):
+        created = enqueue_pdf_regeneration(queryset)
+        self.message_user(request, f"Поставлено в очередь заданий на генерацию PDF: {created}. "
+                                   f"Их выполнит воркер (manage.py run_ticket_worker).", messages.SUCCESS)
 
     def pdf_файл_link(self, obj):
         if obj.pdf_файл:
-            return format_html('<a href="{}" target="_blank">Скачать/Посмотреть PDF</a>', obj.pdf_файл.url)
+            # Через API, а не MEDIA_URL: PDF прошедших сеансов лежат в пакетах (storage.py)
+            url = reverse('cinema_tickets:get_ticket_pdf', args=[obj.pk])
+            return format_html('<a href="{}" target="_blank">Скачать/Посмотреть PDF</a>', url)
         return "Еще не сгенерирован"
     pdf_файл_link.short_description = "PDF Билет"
 
-    # Метод save_model остается как был (генерирует PDF при сохранении в админке)
+    # PDF по билету, сохраненному в админке, генерирует воркер: запрос админки его не ждет
     # НЕ добавляем сюда отправку email, чтобы избежать случайных отправок из админки
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
         if obj.pk:
-            try:
-                print(f"Пытаемся сгенерировать PDF для билета ID: {obj.pk} (из админки)")
-                generate_ticket_pdf(obj) # Эта функция теперь будет включать QR/штрихкод
-                print(f"PDF для билета ID: {obj.pk} успешно сгенерирован и сохранен (из админки).")
-            except Exception as e:
-                print(f"Ошибка генерации PDF для билета {obj.pk} через админку: {e}")
-                from django.contrib import messages
-                messages.error(request, f"Не удалось сгенерировать PDF для билета {obj.pk}: {e}")
\ No newline at end of file
+            transaction.on_commit(lambda: enqueue_pdf_regeneration(КупленныеБилеты.objects.filter(pk=obj.pk)))
+            messages.info(request, f"PDF для билета {obj.pk} будет сгенерирован в фоне.")
+
+@admin.register(Заказы)
+class ЗаказыAdmin(admin.ModelAdmin):
+    list_display = ('id', 'клиент', 'сеанс', 'дата_создания', 'email_получателя', 'статус')
+    list_filter = ('статус',)
+    list_select_related = ('клиент', 'сеанс')
+    paginator = ОценочныйПагинатор
+    show_full_result_count = False
+    raw_id_fields = ('клиент', 'сеанс')
+    readonly_fields = ('дата_создания', 'pdf_файл', 'email_получателя', 'ошибка_обработки')
+
+# Архив только для просмотра: билеты попадают в него командой manage.py archive_tickets
+@admin.register(АрхивБилетов)
+class АрхивБилетовAdmin(admin.ModelAdmin):
+    list_display = ('id', 'клиент', 'сеанс', 'место', 'дата_покупки', 'статус', 'дата_архивации')
+    list_select_related = ('клиент', 'сеанс', 'место')
+    paginator = ОценочныйПагинатор
+    show_full_result_count = False
+    search_fields = ('=id', '=email_получателя')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ЗаданияОбработки)
+class ЗаданияОбработкиAdmin(admin.ModelAdmin):
+    list_display = ('id', 'тип', 'билет', 'статус', 'попытки', 'макс_попыток', 'выполнить_после', 'обновлено')
+    list_filter = ('тип', 'статус')
+    list_select_related = ('билет__клиент', 'билет__сеанс')
+    paginator = ОценочныйПагинатор
+    show_full_result_count = False
+    raw_id_fields = ('билет',)
+    readonly_fields = ('создано', 'обновлено', 'последняя_ошибка')
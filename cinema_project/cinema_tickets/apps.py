@@ -4,3 +4,21 @@ from django.apps import AppConfig
 class CinemaTicketsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cinema_tickets'
+
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete
+        from . import checks  # noqa: F401 - регистрирует проверки для manage.py check --deploy
+        from . import metrics, seatmap
+        from .utils import add_stage_observer
+        from .models import КупленныеБилеты, МестаВЗале, СеансыФильмов
+
+        # Инкрементальное обновление закэшированной карты мест
+        post_save.connect(seatmap.ticket_saved, sender=КупленныеБилеты, dispatch_uid='seatmap_ticket_saved')
+        post_delete.connect(seatmap.ticket_deleted, sender=КупленныеБилеты, dispatch_uid='seatmap_ticket_deleted')
+        post_save.connect(seatmap.seats_changed, sender=МестаВЗале, dispatch_uid='seatmap_seats_saved')
+        post_delete.connect(seatmap.seats_changed, sender=МестаВЗале, dispatch_uid='seatmap_seats_deleted')
+        post_save.connect(seatmap.session_saved, sender=СеансыФильмов, dispatch_uid='seatmap_session_saved')
+        post_delete.connect(seatmap.session_saved, sender=СеансыФильмов, dispatch_uid='seatmap_session_deleted')
+
+        # Время стадий генерации PDF и отправки писем - в метрики (/metrics)
+        add_stage_observer(metrics.observe_stage)
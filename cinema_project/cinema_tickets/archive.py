@@ -0,0 +1,99 @@
+# cinema_tickets/archive.py
+"""
+Архив билетов прошедших сеансов.
+
+Почти все запросы к КупленныеБилеты касаются ближайших сеансов, а таблица
+растет с каждой продажей. Команда manage.py archive_tickets переносит билеты
+сеансов, закончившихся давно, в таблицу АрхивБилетов порциями: каждая порция -
+вставка в архив и удаление из рабочей таблицы в одной транзакции, поэтому
+прерванный перенос просто продолжается следующим запуском.
+
+Чтение билета по ID (скачивание PDF, статус) идет через find_ticket: сначала
+рабочая таблица, затем архив - архивные билеты остаются доступными по тем же
+ссылкам. Билеты с невыполненными фоновыми заданиями не переносятся, как и все
+билеты заказа, пока не выполнены его задания: задания заказа привязаны к первому
+билету, а PDF и письмо заказа собираются по всем его билетам.
+
+Уникальность (сеанс, место) в архиве не проверяется, поэтому на закончившиеся
+сеансы билеты не продаются (views.py), а карта мест учитывает и архив (seatmap.py).
+"""
+from datetime import timedelta
+from functools import partial
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .models import АрхивБилетов, ЗаданияОбработки, КупленныеБилеты, СеансыФильмов
+from .seatmap import invalidate_seat_map
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Поля, которые копируются в архив как есть (ID билета сохраняется)
+ARCHIVED_FIELDS = ('id', 'клиент_id', 'сеанс_id', 'место_id', 'дата_покупки', 'pdf_файл', 'email_получателя',
+                   'статус', 'ошибка_обработки', 'заказ_id', 'время_прохода')
+
+_UNFINISHED_JOBS = (ЗаданияОбработки.СТАТУС_ОЖИДАЕТ, ЗаданияОбработки.СТАТУС_ВЫПОЛНЯЕТСЯ,
+                    ЗаданияОбработки.СТАТУС_ОТЛОЖЕНО)
+
+
+def sessions_to_archive(older_than_days, now=None):
+    """Сеансы, закончившиеся больше older_than_days дней назад и еще имеющие билеты в рабочей таблице."""
+    border = (now or timezone.now()) - timedelta(days=older_than_days)
+    return (СеансыФильмов.objects.filter(время_окончания__lt=border,
+                                         pk__in=КупленныеБилеты.objects.values('сеанс_id'))
+            .order_by('время_окончания', 'pk'))
+
+
+def _delete_tickets(ids, using):
+    """
+    Удаляет билеты по id одним DELETE на пачку параметров, без сигналов post_delete
+    и без сбора связанных объектов (задания билетов к этому моменту уже удалены).
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(КупленныеБилеты._meta.db_table)
+    column = connection.ops.quote_name(КупленныеБилеты._meta.pk.column)
+    step = connection.ops.bulk_batch_size([КупленныеБилеты._meta.pk], ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), step):
+            chunk = ids[start:start + step]
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({", ".join(["%s"] * len(chunk))})', chunk)
+
+
+def archive_session(session_id, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Переносит билеты сеанса в архив порциями по batch_size. После каждой
+    порции возвращает (yield) число перенесенных в ней билетов.
+    Если билет с тем же ID уже есть в архиве, выбрасывается IntegrityError
+    и порция не переносится: рабочая строка не удаляется, пока ее копии нет в архиве.
+    """
+    unfinished = ЗаданияОбработки.objects.filter(статус__in=_UNFINISHED_JOBS)
+    tickets = (КупленныеБилеты.objects.filter(сеанс_id=session_id)
+               .exclude(задания__статус__in=_UNFINISHED_JOBS)
+               .exclude(заказ_id__in=unfinished.filter(билет__заказ_id__isnull=False).values('билет__заказ_id'))
+               .order_by('pk'))
+    last_id = 0
+    using = router.db_for_write(КупленныеБилеты)
+    while True:
+        with transaction.atomic(using=using):
+            rows = list(tickets.filter(pk__gt=last_id).values(*ARCHIVED_FIELDS)[:batch_size])
+            if not rows:
+                return
+            АрхивБилетов.objects.using(using).bulk_create([АрхивБилетов(**row) for row in rows])
+            ids = [row['id'] for row in rows]
+            # Задания перенесенных билетов (все выполнены) удаляются вместе с ними. Билеты
+            # удаляются без сигналов post_delete: они сбросили бы карту мест по разу на
+            # билет, а карта сбрасывается один раз на порцию
+            ЗаданияОбработки.objects.using(using).filter(билет_id__in=ids).delete()
+            _delete_tickets(ids, using)
+            transaction.on_commit(partial(invalidate_seat_map, session_id), using=using)
+        last_id = ids[-1]
+        yield len(rows)
+
+
+def find_ticket(ticket_id, related=()):
+    """Билет по ID из рабочей таблицы или из архива; None, если его нет нигде."""
+    for model in (КупленныеБилеты, АрхивБилетов):
+        билет = model.objects.select_related(*related).filter(pk=ticket_id).first()
+        if билет is not None:
+            return билет
+    return None
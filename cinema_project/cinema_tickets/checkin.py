@@ -0,0 +1,142 @@
+# cinema_tickets/checkin.py
+"""
+Проход по билетам на входе в зал (штрихкод TICKET-<id> или QR с токеном из qrtoken.py).
+
+Для каждого сеанса в кэше хранится компактный индекс билетов: отсортированный
+массив ID, номера мест и время прохода (0 - еще не проходил), всего 20 байт на
+билет. Скан отвечается из индекса: бинарный поиск по ID, без запроса к
+КупленныеБилеты. Индекс строится одним запросом - заранее командой
+manage.py preload_checkin для ближайших сеансов или при первом скане.
+
+Индекс только отсекает чужие билеты и проходы, уже записанные в БД при его
+построении. Решает же, пускать ли, сама БД: отметка прохода - условный
+UPDATE ... SET время_прохода WHERE id AND время_прохода IS NULL, и пропущен
+тот, у кого UPDATE изменил строку. Так один билет не пропустят и два
+контролера сразу, даже если сканы пришли в разные процессы, а отметка не
+теряется, если процесс упал сразу после ответа сканеру.
+
+Индекс живет в кэше 'default'; чтобы preload_checkin имел смысл, кэш должен
+быть общим для процессов (при локальной памяти индекс строится в каждом
+процессе при первом скане).
+"""
+import re
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.cache import cache
+
+from .models import КупленныеБилеты
+from .qrtoken import decode_token, НеверныйТокен
+
+# Индекс и ключи прохода живут дольше любого сеанса
+CHECKIN_TIMEOUT = 12 * 60 * 60
+
+_CODE_RE = re.compile(r'^(?:TICKET-)?(\d+)$', re.IGNORECASE)
+
+
+class НеверныйКод(ValueError):
+    """Отсканированная строка не похожа на код билета."""
+
+
+class РезультатПрохода:
+    ПРОПУЩЕН = 'admitted'
+    УЖЕ_ПРОШЕЛ = 'already_admitted'
+    НЕ_НАЙДЕН = 'not_found'
+
+    def __init__(self, result, ticket_id, seat_number=None, admitted_at=None):
+        self.result = result
+        self.ticket_id = ticket_id
+        self.seat_number = seat_number
+        self.admitted_at = admitted_at
+
+
+def parse_code(code):
+    """
+    (ID билета, ID сеанса или None) из штрихкода "TICKET-<id>", номера билета
+    или QR-токена. У токена проверяются подпись и срок действия.
+    """
+    match = _CODE_RE.match(str(code).strip())
+    if match:
+        return int(match.group(1)), None
+    try:
+        token = decode_token(code)
+    except НеверныйТокен as e:
+        raise НеверныйКод(f'Неизвестный формат кода: {code} ({e})')
+    return token.ticket_id, token.session_id
+
+
+def _index_key(session_id):
+    return f'checkin:index:{session_id}'
+
+
+def _timestamp(moment):
+    return int(moment.timestamp()) if moment else 0
+
+
+def _from_timestamp(seconds):
+    return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+
+
+def build_index(session_id):
+    """
+    Строит индекс сеанса одним запросом и кладет его в кэш.
+    Возвращает построенные массивы (ID, места, время прохода).
+    """
+    rows = (КупленныеБилеты.objects.filter(сеанс_id=session_id).order_by('pk')
+            .values_list('pk', 'место__номер_места', 'время_прохода'))
+    ids, seats, entered = array('Q'), array('I'), array('q')
+    for pk, seat_number, admitted_at in rows:
+        ids.append(pk)
+        seats.append(seat_number)
+        entered.append(_timestamp(admitted_at))
+    index = (ids.tobytes(), seats.tobytes(), entered.tobytes())
+    cache.set(_index_key(session_id), index, CHECKIN_TIMEOUT)
+    return ids, seats, entered
+
+
+def invalidate_index(session_id):
+    """Сбрасывает индекс сеанса (продажа, возврат): он перестроится при следующем скане."""
+    cache.delete(_index_key(session_id))
+
+
+def _get_index(session_id):
+    index = cache.get(_index_key(session_id))
+    if index is None:
+        # Построенные массивы используются сразу: кэш мог и не принять индекс
+        # (ограничение размера значения, вытеснение)
+        return build_index(session_id)
+    ids, seats, entered = (memoryview(part) for part in index)
+    return ids.cast('Q'), seats.cast('I'), entered.cast('q')
+
+
+def check_in(session_id, code, now=None):
+    """
+    Проход по билету на сеанс. Возвращает РезультатПрохода; для испорченного кода
+    выбрасывает НеверныйКод. Чужой билет и повторный проход, известный индексу,
+    отсекаются без БД; пропуск - один условный UPDATE.
+    """
+    ticket_id, token_session_id = parse_code(code)
+    if token_session_id is not None and token_session_id != session_id:
+        return РезультатПрохода(РезультатПрохода.НЕ_НАЙДЕН, ticket_id)
+    ids, seats, entered = _get_index(session_id)
+    position = bisect_left(ids, ticket_id)
+    if position == len(ids) or ids[position] != ticket_id:
+        return РезультатПрохода(РезультатПрохода.НЕ_НАЙДЕН, ticket_id)
+    seat_number = seats[position]
+    if entered[position]:
+        return РезультатПрохода(РезультатПрохода.УЖЕ_ПРОШЕЛ, ticket_id, seat_number,
+                                _from_timestamp(entered[position]))
+
+    admitted_at = _from_timestamp(int(now or time.time()))
+    admitted = КупленныеБилеты.objects.filter(pk=ticket_id, сеанс_id=session_id,
+                                             время_прохода__isnull=True).update(время_прохода=admitted_at)
+    if admitted:
+        return РезультатПрохода(РезультатПрохода.ПРОПУЩЕН, ticket_id, seat_number, admitted_at)
+    # Билет прошел после построения индекса (или его уже нет в рабочей таблице)
+    first = (КупленныеБилеты.objects.filter(pk=ticket_id, сеанс_id=session_id)
+             .values_list('время_прохода', flat=True).first())
+    if first is None:
+        return РезультатПрохода(РезультатПрохода.НЕ_НАЙДЕН, ticket_id)
+    return РезультатПрохода(РезультатПрохода.УЖЕ_ПРОШЕЛ, ticket_id, seat_number, first)
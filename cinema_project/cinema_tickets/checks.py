@@ -0,0 +1,49 @@
+# cinema_tickets/checks.py
+"""
+Проверки конфигурации (manage.py check и check --deploy).
+
+Удержания мест (holds.py) исключают друг друга через атомарный cache.add, поэтому
+при нескольких процессах приложения кэш 'default' должен быть общим для всех
+процессов. Локальная память у каждого процесса своя, DummyCache ничего не хранит,
+а у файлового кэша add не атомарен - с ними одно место могут удержать двое.
+
+Компактный профиль PDF (pdfcompact.py) с непроверенной версией ReportLab
+отключается - об этом предупреждает check_pdf_profile.
+"""
+import reportlab
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+from .pdfcompact import COMPACT_REPORTLAB_VERSIONS, compact_supported, pdf_profile
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Error(
+        f'Кэш default ({backend}) не общий для процессов приложения: удержания мест '
+        f'не исключают друг друга между процессами.',
+        hint="Используйте общий кэш, например 'django.core.cache.backends.redis.RedisCache'. "
+             "Если приложение работает в одном процессе, добавьте проверку в SILENCED_SYSTEM_CHECKS.",
+        id='cinema_tickets.E001',
+    )]
+
+
+@register()
+def check_pdf_profile(app_configs, **kwargs):
+    if pdf_profile() != 'compact' or compact_supported():
+        return []
+    return [Warning(
+        f'TICKET_PDF_PROFILE = "compact" не проверен с ReportLab {reportlab.Version}: '
+        f'PDF билетов рисуются по профилю "standard".',
+        hint=f'Проверенные версии ReportLab: {", ".join(COMPACT_REPORTLAB_VERSIONS)}.',
+        id='cinema_tickets.W001',
+    )]
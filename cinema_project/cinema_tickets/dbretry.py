@@ -0,0 +1,63 @@
+# cinema_tickets/dbretry.py
+"""
+Повтор коротких транзакций записи при конкуренции за блокировку SQLite.
+
+Даже в режиме WAL писатель в SQLite один. Если блокировку не удалось получить
+за busy_timeout, драйвер выбрасывает OperationalError "database is locked".
+Транзакция покупки короткая и идемпотентна до коммита, поэтому ее безопасно
+повторить после небольшой паузы; задержка растет экспоненциально и случайно
+"размазывается", чтобы повторы конкурентов не совпадали по времени.
+"""
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+from .metrics import db_lock_errors
+
+_LOCK_MESSAGES = ('database is locked', 'database table is locked')
+
+
+class БДПерегружена(Exception):
+    """Блокировку БД не удалось получить за все попытки."""
+
+
+def is_lock_error(exc):
+    return isinstance(exc, OperationalError) and any(message in str(exc) for message in _LOCK_MESSAGES)
+
+
+def lock_retry_delay(attempt):
+    """Пауза перед повтором номер attempt (с 1): "полный" случайный разброс до экспоненциальной границы."""
+    base = getattr(settings, 'DB_LOCK_RETRY_BASE_DELAY', 0.02)
+    cap = getattr(settings, 'DB_LOCK_RETRY_MAX_DELAY', 0.5)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry_on_lock(func=None, *, using=DEFAULT_DB_ALIAS):
+    """
+    Декоратор: при "database is locked" повторяет функцию (целиком, вместе с ее
+    transaction.atomic) до DB_LOCK_RETRY_ATTEMPTS раз, затем выбрасывает БДПерегружена.
+    Внутри внешней транзакции не повторяет - откатить и повторить можно только ее целиком.
+    """
+    if func is None:
+        return functools.partial(retry_on_lock, using=using)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        attempts = max(1, getattr(settings, 'DB_LOCK_RETRY_ATTEMPTS', 5))
+        for attempt in range(1, attempts + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if not is_lock_error(e) or connections[using].in_atomic_block:
+                    raise
+                if attempt == attempts:
+                    db_lock_errors.inc(outcome='gave_up')
+                    raise БДПерегружена(f"БД занята, транзакция не выполнена за {attempts} попыток.") from e
+                db_lock_errors.inc(outcome='retried')
+                delay = lock_retry_delay(attempt)
+                print(f"БД занята ({func.__name__}), повтор {attempt}/{attempts - 1} через {delay * 1000:.0f} мс")
+                time.sleep(delay)
+    return wrapper
@@ -0,0 +1,37 @@
+# cinema_tickets/dbstats.py
+"""
+Оценка числа строк больших таблиц без COUNT(*) по статистике БД.
+
+Полный COUNT(*) по таблице билетов просматривает ее целиком, поэтому списки
+админки берут оценку из статистики планировщика: reltuples в PostgreSQL,
+sqlite_stat1 в SQLite. Статистику обновляет ANALYZE - его вызывает
+archive_tickets после переноса билетов в архив.
+"""
+from django.db import OperationalError, connection
+
+
+def estimated_row_count(model):
+    """Быстрая оценка числа строк таблицы без COUNT(*) или None, если для этой БД оценки нет."""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        return max(row[0], 0) if row else None
+    if connection.vendor == 'sqlite':
+        # Статистика последнего ANALYZE: первое число в sqlite_stat1 - строк в индексе,
+        # у полного индекса (и у таблицы без индексов) это число строк таблицы.
+        # Максимальный id не годится: archive_tickets удаляет билеты миллионами
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [model._meta.db_table])
+            except OperationalError:
+                return None  # ANALYZE ни разу не выполнялся
+            rows = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+        return max(rows) if rows else None
+    return None
+
+
+def refresh_row_estimate(model):
+    """Обновляет статистику таблицы для estimated_row_count (после массового удаления строк)."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
@@ -0,0 +1,139 @@
+# cinema_tickets/downloads.py
+"""
+Отдача сохраненных PDF (билеты, заказы) без загрузки файла в память.
+
+- файл стримится кусками (FileResponse / StreamingHttpResponse);
+- строгий ETag и Last-Modified, условные GET отвечают 304;
+- поддерживается один диапазон Range: bytes=... (ответ 206);
+- опционально отдача перекладывается на фронтовой сервер
+  через X-Sendfile (Apache) или X-Accel-Redirect (nginx).
+"""
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+from .storage import is_packed
+
+CHUNK_SIZE = 64 * 1024
+
+# Билеты персональные: кэшировать можно только в браузере, с перепроверкой по ETag
+CACHE_CONTROL = 'private, max-age=300'
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _etag(size, modified):
+    # Файл PDF никогда не дописывается на месте: при перегенерации меняется
+    # время изменения, поэтому пара (размер, mtime) однозначно задает содержимое
+    return f'"{size:x}-{int(modified.timestamp() * 1_000_000):x}"'
+
+
+def _parse_range(header, size):
+    """
+    Разбирает заголовок Range. Возвращает (start, end) включительно,
+    None - если диапазон не задан или не поддерживается (отдаем файл целиком),
+    'unsatisfiable' - если диапазон за пределами файла.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        # Нет заголовка или несколько диапазонов - по RFC 9110 можно отдать весь файл
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N - последние N байт
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return 'unsatisfiable'
+    return start, end
+
+
+def _not_modified(request, etag, modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return if_modified_since is not None and int(modified.timestamp()) <= if_modified_since
+
+
+def _iter_range(file, start, length):
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def _sendfile_response(field_file, mode):
+    response = HttpResponse(content_type='application/pdf')
+    if mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'TICKET_PDF_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + field_file.name.lstrip('/')
+    else:
+        response['X-Sendfile'] = field_file.path
+    return response
+
+
+def serve_stored_file(request, field_file, filename):
+    """
+    Отдает файл из FileField. FileNotFoundError пробрасывается вызывающему коду.
+    """
+    storage = field_file.storage
+    size = storage.size(field_file.name)
+    modified = storage.get_modified_time(field_file.name)
+    etag = _etag(size, modified)
+
+    def with_validators(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified.timestamp())
+        response['Cache-Control'] = CACHE_CONTROL
+        return response
+
+    if _not_modified(request, etag, modified):
+        return with_validators(HttpResponseNotModified())
+
+    sendfile_mode = getattr(settings, 'TICKET_PDF_SENDFILE', None)
+    # PDF из пакета (storage.py) не отдельный файл - его фронтовой сервер отдать не может
+    if sendfile_mode and not is_packed(field_file.name):
+        # Диапазоны и условные запросы дальше обработает фронтовой сервер
+        response = with_validators(_sendfile_response(field_file, sendfile_mode))
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+        return response
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range.strip() == etag:
+        byte_range = _parse_range(request.headers.get('Range'), size)
+
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return with_validators(response)
+
+    file = field_file.storage.open(field_file.name, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type='application/pdf')
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_iter_range(file, start, end - start + 1),
+                                         status=206, content_type='application/pdf')
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = f'inline; filename="{filename}"'
+    return with_validators(response)
@@ -0,0 +1,149 @@
+# cinema_tickets/holds.py
+"""
+Временное удержание мест (hold) перед покупкой.
+
+Удержания хранятся в кэше Django: ключ на каждое место сеанса создается
+атомарным cache.add, поэтому из нескольких покупателей место получает только
+один, а остальные получают отказ еще до обращения к таблице КупленныеБилеты.
+Просроченные удержания удаляет сам кэш по TTL - отдельный процесс-чистильщик
+не нужен, и место освобождается даже если клиент пропал.
+
+Взаимное исключение работает только при общем для всех процессов кэше
+(Redis, Memcached) - см. checks.py и manage.py check --deploy.
+"""
+import math
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+# Удержание, которое покупка без hold_token берет на время своей транзакции
+PURCHASE_HOLD_TTL = 30
+
+# Ближе этого срока (секунды) к истечению удержание не снимается досрочно,
+# а дожидается TTL (см. Удержание.release)
+RELEASE_MARGIN = 2
+
+
+class МестаУдерживаются(Exception):
+    """Часть мест уже удерживается другим покупателем."""
+
+    def __init__(self, seat_numbers):
+        self.seat_numbers = sorted(seat_numbers)
+        super().__init__(f"Места {', '.join(map(str, self.seat_numbers))} временно удерживаются.")
+
+
+class НеверноеУдержание(Exception):
+    """Удержание не найдено, истекло или не покрывает запрошенные места."""
+
+
+def hold_ttl():
+    return getattr(settings, 'SEAT_HOLD_TTL', 5 * 60)
+
+
+def _seat_key(session_id, seat_number):
+    return f'hold:seat:{session_id}:{seat_number}'
+
+
+def _token_key(token):
+    return f'hold:token:{token}'
+
+
+class Удержание:
+    """Удержанные места одного покупателя."""
+
+    def __init__(self, token, session_id, seat_numbers, expires_at, implicit=False):
+        self.token = token
+        self.session_id = session_id
+        self.seat_numbers = sorted(seat_numbers)
+        self.expires_at = expires_at
+        # Неявное удержание берет сама покупка; оно снимается при любом исходе
+        self.implicit = implicit
+
+    def release(self, seat_numbers=None):
+        """
+        Снимает удержание мест seat_numbers (по умолчанию - всех мест удержания),
+        только тех, что все еще принадлежат этому токену. Если в удержании
+        остаются другие места, токен действует для них до прежнего срока:
+        покупка части мест не отдает остальные другим покупателям.
+
+        Ключ места удаляет либо его владелец, либо TTL. Пока до истечения больше
+        RELEASE_MARGIN секунд, ключ с нашим токеном не может между get_many и
+        delete_many истечь и достаться другому покупателю, так что удаляется
+        только свое. Ближе к сроку места не трогаем - их освободит TTL.
+        """
+        if seat_numbers is None:
+            released = self.seat_numbers
+        else:
+            wanted = {str(n) for n in seat_numbers}
+            released = [n for n in self.seat_numbers if str(n) in wanted]
+        remaining = [n for n in self.seat_numbers if n not in released]
+        left = (self.expires_at - timezone.now()).total_seconds()
+        if left > RELEASE_MARGIN:
+            keys = [_seat_key(self.session_id, n) for n in released]
+            owned = [key for key, value in cache.get_many(keys).items() if value == self.token]
+            cache.delete_many(owned)
+        if remaining and not self.implicit and left > 0:
+            cache.set(_token_key(self.token), {'session_id': self.session_id, 'seats': remaining,
+                                               'expires_at': self.expires_at}, math.ceil(left))
+        else:
+            cache.delete(_token_key(self.token))
+        self.seat_numbers = remaining
+
+
+def create_hold(session_id, seat_numbers, ttl=None, implicit=False):
+    """
+    Удерживает места сеанса на ttl секунд. Либо все места, либо ни одного:
+    если хотя бы одно место уже удерживается, выбрасывает МестаУдерживаются.
+    """
+    ttl = ttl or hold_ttl()
+    token = secrets.token_urlsafe(16)
+    # Срок считается до cache.add, чтобы ключи мест не истекли раньше него
+    expires_at = timezone.now() + timedelta(seconds=ttl)
+    acquired, busy = [], []
+    for seat_number in seat_numbers:
+        if cache.add(_seat_key(session_id, seat_number), token, ttl):
+            acquired.append(seat_number)
+        else:
+            busy.append(seat_number)
+    if busy:
+        cache.delete_many([_seat_key(session_id, n) for n in acquired])
+        raise МестаУдерживаются(busy)
+
+    if not implicit:
+        cache.set(_token_key(token), {'session_id': session_id, 'seats': list(seat_numbers),
+                                      'expires_at': expires_at}, ttl)
+    return Удержание(token, session_id, seat_numbers, expires_at, implicit=implicit)
+
+
+def get_hold(token):
+    """Возвращает действующее удержание по токену или выбрасывает НеверноеУдержание."""
+    data = cache.get(_token_key(token)) if token else None
+    if data is None:
+        raise НеверноеУдержание("Удержание не найдено или истекло.")
+    return Удержание(token, data['session_id'], data['seats'], data['expires_at'])
+
+
+def acquire_for_purchase(session_id, seat_numbers, token=None):
+    """
+    Проверка удержания перед покупкой.
+    С токеном - удержание должно принадлежать покупателю и покрывать все места.
+    Без токена - места удерживаются неявно на время покупки, чтобы конкуренты
+    за то же место отсеивались здесь, а не на вставке в таблицу билетов.
+    """
+    if not token:
+        return create_hold(session_id, seat_numbers, ttl=PURCHASE_HOLD_TTL, implicit=True)
+
+    hold = get_hold(token)
+    if str(hold.session_id) != str(session_id):
+        raise НеверноеУдержание("Удержание оформлено на другой сеанс.")
+    keys = {_seat_key(hold.session_id, n): n for n in seat_numbers}
+    owners = cache.get_many(list(keys))
+    not_owned = [n for key, n in keys.items() if owners.get(key) != token]
+    if not_owned:
+        raise НеверноеУдержание(
+            f"Места {', '.join(map(str, sorted(not_owned)))} не входят в удержание или оно истекло."
+        )
+    return hold
@@ -0,0 +1,403 @@
+# cinema_tickets/jobs.py
+"""
+Фоновая обработка билетов через очередь заданий в БД (модель ЗаданияОбработки).
+
+Покупка только ставит задания в очередь, а генерацию PDF и отправку email
+выполняет команда manage.py run_ticket_worker. Неудачные задания повторяются
+с экспоненциальной задержкой, после исчерпания попыток помечаются как "мертвые".
+Задания отправки email воркер забирает пачками и отправляет через одно
+соединение с почтовым сервером (см. outbox.ПочтовыйЯщик).
+"""
+import random
+import traceback
+from datetime import timedelta
+from itertools import islice
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import КупленныеБилеты, Заказы, ЗаданияОбработки, СеансыФильмов
+from .outbox import ПочтовыйЯщик, email_batch_size, notify_session_change, session_recipients
+from .utils import (
+    build_order_email, build_ticket_email, ensure_ticket_pdf, ensure_order_pdf,
+    generate_order_pdf, generate_ticket_pdf, pdf_lazy_mode,
+)
+
+# Базовая задержка перед повтором (секунды) и ее верхняя граница
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 15 * 60
+# Задание в статусе "выполняется" дольше этого времени считается брошенным
+# (воркер упал) и снова становится доступным для выполнения
+STALE_JOB_TIMEOUT = timedelta(minutes=10)
+# Задания, которые воркер отправляет пачкой через одно соединение
+EMAIL_JOB_TYPES = (ЗаданияОбработки.ТИП_EMAIL, ЗаданияОбработки.ТИП_EMAIL_ЗАКАЗА)
+
+
+class ОшибкаЗадания(Exception):
+    """Ошибка выполнения задания, после которой задание нужно повторить."""
+
+
+class ЗаданиеНеГотово(ОшибкаЗадания):
+    """Задание ждет результата другого задания (например, email ждет PDF)."""
+
+
+def enqueue_ticket_jobs(ticket, recipient_email=None):
+    """
+    Ставит в очередь генерацию PDF и отправку email для билета.
+    Вызывается внутри транзакции покупки, поэтому задания появятся
+    только вместе с самим билетом.
+    """
+    jobs = []
+    # В ленивом режиме PDF создается при первом обращении (скачивание или email)
+    if not pdf_lazy_mode():
+        jobs.append(ЗаданияОбработки(тип=ЗаданияОбработки.ТИП_PDF, билет=ticket))
+    recipient_email = recipient_email or ticket.email_получателя
+    if recipient_email:
+        jobs.append(ЗаданияОбработки(
+            тип=ЗаданияОбработки.ТИП_EMAIL,
+            билет=ticket,
+            параметры={'email': recipient_email},
+        ))
+    return ЗаданияОбработки.objects.bulk_create(jobs)
+
+
+def enqueue_order_jobs(order, tickets, recipient_email=None):
+    """
+    Ставит в очередь генерацию одного PDF на весь заказ и одно письмо.
+    Задания привязаны к первому билету заказа, чтобы их было видно из билета.
+    """
+    params = {'order_id': order.id}
+    first_ticket = min(tickets, key=lambda ticket: ticket.pk)
+    jobs = []
+    if not pdf_lazy_mode():
+        jobs.append(ЗаданияОбработки(тип=ЗаданияОбработки.ТИП_PDF_ЗАКАЗА, билет=first_ticket, параметры=params))
+    recipient_email = recipient_email or order.email_получателя
+    if recipient_email:
+        jobs.append(ЗаданияОбработки(
+            тип=ЗаданияОбработки.ТИП_EMAIL_ЗАКАЗА,
+            билет=first_ticket,
+            параметры={**params, 'email': recipient_email},
+        ))
+    return ЗаданияОбработки.objects.bulk_create(jobs)
+
+
+def enqueue_session_notification(session, message=''):
+    """Ставит в очередь рассылку об изменении сеанса всем держателям билетов."""
+    return ЗаданияОбработки.objects.create(
+        тип=ЗаданияОбработки.ТИП_УВЕДОМЛЕНИЕ_СЕАНСА,
+        параметры={'session_id': session.pk, 'message': message},
+    )
+
+
+def enqueue_pdf_regeneration(tickets, chunk_size=1000):
+    """
+    Ставит в очередь перегенерацию PDF билетов из queryset tickets (для билетов
+    заказа - одну перегенерацию общего PDF заказа). Билеты и заказы, PDF которых
+    уже ждет в очереди, пропускаются. Возвращает число созданных заданий.
+    """
+    waiting = [ЗаданияОбработки.СТАТУС_ОЖИДАЕТ, ЗаданияОбработки.СТАТУС_ОТЛОЖЕНО]
+    queued_orders = {params.get('order_id') for params in ЗаданияОбработки.objects.filter(
+        тип=ЗаданияОбработки.ТИП_PDF_ЗАКАЗА, статус__in=waiting).values_list('параметры', flat=True)}
+    created = 0
+    rows = tickets.order_by().values_list('id', 'заказ_id').iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        queued_tickets = set(ЗаданияОбработки.objects.filter(
+            тип=ЗаданияОбработки.ТИП_PDF, статус__in=waiting, билет_id__in=[ticket_id for ticket_id, _ in chunk]
+        ).values_list('билет_id', flat=True))
+        jobs = []
+        for ticket_id, order_id in chunk:
+            if order_id is not None:
+                if order_id not in queued_orders:
+                    queued_orders.add(order_id)
+                    jobs.append(ЗаданияОбработки(тип=ЗаданияОбработки.ТИП_PDF_ЗАКАЗА, билет_id=ticket_id,
+                                                 параметры={'order_id': order_id}))
+            elif ticket_id not in queued_tickets:
+                jobs.append(ЗаданияОбработки(тип=ЗаданияОбработки.ТИП_PDF, билет_id=ticket_id))
+        ЗаданияОбработки.objects.bulk_create(jobs)
+        created += len(jobs)
+    return created
+
+
+def retry_delay(attempt):
+    """Экспоненциальная задержка с небольшим случайным разбросом."""
+    delay = min(RETRY_BASE_DELAY * (2 ** max(attempt - 1, 0)), RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim_job(ticket_id=None, types=None):
+    """
+    Забирает одно готовое к выполнению задание (при ticket_id - только этого билета,
+    при types - только заданий этих типов).
+    Захват делается условным UPDATE, поэтому несколько воркеров
+    (потоков или процессов) не получат одно и то же задание.
+    """
+    now = timezone.now()
+    ready = ЗаданияОбработки.objects.filter(
+        Q(статус__in=[ЗаданияОбработки.СТАТУС_ОЖИДАЕТ, ЗаданияОбработки.СТАТУС_ОТЛОЖЕНО],
+          выполнить_после__lte=now)
+        | Q(статус=ЗаданияОбработки.СТАТУС_ВЫПОЛНЯЕТСЯ, обновлено__lt=now - STALE_JOB_TIMEOUT)
+    ).order_by('выполнить_после', 'id')
+    if ticket_id is not None:
+        ready = ready.filter(билет_id=ticket_id)
+    if types is not None:
+        ready = ready.filter(тип__in=types)
+
+    for job_id, status in ready.values_list('id', 'статус')[:10]:
+        claimed = ЗаданияОбработки.objects.filter(pk=job_id, статус=status).update(
+            статус=ЗаданияОбработки.СТАТУС_ВЫПОЛНЯЕТСЯ,
+            обновлено=now,
+        )
+        if claimed:
+            return ЗаданияОбработки.objects.select_related(
+                'билет__клиент', 'билет__сеанс', 'билет__место'
+            ).get(pk=job_id)
+    return None
+
+
+def _handle_render(job):
+    ticket = job.билет
+    generate_ticket_pdf(ticket)
+    # Не понижаем статус, если email уже успел уйти
+    КупленныеБилеты.objects.filter(pk=ticket.pk, статус=КупленныеБилеты.СТАТУС_ОЖИДАЕТ).update(
+        статус=КупленныеБилеты.СТАТУС_PDF_ГОТОВ
+    )
+
+
+def _prepare_ticket_email(job):
+    """Готовит письмо с билетом. Возвращает (письмо, действие после успешной отправки)."""
+    ticket = job.билет
+    if not ticket.pdf_файл:
+        if not pdf_lazy_mode():
+            # PDF генерируется отдельным заданием, ждем его
+            raise ЗаданиеНеГотово(f"PDF для билета {ticket.id} еще не сгенерирован.")
+        ensure_ticket_pdf(ticket)
+    recipient_email = job.параметры.get('email') or ticket.email_получателя
+    if not recipient_email:
+        raise ОшибкаЗадания(f"Email для билета {ticket.id} не указан.")
+
+    def mark_sent():
+        КупленныеБилеты.objects.filter(pk=ticket.pk).update(
+            статус=КупленныеБилеты.СТАТУС_ОТПРАВЛЕН, ошибка_обработки=''
+        )
+    return build_ticket_email(ticket, recipient_email), mark_sent
+
+
+def _set_order_status(order, status, error=''):
+    Заказы.objects.filter(pk=order.pk).update(статус=status, ошибка_обработки=error)
+    КупленныеБилеты.objects.filter(заказ_id=order.pk).update(статус=status, ошибка_обработки=error)
+
+
+def _handle_render_order(job):
+    order = Заказы.objects.select_related('клиент', 'сеанс').get(pk=job.параметры['order_id'])
+    generate_order_pdf(order)
+    if order.статус == КупленныеБилеты.СТАТУС_ОЖИДАЕТ:
+        _set_order_status(order, КупленныеБилеты.СТАТУС_PDF_ГОТОВ)
+
+
+def _prepare_order_email(job):
+    order = Заказы.objects.select_related('клиент', 'сеанс').get(pk=job.параметры['order_id'])
+    if not order.pdf_файл:
+        if not pdf_lazy_mode():
+            raise ЗаданиеНеГотово(f"PDF для заказа {order.id} еще не сгенерирован.")
+        ensure_order_pdf(order)
+    recipient_email = job.параметры.get('email') or order.email_получателя
+    if not recipient_email:
+        raise ОшибкаЗадания(f"Email для заказа {order.id} не указан.")
+
+    def mark_sent():
+        _set_order_status(order, КупленныеБилеты.СТАТУС_ОТПРАВЛЕН)
+    return build_order_email(order, recipient_email), mark_sent
+
+
+# Подготовка писем по типу задания
+ПИСЬМА = {
+    ЗаданияОбработки.ТИП_EMAIL: _prepare_ticket_email,
+    ЗаданияОбработки.ТИП_EMAIL_ЗАКАЗА: _prepare_order_email,
+}
+
+
+def _handle_email(job):
+    """Одиночная отправка (режим TICKET_JOBS_EAGER); воркер использует run_email_batch."""
+    message, mark_sent = ПИСЬМА[job.тип](job)
+    outbox = ПочтовыйЯщик()
+    outbox.add(message, key=job.id)
+    [(_, error)] = outbox.flush()
+    if error:
+        raise ОшибкаЗадания(f"Не удалось отправить email: {error}")
+    mark_sent()
+
+
+def _handle_notify_session(job):
+    """
+    Рассылка об изменении сеанса. Адреса, на которые письмо не ушло,
+    сохраняются в параметрах задания, и повтор отправляет только им.
+    """
+    session = СеансыФильмов.objects.get(pk=job.параметры['session_id'])
+    emails = job.параметры.get('emails')
+    if emails is None:
+        emails = session_recipients(session)
+    outbox = notify_session_change(session, job.параметры.get('message', ''), emails=emails)
+    failed = [email for email, error in outbox.results if error]
+    print(f"Рассылка по сеансу {session.id}: отправлено {outbox.sent}, ошибок {outbox.failed} "
+          f"({outbox.rate:.1f} писем/с)")
+    if failed:
+        job.параметры['emails'] = failed
+        job.save(update_fields=['параметры'])
+        raise ОшибкаЗадания(f"Не отправлено писем: {len(failed)} из {len(emails)}.")
+
+
+# Обработчики по типу задания
+ОБРАБОТЧИКИ = {
+    ЗаданияОбработки.ТИП_PDF: _handle_render,
+    ЗаданияОбработки.ТИП_EMAIL: _handle_email,
+    ЗаданияОбработки.ТИП_PDF_ЗАКАЗА: _handle_render_order,
+    ЗаданияОбработки.ТИП_EMAIL_ЗАКАЗА: _handle_email,
+    ЗаданияОбработки.ТИП_УВЕДОМЛЕНИЕ_СЕАНСА: _handle_notify_session,
+}
+
+
+def _fail_job(job, e):
+    """Записывает ошибку задания: повтор позже или, если попытки исчерпаны, "мертвое"."""
+    job.попытки += 1
+    job.последняя_ошибка = ''.join(traceback.format_exception_only(type(e), e)).strip()
+    ticket_update = {}
+    if not isinstance(e, ЗаданиеНеГотово):
+        ticket_update['ошибка_обработки'] = job.последняя_ошибка
+    if job.попытки >= job.макс_попыток:
+        job.статус = ЗаданияОбработки.СТАТУС_МЕРТВОЕ
+        print(f"Задание {job.id} не выполнено после {job.попытки} попыток: {e}")
+        ticket_update['статус'] = КупленныеБилеты.СТАТУС_ОШИБКА
+        ticket_update.setdefault('ошибка_обработки', job.последняя_ошибка)
+    else:
+        job.статус = ЗаданияОбработки.СТАТУС_ОТЛОЖЕНО
+        job.выполнить_после = timezone.now() + retry_delay(job.попытки)
+        print(f"Задание {job.id} завершилось ошибкой (попытка {job.попытки}), повтор позже: {e}")
+    job.save(update_fields=['попытки', 'последняя_ошибка', 'статус', 'выполнить_после', 'обновлено'])
+    # Ошибка видна клиенту в статусе билета; сама покупка остается в силе
+    if ticket_update:
+        order_id = job.параметры.get('order_id')
+        if order_id:
+            Заказы.objects.filter(pk=order_id).update(**ticket_update)
+            КупленныеБилеты.objects.filter(заказ_id=order_id).update(**ticket_update)
+        elif job.билет_id:
+            КупленныеБилеты.objects.filter(pk=job.билет_id).update(**ticket_update)
+
+
+def _complete_job(job):
+    job.попытки += 1
+    job.статус = ЗаданияОбработки.СТАТУС_ВЫПОЛНЕНО
+    job.последняя_ошибка = ''
+    job.save(update_fields=['попытки', 'последняя_ошибка', 'статус', 'обновлено'])
+
+
+def _release_job(job):
+    ЗаданияОбработки.objects.filter(pk=job.pk, статус=ЗаданияОбработки.СТАТУС_ВЫПОЛНЯЕТСЯ).update(
+        статус=ЗаданияОбработки.СТАТУС_ОЖИДАЕТ, выполнить_после=timezone.now(), обновлено=timezone.now()
+    )
+
+
+def run_job(job):
+    """
+    Выполняет задание и сохраняет результат.
+    Возвращает True, если задание выполнено успешно.
+    """
+    handler = ОБРАБОТЧИКИ.get(job.тип)
+    try:
+        if handler is None:
+            raise ОшибкаЗадания(f"Неизвестный тип задания: {job.тип}")
+        handler(job)
+    except Exception as e:
+        _fail_job(job, e)
+        return False
+    _complete_job(job)
+    return True
+
+
+def run_email_batch(first_job, batch_size=None):
+    """
+    Выполняет задание отправки email вместе с другими готовыми заданиями
+    отправки (до batch_size штук) через одно соединение с почтовым сервером.
+    Возвращает (выполнено, с ошибкой).
+    """
+    batch_size = batch_size or email_batch_size()
+    jobs = [first_job]
+    while len(jobs) < batch_size:
+        job = claim_job(types=EMAIL_JOB_TYPES)
+        if job is None:
+            break
+        jobs.append(job)
+
+    ok = failed = 0
+    outbox = ПочтовыйЯщик(batch_size=len(jobs))
+    prepared = {}
+    for job in jobs:
+        try:
+            message, mark_sent = ПИСЬМА[job.тип](job)
+        except ЗаданиеНеГотово as e:
+            if job is not first_job:
+                # Попутно захваченное письмо ждет свой PDF - возвращаем его в очередь
+                # без траты попытки, задание генерации PDF стоит в очереди раньше
+                _release_job(job)
+                continue
+            _fail_job(job, e)
+            failed += 1
+            continue
+        except Exception as e:
+            _fail_job(job, e)
+            failed += 1
+            continue
+        prepared[job.id] = (job, mark_sent)
+        outbox.add(message, key=job.id)
+    outbox.flush()
+
+    for job_id, error in outbox.results:
+        job, mark_sent = prepared[job_id]
+        if error:
+            _fail_job(job, ОшибкаЗадания(f"Не удалось отправить email: {error}"))
+            failed += 1
+        else:
+            mark_sent()
+            _complete_job(job)
+            ok += 1
+    if outbox.sent:
+        print(f"Отправлено писем: {outbox.sent} за {outbox.elapsed:.2f} с ({outbox.rate:.1f} писем/с)")
+    return ok, failed
+
+
+def run_claimed_job(job):
+    """Выполняет захваченное задание; email - пачкой с другими. Возвращает (выполнено, с ошибкой)."""
+    if job.тип in EMAIL_JOB_TYPES:
+        return run_email_batch(job)
+    return (1, 0) if run_job(job) else (0, 1)
+
+
+def run_pending_jobs(limit=None):
+    """Выполняет готовые задания в текущем потоке. Возвращает число обработанных."""
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_job()
+        if job is None:
+            break
+        if job.тип in EMAIL_JOB_TYPES:
+            batch_size = email_batch_size() if limit is None else min(email_batch_size(), limit - processed)
+            processed += sum(run_email_batch(job, batch_size))
+        else:
+            run_job(job)
+            processed += 1
+    return processed
+
+
+def run_ticket_jobs(ticket_id):
+    """
+    Сразу выполняет готовые задания одного билета (режим TICKET_JOBS_EAGER).
+    Вызывается через transaction.on_commit после покупки; ошибки не пробрасываются,
+    а остаются в заданиях и в билете, повторы выполнит воркер.
+    """
+    processed = 0
+    while True:
+        job = claim_job(ticket_id=ticket_id)
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
@@ -0,0 +1,149 @@
+# cinema_tickets/listing.py
+"""
+Списки с пагинацией по ключу: ближайшие сеансы для главной страницы и билеты клиента.
+
+Страница строится одним запросом: сеансы с залом, числом проданных билетов
+(Count) и числом мест зала (подзапрос). Пагинация - по ключу (время_начала, id):
+следующая страница начинается после последнего показанного сеанса, поэтому
+стоимость запроса не растет с номером страницы, как у OFFSET.
+
+Готовый HTML фрагмент страницы кэшируется. Ключ фрагмента включает версию
+списка, которую увеличивает любая продажа и любое изменение сеанса, так что
+после них все страницы перестраиваются, а до того главная не ходит в БД.
+
+Билеты клиента листаются так же, по ключу (дата_покупки, id) от новых к старым,
+по составному индексу (клиент, дата_покупки, id): глубокая страница стоит столько же,
+сколько первая. С архивом (include_archive) та же страница берется из рабочей
+таблицы и из АрхивБилетов (по такому же индексу) и сливается - два запроса.
+"""
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import АрхивБилетов, КупленныеБилеты, МестаВЗале, СеансыФильмов
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+DEFAULT_CACHE_TIMEOUT = 60
+
+_VERSION_KEY = 'listing:sessions:version'
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class НеверныйКурсор(ValueError):
+    """Курсор страницы не удалось разобрать."""
+
+
+def page_size():
+    return getattr(settings, 'HOME_SESSIONS_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+
+def encode_cursor(moment, pk):
+    """Курсор "после этой строки": микросекунды ключевого времени и ID."""
+    delta = moment - _EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    return f'{microseconds}.{pk}'
+
+
+def decode_cursor(cursor):
+    try:
+        microseconds, pk = cursor.split('.')
+        return _EPOCH + timedelta(microseconds=int(microseconds)), int(pk)
+    except (ValueError, OverflowError):
+        raise НеверныйКурсор(f'Неверный курсор страницы: {cursor}')
+
+
+def upcoming_sessions(after=None, limit=None, now=None):
+    """
+    Ближайшие сеансы (начинающиеся не раньше now) с аннотациями продано и мест_в_зале.
+    Продано считается по рабочей таблице: в архив переносятся билеты только
+    закончившихся сеансов, а они в этот список не попадают.
+    after - курсор из encode_cursor. Возвращает (сеансы, курсор следующей страницы или None).
+    """
+    limit = limit or page_size()
+    seats = (МестаВЗале.objects.filter(зал=OuterRef('зал')).order_by()
+             .values('зал').annotate(n=Count('pk')).values('n'))
+    queryset = (СеансыФильмов.objects
+                .filter(время_начала__gte=now or timezone.now())
+                .select_related('зал')
+                .annotate(продано=Count('купленныебилеты'), мест_в_зале=Coalesce(Subquery(seats), 0))
+                .order_by('время_начала', 'pk'))
+    if after:
+        начало, pk = decode_cursor(after)
+        queryset = queryset.filter(Q(время_начала__gt=начало) | Q(время_начала=начало, pk__gt=pk),
+                                   время_начала__gte=начало)
+
+    # Лишняя строка показывает, есть ли следующая страница, без отдельного COUNT
+    sessions, next_cursor = _split_page(list(queryset[:limit + 1]), limit, 'время_начала')
+    for сеанс in sessions:
+        сеанс.свободно = max(сеанс.мест_в_зале - сеанс.продано, 0)
+    return sessions, next_cursor
+
+
+def _split_page(rows, limit, time_field):
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(getattr(last, time_field), last.pk)
+
+
+def client_tickets(client_id, after=None, limit=None, include_archive=False):
+    """
+    Билеты клиента от новых к старым с сеансом, залом и местом - одним запросом
+    (с include_archive - и архивные билеты, вторым запросом).
+    Возвращает (билеты, курсор следующей страницы или None).
+    """
+    limit = min(limit or page_size(), MAX_PAGE_SIZE)
+    cursor = decode_cursor(after) if after else None
+    rows = []
+    for model in (КупленныеБилеты, АрхивБилетов) if include_archive else (КупленныеБилеты,):
+        queryset = (model.objects.filter(клиент_id=client_id)
+                    .select_related('сеанс__зал', 'место')
+                    .order_by('-дата_покупки', '-pk'))
+        if cursor:
+            куплен, pk = cursor
+            # Отдельное условие дата_покупки <= курсора дает индексу границу диапазона:
+            # без него SQLite читает индекс с начала и отбрасывает строки до курсора
+            queryset = queryset.filter(Q(дата_покупки__lt=куплен) | Q(дата_покупки=куплен, pk__lt=pk),
+                                       дата_покупки__lte=куплен)
+        rows.extend(queryset[:limit + 1])
+    if include_archive:
+        # ID билета при переносе в архив не меняется, поэтому ключ (дата, id) общий
+        rows.sort(key=lambda билет: (билет.дата_покупки, билет.pk), reverse=True)
+    return _split_page(rows, limit, 'дата_покупки')
+
+
+def _version():
+    version = cache.get(_VERSION_KEY)
+    if version is None:
+        cache.add(_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(_VERSION_KEY)
+    return version
+
+
+def sessions_changed():
+    """Делает устаревшими все закэшированные страницы списка."""
+    cache.set(_VERSION_KEY, time.time_ns(), None)
+
+
+def render_sessions_page(after=None):
+    """
+    HTML фрагмент страницы списка сеансов (из кэша, если список не менялся).
+    Для испорченного курсора выбрасывает НеверныйКурсор.
+    """
+    if after:
+        decode_cursor(after)
+    key = f'listing:sessions:{_version()}:{after or "first"}:{page_size()}'
+    html = cache.get(key)
+    if html is None:
+        sessions, next_cursor = upcoming_sessions(after)
+        html = render_to_string('cinema_tickets/_sessions_page.html',
+                                {'sessions': sessions, 'next_cursor': next_cursor})
+        cache.set(key, html, getattr(settings, 'HOME_SESSIONS_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT))
+    return html
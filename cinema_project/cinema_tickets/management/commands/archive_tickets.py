@@ -0,0 +1,62 @@
+# cinema_tickets/management/commands/archive_tickets.py
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from cinema_tickets.archive import DEFAULT_BATCH_SIZE, archive_session, sessions_to_archive
+from cinema_tickets.dbstats import refresh_row_estimate
+from cinema_tickets.models import КупленныеБилеты
+
+
+class Command(BaseCommand):
+    help = ('Переносит билеты давно прошедших сеансов в архив (АрхивБилетов) порциями; '
+            'прерванный перенос продолжается повторным запуском')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, required=True,
+                            help='Сеансы, закончившиеся больше N дней назад')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help=f'Билетов в одной транзакции (по умолчанию {DEFAULT_BATCH_SIZE})')
+        parser.add_argument('--pack', action='store_true',
+                            help='Перед переносом сложить PDF сеанса в пакет (migrate_pdf_storage --pack)')
+        parser.add_argument('--limit', type=int, default=None, help='Обработать не больше N сеансов')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать сеансы, ничего не менять')
+
+    def handle(self, *args, **options):
+        if options['older_than'] < 0:
+            raise CommandError('--older-than не может быть отрицательным.')
+        sessions = sessions_to_archive(options['older_than'])
+        if options['limit']:
+            sessions = sessions[:options['limit']]
+        sessions = list(sessions.values_list('pk', 'название_фильма'))
+        self.stdout.write(f'Сеансов к архивации: {len(sessions)}')
+        if options['dry_run']:
+            for session_id, title in sessions:
+                self.stdout.write(f'  {session_id}: {title}')
+            return
+
+        started = time.perf_counter()
+        total = 0
+        for session_id, title in sessions:
+            if options['pack']:
+                call_command('migrate_pdf_storage', pack=True, sessions=[session_id], closed_hours=0,
+                             stdout=self.stdout, stderr=self.stderr)
+            moved = 0
+            try:
+                for count in archive_session(session_id, options['batch_size']):
+                    moved += count
+            except IntegrityError as e:
+                raise CommandError(f'Сеанс {session_id}: билет с тем же ID уже есть в архиве, '
+                                   f'порция не перенесена ({e}).')
+            total += moved
+            self.stdout.write(f'Сеанс {session_id} ({title}): в архив {moved} билетов')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {total} билетов за {elapsed:.1f} с ({total / elapsed if elapsed else 0:.0f} билетов/с)'
+        ))
+        if total:
+            # Оценка числа билетов в админке берется из статистики таблицы
+            refresh_row_estimate(КупленныеБилеты)
@@ -0,0 +1,357 @@
+# cinema_tickets/management/commands/benchmark_suite.py
+"""
+Нагрузочный бенчмарк горячих путей: покупка, генерация PDF, скачивание PDF.
+
+По умолчанию работает в отдельной временной БД (как тестовый раннер),
+рабочая БД и MEDIA_ROOT не затрагиваются. Результаты пишутся в JSON,
+чтобы сравнивать прогоны между коммитами (--compare старый.json).
+"""
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.urls import reverse
+from django.utils import timezone
+
+from cinema_tickets.models import ФизическиеЛица, Залы, СеансыФильмов, МестаВЗале, КупленныеБилеты
+from cinema_tickets.utils import add_stage_observer, generate_ticket_pdf, remove_stage_observer
+
+# Ключевые показатели для сравнения прогонов: (раздел, показатель, больше - лучше)
+COMPARED_METRICS = [
+    ('purchase', 'throughput', True),
+    ('purchase', 'p95_ms', False),
+    ('render', 'throughput', True),
+    ('render', 'p95_ms', False),
+    ('download', 'throughput', True),
+    ('download', 'p95_ms', False),
+]
+
+
+def summarize(latencies, elapsed=None):
+    """Сводка по задержкам (секунды): пропускная способность и перцентили в мс."""
+    if not latencies:
+        return {'count': 0}
+    ordered = sorted(latencies)
+    if len(ordered) > 1:
+        cuts = statistics.quantiles(ordered, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = ordered[0]
+    elapsed = elapsed if elapsed is not None else sum(ordered)
+    return {
+        'count': len(ordered),
+        'elapsed_s': round(elapsed, 4),
+        'throughput': round(len(ordered) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'p99_ms': round(p99 * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def run_threads(worker, threads):
+    """Запускает worker(index) в threads потоках одновременно, возвращает время выполнения."""
+    barrier = threading.Barrier(threads)
+
+    def target(index):
+        try:
+            barrier.wait()
+            worker(index)
+        finally:
+            # У каждого потока свое соединение с БД
+            connection.close()
+
+    pool = [threading.Thread(target=target, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Бенчмарк покупки (конкурентные потоки за одни и те же места), генерации PDF по стадиям '
+            'и скачивания PDF. Данные создаются во временной БД, результаты пишутся в JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=100_000, help='Сколько билетов создать для фона')
+        parser.add_argument('--clients', type=int, default=10_000, help='Сколько клиентов создать')
+        parser.add_argument('--hall-seats', type=int, default=500, help='Мест в зале')
+        parser.add_argument('--threads', type=int, default=8, help='Конкурентных потоков')
+        parser.add_argument('--purchase-seats', type=int, default=50,
+                            help='Сколько мест разыгрывают потоки (каждый поток пытается купить все)')
+        parser.add_argument('--distinct-seats', action='store_true',
+                            help='Каждый поток покупает свои места (нагрузка на запись вместо гонки за место)')
+        parser.add_argument('--renders', type=int, default=200, help='Сколько PDF сгенерировать')
+        parser.add_argument('--downloads', type=int, default=1000, help='Сколько скачиваний PDF выполнить')
+        parser.add_argument('--output', default='benchmark_results.json', help='Файл для результатов')
+        parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+        parser.add_argument('--use-current-db', action='store_true',
+                            help='Не создавать временную БД (для тестов; данные останутся в текущей БД)')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора случайных чисел')
+        parser.add_argument('--sqlite-profile', choices=['settings', 'legacy'], default='settings',
+                            help='legacy - SQLite без WAL, BEGIN IMMEDIATE и повторов покупки (для сравнения)')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        media_root = tempfile.mkdtemp(prefix='cinema_benchmark_media_')
+        old_config = None
+        # Ответы 409 на проигранные гонки за место - ожидаемые, не засоряем ими вывод
+        request_logger = logging.getLogger('django.request')
+        old_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            legacy = options['sqlite_profile'] == 'legacy'
+            if not options['use_current_db']:
+                old_config = self._setup_database(media_root, legacy)
+            with override_settings(DB_LOCK_RETRY_ATTEMPTS=1 if legacy else settings.DB_LOCK_RETRY_ATTEMPTS,
+                                   MEDIA_ROOT=media_root, TICKET_JOBS_EAGER=False, TICKET_PDF_LAZY=False,
+                                   TICKET_PDF_SENDFILE=None, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                                   EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+                cache.clear()
+                results = self._run(options)
+        finally:
+            request_logger.setLevel(old_level)
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Результаты записаны в {options['output']}"))
+        if options['compare']:
+            self._compare(options['compare'], results)
+
+    def _setup_database(self, directory, legacy=False):
+        """Временная БД как у тестового раннера; SQLite - файлом, чтобы потоки писали конкурентно."""
+        db = connections['default']
+        if db.vendor == 'sqlite':
+            db.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            if legacy:
+                # Настройки SQLite по умолчанию: журнал DELETE, отложенные транзакции
+                db.settings_dict['OPTIONS'] = {}
+        self.stdout.write('Создание временной БД...')
+        return setup_databases(verbosity=0, interactive=False, aliases={'default'}, serialized_aliases=set())
+
+    def _run(self, options):
+        results = {
+            'meta': {
+                'commit': _git_commit(),
+                'timestamp': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'sqlite_profile': options['sqlite_profile'],
+                'options': {key: options[key] for key in (
+                    'tickets', 'clients', 'hall_seats', 'threads', 'purchase_seats', 'distinct_seats',
+                    'renders', 'downloads', 'seed', 'sqlite_profile',
+                )},
+            },
+        }
+        started = time.perf_counter()
+        self._seed(options)
+        results['seed'] = {'elapsed_s': round(time.perf_counter() - started, 3),
+                           'tickets': КупленныеБилеты.objects.count(),
+                           'clients': ФизическиеЛица.objects.count()}
+        self.stdout.write(f"Данные созданы за {results['seed']['elapsed_s']} с")
+
+        results['purchase'] = self._bench_purchase(options)
+        self._print('Покупка', results['purchase'])
+        results['render'] = self._bench_render(options)
+        self._print('Генерация PDF', results['render'])
+        for stage, summary in results['render']['stages'].items():
+            self.stdout.write(f"    {stage:<10} p50 {summary['p50_ms']} мс, p95 {summary['p95_ms']} мс")
+        results['download'] = self._bench_download(options)
+        self._print('Скачивание PDF', results['download'])
+        return results
+
+    # --- Данные ---
+
+    def _seed(self, options):
+        зал = Залы.objects.create(название='Бенчмарк')
+        МестаВЗале.objects.bulk_create(
+            [МестаВЗале(зал=зал, номер_места=n, ряд=(n - 1) // 25 + 1, место_в_ряду=(n - 1) % 25 + 1)
+             for n in range(1, options['hall_seats'] + 1)],
+            batch_size=1000,
+        )
+        места = list(МестаВЗале.objects.filter(зал=зал).order_by('номер_места'))
+
+        clients_count = max(options['clients'], options['threads'])
+        ФизическиеЛица.objects.bulk_create(
+            [ФизическиеЛица(фамилия=f'Фамилия{i}', имя='Имя', номер_телефона=f'+7900{i:07d}',
+                            дата_рождения=date(1980, 1, 1) + timedelta(days=i % 10_000),
+                            email=f'client{i}@example.com')
+             for i in range(clients_count)],
+            batch_size=1000,
+        )
+        self.clients = list(ФизическиеЛица.objects.order_by('pk').values_list('pk', 'email'))
+
+        # Сеансов столько, чтобы в них поместились все фоновые билеты
+        sessions_count = max(1, -(-options['tickets'] // len(места)))
+        начало = timezone.now().replace(second=0, microsecond=0) + timedelta(days=1)
+        СеансыФильмов.objects.bulk_create(
+            [СеансыФильмов(зал=зал, название_фильма=f'Фильм {i % 20}', время_начала=начало + timedelta(hours=3 * i),
+                           время_окончания=начало + timedelta(hours=3 * i, minutes=110))
+             for i in range(sessions_count + 1)],
+        )
+        сеансы = list(СеансыФильмов.objects.filter(зал=зал).order_by('pk'))
+        # Последний сеанс остается пустым - за его места соревнуются покупатели
+        self.race_session = сеансы.pop()
+
+        batch = []
+        created = 0
+        for сеанс in сеансы:
+            for место in места:
+                if created >= options['tickets']:
+                    break
+                client_id, email = self.clients[self.random.randrange(len(self.clients))]
+                batch.append(КупленныеБилеты(клиент_id=client_id, сеанс=сеанс, место=место,
+                                             email_получателя=email, статус=КупленныеБилеты.СТАТУС_ОТПРАВЛЕН))
+                created += 1
+                if len(batch) >= 5000:
+                    КупленныеБилеты.objects.bulk_create(batch, batch_size=1000)
+                    batch = []
+        КупленныеБилеты.objects.bulk_create(batch, batch_size=1000)
+
+    # --- Замеры ---
+
+    def _bench_purchase(self, options):
+        """
+        Все потоки пытаются купить одни и те же места (каждый в своем порядке).
+        С --distinct-seats у каждого потока свои места: все покупки успешны и конкурируют только за запись в БД.
+        """
+        seats = list(range(1, min(options['purchase_seats'], options['hall_seats']) + 1))
+        distinct = options['distinct_seats']
+        latencies = []
+        statuses = Counter()
+        lock = threading.Lock()
+        url = reverse('cinema_tickets:purchase_ticket')
+
+        def worker(index):
+            client_id, email = self.clients[index]
+            order = seats[index::options['threads']] if distinct else seats[:]
+            random.Random(options['seed'] + index).shuffle(order)
+            http = Client()
+            local_latencies, local_statuses = [], Counter()
+            for seat in order:
+                payload = json.dumps({'client_id': client_id, 'session_id': self.race_session.pk,
+                                      'seat_number': seat, 'client_email': email})
+                started = time.perf_counter()
+                response = http.post(url, data=payload, content_type='application/json')
+                local_latencies.append(time.perf_counter() - started)
+                local_statuses[response.status_code] += 1
+            with lock:
+                latencies.extend(local_latencies)
+                statuses.update(local_statuses)
+
+        elapsed = run_threads(worker, options['threads'])
+        summary = summarize(latencies, elapsed)
+        summary['statuses'] = {str(code): count for code, count in sorted(statuses.items())}
+        sold = КупленныеБилеты.objects.filter(сеанс=self.race_session).count()
+        summary['sold'] = sold
+        # Каждое место должно быть продано ровно один раз
+        summary['oversold'] = sold > len(seats)
+        summary['error_rate'] = round(sum(count for code, count in statuses.items() if code >= 500)
+                                      / max(len(latencies), 1), 4)
+        return summary
+
+    def _bench_render(self, options):
+        stages = defaultdict(list)
+
+        def observer(name, seconds):
+            stages[name].append(seconds)
+
+        tickets = list(КупленныеБилеты.objects.filter(сеанс__зал=self.race_session.зал_id)
+                       .order_by('pk')[:options['renders']])
+        latencies = []
+        add_stage_observer(observer)
+        try:
+            for ticket in tickets:
+                started = time.perf_counter()
+                generate_ticket_pdf(ticket)
+                latencies.append(time.perf_counter() - started)
+        finally:
+            remove_stage_observer(observer)
+        self.rendered = [ticket.pk for ticket in tickets]
+        summary = summarize(latencies)
+        summary['stages'] = {name: summarize(values) for name, values in stages.items()}
+        summary['avg_pdf_bytes'] = (sum(ticket.pdf_файл.size for ticket in tickets) // len(tickets)) if tickets else 0
+        return summary
+
+    def _bench_download(self, options):
+        if not self.rendered:
+            return {'count': 0}
+        per_thread = max(1, options['downloads'] // options['threads'])
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(index):
+            rng = random.Random(options['seed'] + index)
+            http = Client()
+            local = []
+            for _ in range(per_thread):
+                url = reverse('cinema_tickets:get_ticket_pdf', args=[rng.choice(self.rendered)])
+                started = time.perf_counter()
+                response = http.get(url)
+                # Ответ стримится - учитываем время чтения всего тела
+                b''.join(response.streaming_content) if response.streaming else response.content
+                response.close()
+                local.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(local)
+
+        elapsed = run_threads(worker, options['threads'])
+        return summarize(latencies, elapsed)
+
+    # --- Вывод ---
+
+    def _print(self, title, summary):
+        if not summary.get('count'):
+            self.stdout.write(f'{title}: нет данных')
+            return
+        line = (f"{title}: {summary['count']} за {summary['elapsed_s']} с, {summary['throughput']}/с, "
+                f"p50 {summary['p50_ms']} мс, p95 {summary['p95_ms']} мс, p99 {summary['p99_ms']} мс")
+        if 'statuses' in summary:
+            line += f", ответы {summary['statuses']}"
+        self.stdout.write(self.style.SUCCESS(line))
+
+    def _compare(self, path, results):
+        with open(path, encoding='utf-8') as f:
+            previous = json.load(f)
+        self.stdout.write(f"Сравнение с {path} (коммит {previous.get('meta', {}).get('commit')}):")
+        for section, metric, higher_is_better in COMPARED_METRICS:
+            old = previous.get(section, {}).get(metric)
+            new = results.get(section, {}).get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = change < 0 if higher_is_better else change > 0
+            style = self.style.WARNING if worse and abs(change) > 10 else self.style.SUCCESS
+            self.stdout.write(style(f'  {section}.{metric}: {old} -> {new} ({change:+.1f}%)'))
@@ -0,0 +1,56 @@
+# cinema_tickets/management/commands/benchmark_tickets.py
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cinema_tickets.models import ФизическиеЛица, СеансыФильмов, МестаВЗале, КупленныеБилеты
+from cinema_tickets.utils import render_tickets_pdf
+
+
+def make_sample_tickets(count):
+    """Билеты в памяти (без БД) со всеми связанными объектами, как после select_related."""
+    клиент = ФизическиеЛица(id=1, фамилия='Иванов', имя='Иван', отчество='Иванович',
+                            номер_телефона='+79000000000', дата_рождения=date(1990, 1, 1))
+    начало = timezone.now().replace(microsecond=0)
+    сеанс = СеансыФильмов(id=1, название_фильма='Тестовый фильм', время_начала=начало,
+                          время_окончания=начало + timedelta(minutes=125))
+    tickets = []
+    for i in range(1, count + 1):
+        tickets.append(КупленныеБилеты(
+            id=i, клиент=клиент, сеанс=сеанс, место=МестаВЗале(id=i, номер_места=i % 100 + 1),
+            дата_покупки=начало, email_получателя='ivanov@example.com',
+        ))
+    return tickets
+
+
+class Command(BaseCommand):
+    help = 'Замеряет скорость генерации PDF билетов (билетов в секунду)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help='Сколько билетов сгенерировать')
+
+    def handle(self, *args, **options):
+        tickets = make_sample_tickets(options['count'])
+        # Прогрев: регистрация шрифта и т.п. не должны попадать в замер
+        render_tickets_pdf(tickets[:1])
+
+        started = time.perf_counter()
+        total_bytes = 0
+        for ticket in tickets:
+            total_bytes += len(render_tickets_pdf([ticket]))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Отдельные PDF: {len(tickets)} билетов за {elapsed:.2f} с - "
+            f"{len(tickets) / elapsed:.1f} билетов/с, в среднем {total_bytes // len(tickets)} байт"
+        ))
+
+        started = time.perf_counter()
+        pdf = render_tickets_pdf(tickets)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Один многостраничный PDF: {len(tickets)} страниц за {elapsed:.2f} с - "
+            f"{len(tickets) / elapsed:.1f} билетов/с, {len(pdf)} байт"
+        ))
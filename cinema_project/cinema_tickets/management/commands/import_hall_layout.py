@@ -0,0 +1,150 @@
+# cinema_tickets/management/commands/import_hall_layout.py
+"""
+Создает места залов по схеме из JSON файла.
+
+Формат (один зал - объект, несколько - список объектов или {"halls": [...]}):
+
+    {
+      "hall": "Зал 1",
+      "sections": [
+        {"name": "Партер", "rows": [
+          {"row": 1, "seats": 18},
+          {"rows": [2, 12], "seats": 20}
+        ]},
+        {"name": "Балкон", "rows": [
+          {"row": 1, "seats": [1, 2, 3, 6, 7, 8]}
+        ]}
+      ]
+    }
+
+"seats" - количество мест в ряду (нумерация с 1) или явный список номеров
+мест в ряду (для рядов с проходами). "rows": [с, по] задает одинаковые ряды.
+Сквозные номера мест (по ним идет покупка) присваиваются подряд в порядке
+файла, начиная с 1, либо с "first_number", если он указан у ряда.
+"""
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from cinema_tickets.models import Залы, МестаВЗале
+from cinema_tickets.seatmap import halls_changed
+
+
+def _row_numbers(row):
+    if 'row' in row:
+        return [int(row['row'])]
+    if 'rows' in row:
+        first, last = row['rows']
+        return list(range(int(first), int(last) + 1))
+    raise CommandError(f'Для ряда не указан "row" или "rows": {row}')
+
+
+def _seats_in_row(row):
+    seats = row.get('seats')
+    if isinstance(seats, int):
+        return list(range(1, seats + 1))
+    if isinstance(seats, list) and all(isinstance(n, int) for n in seats):
+        return seats
+    raise CommandError(f'"seats" должно быть числом или списком номеров: {row}')
+
+
+def parse_layout(data):
+    """
+    Разбирает схему. Возвращает список (название зала, места), где место -
+    кортеж (номер_места, секция, ряд, место_в_ряду).
+    """
+    if isinstance(data, dict) and 'halls' in data:
+        data = data['halls']
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        raise CommandError('Схема должна быть объектом зала или списком залов.')
+
+    halls = []
+    for hall in data:
+        name = hall.get('hall')
+        if not name:
+            raise CommandError('У зала не указано название ("hall").')
+        seats = []
+        numbers = set()
+        next_number = 1
+        for section in hall.get('sections', []):
+            section_name = section.get('name', '')
+            for row in section.get('rows', []):
+                if 'first_number' in row:
+                    next_number = int(row['first_number'])
+                for row_number in _row_numbers(row):
+                    for seat_in_row in _seats_in_row(row):
+                        if next_number in numbers:
+                            raise CommandError(f'Зал "{name}": номер места {next_number} встречается дважды.')
+                        numbers.add(next_number)
+                        seats.append((next_number, section_name, row_number, seat_in_row))
+                        next_number += 1
+        if not seats:
+            raise CommandError(f'Зал "{name}": в схеме нет ни одного места.')
+        halls.append((name, seats))
+    return halls
+
+
+class Command(BaseCommand):
+    help = ('Создает залы и места по схеме из JSON файла (секции, ряды, места). '
+            'Места вставляются пачками, уже существующие пропускаются (или обновляются с --update).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('layout_file', help='Путь к JSON файлу со схемой зала')
+        parser.add_argument('--update', action='store_true',
+                            help='Обновить секцию и ряд у уже существующих мест с теми же номерами')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Мест в одной вставке')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить схему')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['layout_file'], encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise CommandError(f'Не удалось прочитать схему: {e}')
+
+        halls = parse_layout(data)
+        for name, seats in halls:
+            self.stdout.write(f'Зал "{name}": {len(seats)} мест в схеме')
+        if options['dry_run']:
+            return
+
+        if options['update']:
+            conflicts = dict(update_conflicts=True, unique_fields=['зал', 'номер_места'],
+                             update_fields=['секция', 'ряд', 'место_в_ряду'])
+        else:
+            conflicts = dict(ignore_conflicts=True)
+
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        for name, seats in halls:
+            started = time.perf_counter()
+            queries[0] = 0
+            with connection.execute_wrapper(count_query), transaction.atomic():
+                зал, _ = Залы.objects.get_or_create(название=name)
+                before = МестаВЗале.objects.filter(зал=зал).count()
+                МестаВЗале.objects.bulk_create(
+                    [МестаВЗале(зал=зал, номер_места=номер, секция=секция, ряд=ряд, место_в_ряду=место_в_ряду)
+                     for номер, секция, ряд, место_в_ряду in seats],
+                    batch_size=options['batch_size'],
+                    **conflicts,
+                )
+                total = МестаВЗале.objects.filter(зал=зал).count()
+            halls_changed([зал.pk])
+
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f'Зал "{зал}": создано {total - before} мест, всего {total} '
+                f'({elapsed:.2f} с, запросов к БД: {queries[0]})'
+            ))
+            if total > len(seats):
+                self.stdout.write(self.style.WARNING(
+                    f'  В зале есть {total - len(seats)} мест, которых нет в схеме (не удалены).'
+                ))
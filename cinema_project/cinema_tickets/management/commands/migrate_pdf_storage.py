@@ -0,0 +1,117 @@
+# cinema_tickets/management/commands/migrate_pdf_storage.py
+import os
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from cinema_tickets.models import КупленныеБилеты, Заказы, СеансыФильмов
+from cinema_tickets.storage import PACKS_DIR, order_pdf_path, pdf_storage, ticket_pdf_path
+
+
+class Command(BaseCommand):
+    help = ('Переносит PDF билетов и заказов в раскладку по каталогам (--shard) '
+            'и складывает PDF прошедших сеансов в пакеты (--pack), см. storage.py')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shard', action='store_true',
+                            help='Переложить PDF из плоских каталогов tickets/ и orders/ в подкаталоги по ID')
+        parser.add_argument('--pack', action='store_true',
+                            help='Сложить PDF прошедших сеансов в пакеты')
+        parser.add_argument('--closed-hours', type=int, default=24,
+                            help='Сеанс считается прошедшим через N часов после окончания (по умолчанию 24)')
+        parser.add_argument('--session', type=int, action='append', dest='sessions', default=[],
+                            help='Упаковать только этот сеанс (можно указать несколько раз)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Файлов в одной порции')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не менять')
+
+    def handle(self, *args, **options):
+        if not options['shard'] and not options['pack']:
+            raise CommandError('Укажите --shard и/или --pack.')
+        self.dry_run = options['dry_run']
+        self.chunk_size = options['chunk_size']
+        started = time.perf_counter()
+        if options['shard']:
+            moved = self._shard(КупленныеБилеты, ticket_pdf_path) + self._shard(Заказы, order_pdf_path)
+            self.stdout.write(f'Перенесено в подкаталоги: {moved}')
+        if options['pack']:
+            sessions = СеансыФильмов.objects.filter(
+                время_окончания__lt=timezone.now() - timedelta(hours=options['closed_hours']))
+            if options['sessions']:
+                sessions = sessions.filter(pk__in=options['sessions'])
+            packed = total_bytes = 0
+            for session_id in sessions.order_by('pk').values_list('pk', flat=True):
+                count, size = self._pack_session(session_id)
+                packed += count
+                total_bytes += size
+            self.stdout.write(f'Упаковано: {packed} PDF, {total_bytes / 1024 / 1024:.1f} МБ')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - started:.1f} с' + (' (--dry-run, ничего не изменено)' if self.dry_run else '')
+        ))
+
+    def _loose_files(self, queryset):
+        """(ID, имя файла) для PDF, лежащих отдельными файлами; порции по возрастанию ID."""
+        queryset = queryset.exclude(pdf_файл='').exclude(pdf_файл__isnull=True).exclude(pdf_файл__contains='.pack/')
+        last_id = 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', 'pdf_файл')[:self.chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_id = chunk[-1][0]
+
+    def _shard(self, model, upload_to):
+        moved = 0
+        for chunk in self._loose_files(model.objects.all()):
+            updated = []
+            for pk, name in chunk:
+                target = upload_to(model(pk=pk), os.path.basename(name))
+                if name == target:
+                    continue
+                moved += 1
+                if self.dry_run:
+                    continue
+                source_path, target_path = pdf_storage.path(name), pdf_storage.path(target)
+                if os.path.exists(source_path):
+                    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                    os.replace(source_path, target_path)
+                elif not os.path.exists(target_path):
+                    # Файл потерян раньше: имя не меняем, PDF перегенерируется как отсутствующий
+                    self.stderr.write(f'{model._meta.verbose_name} {pk}: файл {name} не найден, пропущен')
+                    moved -= 1
+                    continue
+                updated.append(model(pk=pk, pdf_файл=target))
+            model.objects.bulk_update(updated, ['pdf_файл'])
+        return moved
+
+    def _pack_session(self, session_id):
+        pack = f'{PACKS_DIR}/session_{session_id}.pack'
+        count = total_bytes = 0
+        for model in (КупленныеБилеты, Заказы):
+            for chunk in self._loose_files(model.objects.filter(сеанс_id=session_id)):
+                files, rows = [], []
+                for pk, name in chunk:
+                    try:
+                        with pdf_storage.open(name, 'rb') as f:
+                            data = f.read()
+                        # Время изменения переносится в индекс - ETag и Last-Modified не меняются
+                        modified = pdf_storage.get_modified_time(name).timestamp()
+                        files.append((os.path.basename(name), data, modified))
+                    except FileNotFoundError:
+                        self.stderr.write(f'{model._meta.verbose_name} {pk}: файл {name} не найден, пропущен')
+                        continue
+                    rows.append((pk, name))
+                count += len(files)
+                total_bytes += sum(len(data) for _, data, _ in files)
+                if self.dry_run or not files:
+                    continue
+                names = pdf_storage.append_to_pack(pack, files)
+                model.objects.bulk_update([model(pk=pk, pdf_файл=packed) for (pk, _), packed in zip(rows, names)],
+                                          ['pdf_файл'])
+                # Отдельные файлы удаляем только после того, как БД указывает на пакет
+                for _, name in rows:
+                    pdf_storage.delete(name)
+        if count:
+            self.stdout.write(f'Сеанс {session_id}: {count} PDF -> {pack}')
+        return count, total_bytes
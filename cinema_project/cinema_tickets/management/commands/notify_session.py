@@ -0,0 +1,39 @@
+# cinema_tickets/management/commands/notify_session.py
+from django.core.management.base import BaseCommand, CommandError
+
+from cinema_tickets.jobs import enqueue_session_notification
+from cinema_tickets.models import СеансыФильмов
+from cinema_tickets.outbox import notify_session_change, session_recipients
+
+
+class Command(BaseCommand):
+    help = ('Рассылает письмо об изменении сеанса всем держателям билетов '
+            '(пачками через одно соединение с почтовым сервером)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--session', type=int, required=True, help='ID сеанса')
+        parser.add_argument('--message', default='', help='Дополнительный текст письма')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Писем на одно соединение (по умолчанию TICKET_EMAIL_BATCH_SIZE)')
+        parser.add_argument('--queue', action='store_true',
+                            help='Не отправлять сразу, а поставить рассылку в очередь воркера')
+
+    def handle(self, *args, **options):
+        try:
+            session = СеансыФильмов.objects.get(pk=options['session'])
+        except СеансыФильмов.DoesNotExist:
+            raise CommandError(f"Сеанс {options['session']} не найден.")
+
+        if options['queue']:
+            job = enqueue_session_notification(session, options['message'])
+            self.stdout.write(self.style.SUCCESS(f'Рассылка поставлена в очередь: задание {job.id}'))
+            return
+
+        emails = session_recipients(session)
+        self.stdout.write(f'Получателей: {len(emails)}')
+        outbox = notify_session_change(session, options['message'], emails=emails,
+                                       batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Отправлено: {outbox.sent}, ошибок: {outbox.failed}, соединений: {outbox.batches}, '
+            f'{outbox.elapsed:.2f} с ({outbox.rate:.1f} писем/с)'
+        ))
@@ -1,19 +1,29 @@
 # cinema_tickets/management/commands/populate_seats.py
 from django.core.management.base import BaseCommand
-from cinema_tickets.models import МестаВЗале
+from cinema_tickets.models import Залы, МестаВЗале
+from cinema_tickets.seatmap import halls_changed
 
 class Command(BaseCommand):
-    help = 'Создает места в зале от 1 до 100, если они еще не существуют'
+    help = ('Создает места от 1 до N (по умолчанию 100) в зале без схемы рядов, если они еще не существуют. '
+            'Залы с рядами и секциями создаются командой import_hall_layout.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hall', default=Залы.НАЗВАНИЕ_ПО_УМОЛЧАНИЮ, help='Название зала')
+        parser.add_argument('--count', type=int, default=100, help='Количество мест')
 
     def handle(self, *args, **options):
-        created_count = 0
-        for i in range(1, 101):
-            seat, created = МестаВЗале.objects.get_or_create(номер_места=i)
-            if created:
-                created_count += 1
+        зал, _ = Залы.objects.get_or_create(название=options['hall'])
+        before = МестаВЗале.objects.filter(зал=зал).count()
+        # Одна вставка вместо get_or_create на каждое место; существующие места пропускаются
+        МестаВЗале.objects.bulk_create(
+            [МестаВЗале(зал=зал, номер_места=i) for i in range(1, options['count'] + 1)],
+            ignore_conflicts=True,
+        )
+        halls_changed([зал.pk])
+        total_seats = МестаВЗале.objects.filter(зал=зал).count()
+        created_count = total_seats - before
         if created_count > 0:
             self.stdout.write(self.style.SUCCESS(f'Успешно создано {created_count} новых мест.'))
         else:
              self.stdout.write(self.style.WARNING('Новых мест не создано (вероятно, уже существуют).'))
-        total_seats = МестаВЗале.objects.count()
-        self.stdout.write(f'Всего мест в базе: {total_seats}')
\ No newline at end of file
+        self.stdout.write(f'Всего мест в зале "{зал}": {total_seats}')
@@ -0,0 +1,47 @@
+# cinema_tickets/management/commands/preload_checkin.py
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from cinema_tickets.checkin import build_index
+from cinema_tickets.models import СеансыФильмов
+
+# Кэши, содержимое которых не переживает процесс команды
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class Command(BaseCommand):
+    help = ('Строит индексы прохода (checkin.py) для ближайших и идущих сеансов, '
+            'чтобы первые сканы на входе не ходили в БД')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--within', type=int, default=120,
+                            help='Сеансы, начинающиеся в ближайшие N минут (по умолчанию 120)')
+        parser.add_argument('--started', type=int, default=30,
+                            help='И начавшиеся не раньше N минут назад (по умолчанию 30)')
+
+    def handle(self, *args, **options):
+        backend = settings.CACHES['default']['BACKEND']
+        if backend in PROCESS_LOCAL_CACHES:
+            raise CommandError(f'Кэш default ({backend}) живет только в процессе команды - индексы исчезнут '
+                               f'вместе с ней. Нужен общий кэш (Redis, Memcached, файловый).')
+        now = timezone.now()
+        sessions = (СеансыФильмов.objects
+                    .filter(время_начала__gte=now - timedelta(minutes=options['started']),
+                            время_начала__lte=now + timedelta(minutes=options['within']))
+                    .order_by('время_начала').values_list('pk', flat=True))
+        started = time.perf_counter()
+        total = 0
+        for session_id in sessions:
+            count = len(build_index(session_id)[0])
+            total += count
+            self.stdout.write(f'Сеанс {session_id}: билетов {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Индексов: {len(sessions)}, билетов: {total}, {time.perf_counter() - started:.2f} с'
+        ))
@@ -0,0 +1,43 @@
+# cinema_tickets/management/commands/print_tickets.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cinema_tickets.models import КупленныеБилеты, СеансыФильмов
+from cinema_tickets.utils import SHEET_LAYOUTS, render_ticket_sheets
+
+
+class Command(BaseCommand):
+    help = 'Печатает все билеты сеанса (или выбранные билеты) в один PDF для кассы, по N билетов на лист A4'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--session', type=int, help='ID сеанса')
+        parser.add_argument('--ids', type=int, nargs='+', default=[], help='ID билетов')
+        parser.add_argument('--per-page', type=int, default=4, choices=sorted(SHEET_LAYOUTS),
+                            help='Билетов на лист (1 - отдельная страница A6 на билет)')
+        parser.add_argument('--no-cut-marks', action='store_true', help='Не рисовать линии разреза')
+        parser.add_argument('--output', required=True, help='Путь к итоговому PDF')
+
+    def handle(self, *args, **options):
+        if not options['session'] and not options['ids']:
+            raise CommandError('Укажите --session или --ids.')
+        tickets = КупленныеБилеты.objects.select_related('сеанс', 'место', 'клиент')
+        if options['session']:
+            if not СеансыФильмов.objects.filter(pk=options['session']).exists():
+                raise CommandError(f"Сеанс {options['session']} не найден.")
+            tickets = tickets.filter(сеанс_id=options['session'])
+        if options['ids']:
+            tickets = tickets.filter(pk__in=options['ids'])
+        tickets = tickets.order_by('сеанс__время_начала', 'место__номер_места')
+
+        started = time.perf_counter()
+        # iterator() не держит весь queryset в памяти
+        count = render_ticket_sheets(tickets.iterator(chunk_size=500), options['output'],
+                                     per_page=options['per_page'], cut_marks=not options['no_cut_marks'])
+        elapsed = time.perf_counter() - started
+        if not count:
+            self.stdout.write(self.style.WARNING('Билеты не найдены, PDF пустой.'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Напечатано билетов: {count} в {options['output']} за {elapsed:.1f} с ({count / elapsed:.1f} билетов/с)"
+        ))
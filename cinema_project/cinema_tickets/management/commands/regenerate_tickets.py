@@ -0,0 +1,170 @@
+# cinema_tickets/management/commands/regenerate_tickets.py
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time as dt_time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from cinema_tickets.models import КупленныеБилеты, Заказы
+from cinema_tickets.utils import discard_pdf, render_tickets_pdf, store_pdf
+
+
+def _init_worker():
+    # При запуске процессов через spawn Django нужно инициализировать заново
+    import django
+    django.setup()
+
+
+def _render_ticket(ticket):
+    """Выполняется в процессе пула: только отрисовка, без обращений к БД."""
+    return ticket.pk, render_tickets_pdf([ticket])
+
+
+def _render_order(item):
+    order_id, tickets = item
+    return order_id, render_tickets_pdf(tickets)
+
+
+# Билеты и заказы, у которых статус после новой генерации PDF устарел (как в обработчике задания PDF)
+STALE_STATUSES = (КупленныеБилеты.СТАТУС_ОЖИДАЕТ, КупленныеБилеты.СТАТУС_ОШИБКА)
+
+
+def _mark_rendered(queryset):
+    queryset.filter(статус__in=STALE_STATUSES).update(статус=КупленныеБилеты.СТАТУС_PDF_ГОТОВ, ошибка_обработки='')
+
+
+def _parse_date(value, end_of_day=False):
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Некорректная дата "{value}", ожидается ГГГГ-ММ-ДД.')
+    return timezone.make_aware(datetime.combine(day, dt_time.max if end_of_day else dt_time.min))
+
+
+class Command(BaseCommand):
+    help = ('Перегенерирует PDF билетов (например, после изменения макета или переноса сеанса) '
+            'в пуле процессов. Прогресс сохраняется, прерванный запуск можно продолжить с --resume.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--session', type=int, action='append', dest='sessions', default=[],
+                            help='ID сеанса (можно указать несколько раз)')
+        parser.add_argument('--from', dest='date_from', help='Сеансы, начинающиеся с даты ГГГГ-ММ-ДД')
+        parser.add_argument('--to', dest='date_to', help='Сеансы, начинающиеся до даты ГГГГ-ММ-ДД включительно')
+        parser.add_argument('--ids', type=int, nargs='+', default=[], help='ID билетов')
+        parser.add_argument('--all', action='store_true',
+                            help='Генерировать и те PDF, которых еще нет (по умолчанию - только существующие)')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Размер пула процессов')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Билетов в одной порции')
+        parser.add_argument('--state-file', default='regenerate_tickets.state.json',
+                            help='Файл с прогрессом для продолжения после прерывания')
+        parser.add_argument('--resume', action='store_true', help='Продолжить с места, сохраненного в --state-file')
+
+    def handle(self, *args, **options):
+        tickets = КупленныеБилеты.objects.all()
+        if options['sessions']:
+            tickets = tickets.filter(сеанс_id__in=options['sessions'])
+        if options['date_from']:
+            tickets = tickets.filter(сеанс__время_начала__gte=_parse_date(options['date_from']))
+        if options['date_to']:
+            tickets = tickets.filter(сеанс__время_начала__lte=_parse_date(options['date_to'], end_of_day=True))
+        if options['ids']:
+            tickets = tickets.filter(pk__in=options['ids'])
+
+        # Билеты групповых заказов не имеют своего PDF - перегенерируем PDF их заказов
+        orders = Заказы.objects.filter(pk__in=tickets.filter(заказ__isnull=False).values('заказ_id'))
+        tickets = tickets.filter(заказ__isnull=True)
+        if not options['all']:
+            tickets = tickets.exclude(pdf_файл='').exclude(pdf_файл__isnull=True)
+            orders = orders.exclude(pdf_файл='').exclude(pdf_файл__isnull=True)
+
+        # Фильтры сохраняются вместе с прогрессом: продолжение с другими фильтрами
+        # молча пропустило бы билеты с ID меньше сохраненного
+        filters = {'sessions': sorted(options['sessions']), 'date_from': options['date_from'],
+                   'date_to': options['date_to'], 'ids': sorted(options['ids']), 'all': options['all']}
+        state = {'filters': filters, 'last_ticket_id': 0, 'last_order_id': 0, 'done': 0}
+        state_file = options['state_file']
+        if options['resume'] and os.path.exists(state_file):
+            with open(state_file, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('filters') != filters:
+                raise CommandError(f'{state_file} сохранен с другими фильтрами ({saved.get("filters")}). '
+                                   f'Запустите с теми же параметрами или без --resume.')
+            state.update(saved)
+            self.stdout.write(f"Продолжаем: билеты после ID {state['last_ticket_id']}, "
+                              f"заказы после ID {state['last_order_id']}, уже готово {state['done']}")
+
+        total = (tickets.filter(pk__gt=state['last_ticket_id']).count()
+                 + orders.filter(pk__gt=state['last_order_id']).count())
+        self.stdout.write(f'К перегенерации: {total} PDF, процессов: {options["processes"]}')
+
+        self.started = time.perf_counter()
+        self.processed = 0
+        self.total = total
+        with ProcessPoolExecutor(max_workers=max(1, options['processes']), initializer=_init_worker) as pool:
+            self._run_tickets(pool, tickets, state, state_file, options['chunk_size'])
+            self._run_orders(pool, orders, state, state_file, options['chunk_size'])
+
+        elapsed = time.perf_counter() - self.started
+        if os.path.exists(state_file):
+            os.remove(state_file)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {self.processed} PDF за {elapsed:.1f} с ({self.processed / elapsed if elapsed else 0:.1f} PDF/с)'
+        ))
+
+    def _chunks(self, queryset, last_id, chunk_size):
+        """Порции по возрастанию ID (keyset), без OFFSET и без загрузки всего списка в память."""
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_id).order_by('pk')[:chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_id = chunk[-1].pk
+
+    def _run_tickets(self, pool, tickets, state, state_file, chunk_size):
+        tickets = tickets.select_related('сеанс', 'место', 'клиент')
+        for chunk in self._chunks(tickets, state['last_ticket_id'], chunk_size):
+            by_id = {ticket.pk: ticket for ticket in chunk}
+            old_names = {}
+            for ticket_id, pdf_data in pool.map(_render_ticket, chunk):
+                old_names[ticket_id] = store_pdf(by_id[ticket_id], f'ticket_{ticket_id}.pdf', pdf_data)
+            КупленныеБилеты.objects.bulk_update(chunk, ['pdf_файл'])
+            # Прежние файлы удаляются только после записи новых имен в БД
+            for ticket_id, old_name in old_names.items():
+                discard_pdf(by_id[ticket_id], old_name)
+            _mark_rendered(КупленныеБилеты.objects.filter(pk__in=list(by_id)))
+            state['last_ticket_id'] = chunk[-1].pk
+            self._checkpoint(state, state_file, len(chunk))
+
+    def _run_orders(self, pool, orders, state, state_file, chunk_size):
+        for chunk in self._chunks(orders, state['last_order_id'], chunk_size):
+            by_id = {order.pk: order for order in chunk}
+            order_tickets = {order.pk: [] for order in chunk}
+            for ticket in (КупленныеБилеты.objects.filter(заказ_id__in=list(by_id))
+                           .select_related('сеанс', 'место', 'клиент').order_by('место__номер_места')):
+                order_tickets[ticket.заказ_id].append(ticket)
+            old_names = {}
+            for order_id, pdf_data in pool.map(_render_order, order_tickets.items()):
+                old_names[order_id] = store_pdf(by_id[order_id], f'order_{order_id}.pdf', pdf_data)
+            Заказы.objects.bulk_update(chunk, ['pdf_файл'])
+            for order_id, old_name in old_names.items():
+                discard_pdf(by_id[order_id], old_name)
+            _mark_rendered(Заказы.objects.filter(pk__in=list(by_id)))
+            _mark_rendered(КупленныеБилеты.objects.filter(заказ_id__in=list(by_id)))
+            state['last_order_id'] = chunk[-1].pk
+            self._checkpoint(state, state_file, len(chunk))
+
+    def _checkpoint(self, state, state_file, count):
+        self.processed += count
+        state['done'] += count
+        # Записываем прогресс атомарно, чтобы прерывание не оставило битый файл
+        tmp_file = f'{state_file}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, state_file)
+
+        elapsed = time.perf_counter() - self.started
+        rate = self.processed / elapsed if elapsed else 0
+        self.stdout.write(f'  {self.processed}/{self.total} ({rate:.1f} PDF/с)')
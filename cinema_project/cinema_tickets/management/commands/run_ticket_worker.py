@@ -0,0 +1,74 @@
+# cinema_tickets/management/commands/run_ticket_worker.py
+import logging
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from cinema_tickets.jobs import claim_job, run_claimed_job
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркеры, выполняющие фоновые задания по билетам (генерация PDF, отправка email)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Количество потоков-воркеров')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Пауза (сек.) между опросами очереди, когда она пуста')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить все готовые задания и завершиться')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        stop_event = threading.Event()
+        stats = {'ok': 0, 'failed': 0}
+        stats_lock = threading.Lock()
+
+        def worker_loop():
+            try:
+                while not stop_event.is_set():
+                    try:
+                        close_old_connections()
+                        job = claim_job()
+                        if job is None:
+                            if options['once']:
+                                break
+                            stop_event.wait(options['poll_interval'])
+                            continue
+                        # Задания отправки email выполняются пачкой через одно соединение
+                        ok, failed = run_claimed_job(job)
+                        with stats_lock:
+                            stats['ok'] += ok
+                            stats['failed'] += failed
+                    except Exception:
+                        # Например, "database is locked" дольше таймаута ожидания: поток
+                        # не должен тихо завершиться, пока в очереди остаются задания.
+                        # Захваченное задание снова возьмут после STALE_JOB_TIMEOUT (jobs.py)
+                        logger.exception('Ошибка в воркере %s, повтор через %s с',
+                                         threading.current_thread().name, options['poll_interval'])
+                        connection.close()
+                        stop_event.wait(options['poll_interval'])
+            finally:
+                # У каждого потока свое соединение с БД
+                connection.close()
+
+        threads = [threading.Thread(target=worker_loop, name=f'ticket-worker-{i}', daemon=True)
+                   for i in range(workers)]
+        self.stdout.write(f'Запущено воркеров: {workers}')
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            self.stdout.write('Остановка воркеров...')
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Выполнено заданий: {stats['ok']}, завершилось ошибкой: {stats['failed']}"
+        ))
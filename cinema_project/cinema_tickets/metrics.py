@@ -0,0 +1,184 @@
+# cinema_tickets/metrics.py
+"""
+Метрики приложения и их выдача в текстовом формате Prometheus (GET /metrics).
+
+Значения хранятся в памяти процесса: запись метрики - это поиск корзины
+гистограммы и пара сложений под общей блокировкой, без обращений к БД или кэшу.
+При нескольких процессах (воркеры gunicorn, run_ticket_worker) каждый процесс
+отдает свои значения, Prometheus собирает их с каждого процесса отдельно.
+
+    MetricsMiddleware     - время ответа, число и время SQL запросов по view
+    cinema_render_stage_* - стадии генерации PDF и отправки писем (utils.render_stage)
+    счетчики              - конфликты за места (409), блокировки БД (dbretry), проходы
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from django.db import connection
+
+_lock = threading.Lock()
+_registry = []
+
+# Корзины времени (секунды): от миллисекунд до секунд
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+# Метод запроса задает клиент: остальные методы пишутся как 'other', чтобы
+# произвольные методы не порождали новые ряды метрики
+HTTP_METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Счетчик:
+    """Монотонный счетчик (тип counter) с необязательными метками."""
+    тип = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, _labels_text(self.labels, key), value
+
+
+class Гистограмма:
+    """Гистограмма (тип histogram): число наблюдений по корзинам, сумма и количество."""
+    тип = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # {метки: [счетчики по корзинам (последняя - +Inf), сумма]}
+        self._values = {}
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(labels[name] for name in self.labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield (f'{self.name}_bucket',
+                       _labels_text(self.labels, key, [('le', _format_number(bound))]), cumulative)
+            yield f'{self.name}_sum', _labels_text(self.labels, key), total
+            yield f'{self.name}_count', _labels_text(self.labels, key), cumulative
+
+
+def render_metrics():
+    """Все метрики процесса в текстовом формате Prometheus (версия 0.0.4)."""
+    lines = []
+    with _lock:
+        for metric in _registry:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.тип}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- Метрики приложения ---
+
+http_request_duration = Гистограмма(
+    'cinema_http_request_duration_seconds', 'Время обработки запроса (до возврата ответа view).',
+    labels=('view', 'method', 'status'))
+http_request_queries = Гистограмма(
+    'cinema_http_request_db_queries', 'Число SQL запросов за один HTTP запрос.',
+    labels=('view',), buckets=QUERY_COUNT_BUCKETS)
+http_request_db_time = Гистограмма(
+    'cinema_http_request_db_seconds', 'Суммарное время SQL запросов за один HTTP запрос.',
+    labels=('view',))
+render_stage_duration = Гистограмма(
+    'cinema_render_stage_seconds', 'Время стадий генерации PDF и отправки писем.',
+    labels=('stage',))
+seat_conflicts = Счетчик(
+    'cinema_seat_conflicts_total', 'Отказы 409 из-за занятого места: held - удержано другим покупателем, '
+    'sold - уже продано.', labels=('endpoint', 'reason'))
+db_lock_errors = Счетчик(
+    'cinema_db_lock_errors_total', 'Ошибки "database is locked": retried - транзакция повторена, '
+    'gave_up - попытки исчерпаны (ответ 503).', labels=('outcome',))
+checkins = Счетчик(
+    'cinema_checkins_total', 'Сканы билетов на входе: admitted, already_admitted, not_found.',
+    labels=('result',))
+
+
+def observe_stage(name, seconds):
+    """Наблюдатель стадий для utils.add_stage_observer (подключается в CinemaTicketsConfig.ready)."""
+    render_stage_duration.observe(seconds, stage=name)
+
+
+class MetricsMiddleware:
+    """
+    Время ответа, число и время SQL запросов по имени view. Метка view - имя
+    маршрута (cinema_tickets:purchase_ticket, admin:index), а не путь, чтобы
+    число рядов метрики не росло с числом билетов и клиентов.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0, 0.0]
+
+        def count_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries[0] += 1
+                queries[1] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        http_request_duration.observe(elapsed, view=view, method=method,
+                                      status=f'{response.status_code // 100}xx')
+        http_request_queries.observe(queries[0], view=view)
+        http_request_db_time.observe(queries[1], view=view)
+        return response
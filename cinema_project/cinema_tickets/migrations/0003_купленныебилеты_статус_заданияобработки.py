@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def mark_existing_tickets_rendered(apps, schema_editor):
+    # Билеты, купленные до появления очереди, уже имеют PDF
+    КупленныеБилеты = apps.get_model('cinema_tickets', 'КупленныеБилеты')
+    КупленныеБилеты.objects.exclude(pdf_файл='').exclude(pdf_файл__isnull=True).update(статус='rendered')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_tickets', '0002_купленныебилеты_email_получателя_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='купленныебилеты',
+            name='статус',
+            field=models.CharField(choices=[('pending', 'Ожидает обработки'), ('rendered', 'PDF сгенерирован'), ('sent', 'Отправлен на email'), ('failed', 'Ошибка обработки')], default='pending', max_length=20, verbose_name='Статус обработки'),
+        ),
+        migrations.RunPython(mark_existing_tickets_rendered, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ЗаданияОбработки',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('тип', models.CharField(choices=[('render', 'Генерация PDF'), ('email', 'Отправка email')], max_length=20, verbose_name='Тип задания')),
+                ('параметры', models.JSONField(blank=True, default=dict, verbose_name='Параметры')),
+                ('статус', models.CharField(choices=[('pending', 'Ожидает'), ('running', 'Выполняется'), ('done', 'Выполнено'), ('retry', 'Ожидает повтора'), ('dead', 'Не выполнено (исчерпаны попытки)')], default='pending', max_length=20, verbose_name='Статус')),
+                ('попытки', models.PositiveIntegerField(default=0, verbose_name='Выполнено попыток')),
+                ('макс_попыток', models.PositiveIntegerField(default=5, verbose_name='Максимум попыток')),
+                ('выполнить_после', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Выполнить не раньше')),
+                ('последняя_ошибка', models.TextField(blank=True, default='', verbose_name='Последняя ошибка')),
+                ('создано', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('обновлено', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('билет', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='задания', to='cinema_tickets.купленныебилеты', verbose_name='Билет')),
+            ],
+            options={
+                'verbose_name': 'Задание обработки',
+                'verbose_name_plural': 'Задания обработки',
+                'ordering': ['выполнить_после', 'id'],
+                'indexes': [models.Index(fields=['статус', 'выполнить_после'], name='задания_статус_время_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_tickets', '0003_купленныебилеты_статус_заданияобработки'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='купленныебилеты',
+            name='ошибка_обработки',
+            field=models.TextField(blank=True, default='', verbose_name='Ошибка обработки'),
+        ),
+    ]
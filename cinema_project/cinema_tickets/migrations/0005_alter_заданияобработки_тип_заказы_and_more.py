@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_tickets', '0004_купленныебилеты_ошибка_обработки'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='заданияобработки',
+            name='тип',
+            field=models.CharField(choices=[('render', 'Генерация PDF'), ('email', 'Отправка email'), ('render_order', 'Генерация PDF заказа'), ('email_order', 'Отправка email по заказу')], max_length=20, verbose_name='Тип задания'),
+        ),
+        migrations.CreateModel(
+            name='Заказы',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('дата_создания', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('email_получателя', models.EmailField(blank=True, max_length=254, null=True, verbose_name='Email получателя при покупке')),
+                ('pdf_файл', models.FileField(blank=True, null=True, upload_to='orders/', verbose_name='PDF со всеми билетами')),
+                ('статус', models.CharField(choices=[('pending', 'Ожидает обработки'), ('rendered', 'PDF сгенерирован'), ('sent', 'Отправлен на email'), ('failed', 'Ошибка обработки')], default='pending', max_length=20, verbose_name='Статус обработки')),
+                ('ошибка_обработки', models.TextField(blank=True, default='', verbose_name='Ошибка обработки')),
+                ('клиент', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='cinema_tickets.физическиелица', verbose_name='Клиент')),
+                ('сеанс', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='cinema_tickets.сеансыфильмов', verbose_name='Сеанс')),
+            ],
+            options={
+                'verbose_name': 'Заказ',
+                'verbose_name_plural': 'Заказы',
+                'ordering': ['-дата_создания'],
+            },
+        ),
+        migrations.AddField(
+            model_name='купленныебилеты',
+            name='заказ',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='билеты', to='cinema_tickets.заказы', verbose_name='Заказ'),
+        ),
+    ]
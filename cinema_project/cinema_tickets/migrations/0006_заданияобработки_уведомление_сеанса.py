@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_tickets', '0005_alter_заданияобработки_тип_заказы_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='заданияобработки',
+            name='тип',
+            field=models.CharField(choices=[('render', 'Генерация PDF'), ('email', 'Отправка email'), ('render_order', 'Генерация PDF заказа'), ('email_order', 'Отправка email по заказу'), ('notify_session', 'Рассылка об изменении сеанса')], max_length=20, verbose_name='Тип задания'),
+        ),
+    ]
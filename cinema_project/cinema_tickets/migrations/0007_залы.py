@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+DEFAULT_HALL_NAME = 'Основной зал'
+
+
+def assign_default_hall(apps, schema_editor):
+    # До появления залов был один зал: все существующие места и сеансы относятся к нему
+    Залы = apps.get_model('cinema_tickets', 'Залы')
+    МестаВЗале = apps.get_model('cinema_tickets', 'МестаВЗале')
+    СеансыФильмов = apps.get_model('cinema_tickets', 'СеансыФильмов')
+    if not (МестаВЗале.objects.exists() or СеансыФильмов.objects.exists()):
+        return
+    зал, _ = Залы.objects.get_or_create(название=DEFAULT_HALL_NAME)
+    МестаВЗале.objects.filter(зал__isnull=True).update(зал=зал)
+    СеансыФильмов.objects.filter(зал__isnull=True).update(зал=зал)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_tickets', '0006_заданияобработки_уведомление_сеанса'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Залы',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('название', models.CharField(max_length=100, unique=True, verbose_name='Название')),
+            ],
+            options={
+                'verbose_name': 'Зал',
+                'verbose_name_plural': 'Залы',
+                'ordering': ['название'],
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='меставзале',
+            options={'ordering': ['зал', 'номер_места'], 'verbose_name': 'Место в зале', 'verbose_name_plural': 'Места в зале'},
+        ),
+        migrations.AlterField(
+            model_name='меставзале',
+            name='номер_места',
+            field=models.PositiveIntegerField(verbose_name='Номер места'),
+        ),
+        migrations.AddField(
+            model_name='меставзале',
+            name='секция',
+            field=models.CharField(blank=True, default='', max_length=50, verbose_name='Секция'),
+        ),
+        migrations.AddField(
+            model_name='меставзале',
+            name='ряд',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Ряд'),
+        ),
+        migrations.AddField(
+            model_name='меставзале',
+            name='место_в_ряду',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Место в ряду'),
+        ),
+        migrations.AddField(
+            model_name='меставзале',
+            name='зал',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='места', to='cinema_tickets.залы', verbose_name='Зал'),
+        ),
+        migrations.AddField(
+            model_name='сеансыфильмов',
+            name='зал',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='сеансы', to='cinema_tickets.залы', verbose_name='Зал'),
+        ),
+        migrations.RunPython(assign_default_hall, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='меставзале',
+            name='зал',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='места', to='cinema_tickets.залы', verbose_name='Зал'),
+        ),
+        migrations.AlterField(
+            model_name='сеансыфильмов',
+            name='зал',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='сеансы', to='cinema_tickets.залы', verbose_name='Зал'),
+        ),
+        migrations.AddConstraint(
+            model_name='меставзале',
+            constraint=models.UniqueConstraint(fields=('зал', 'номер_места'), name='место_уникально_в_зале'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_tickets', '0007_залы'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='сеансыфильмов',
+            index=models.Index(fields=['время_начала', 'id'], name='сеансы_начало_id_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_tickets', '0008_сеансы_начало_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='купленныебилеты',
+            index=models.Index(fields=['клиент', '-дата_покупки', '-id'], name='билеты_клиент_дата_idx'),
+        ),
+    ]
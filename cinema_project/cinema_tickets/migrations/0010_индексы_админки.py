@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_tickets', '0009_билеты_клиент_дата_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='купленныебилеты',
+            name='email_получателя',
+            field=models.EmailField(blank=True, db_index=True, max_length=254, null=True, verbose_name='Email получателя при покупке'),
+        ),
+        migrations.AlterField(
+            model_name='физическиелица',
+            name='фамилия',
+            field=models.CharField(db_index=True, max_length=100, verbose_name='Фамилия'),
+        ),
+        migrations.AddIndex(
+            model_name='купленныебилеты',
+            index=models.Index(fields=['-дата_покупки', '-id'], name='билеты_дата_покупки_idx'),
+        ),
+    ]
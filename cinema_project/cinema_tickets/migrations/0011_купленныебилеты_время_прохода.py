@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_tickets', '0010_индексы_админки'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='купленныебилеты',
+            name='время_прохода',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Время прохода'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:56
+
+import cinema_tickets.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_tickets', '0011_купленныебилеты_время_прохода'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='заказы',
+            name='pdf_файл',
+            field=models.FileField(blank=True, null=True, storage=cinema_tickets.storage.ХранилищеPDF(), upload_to=cinema_tickets.storage.order_pdf_path, verbose_name='PDF со всеми билетами'),
+        ),
+        migrations.AlterField(
+            model_name='купленныебилеты',
+            name='pdf_файл',
+            field=models.FileField(blank=True, null=True, storage=cinema_tickets.storage.ХранилищеPDF(), upload_to=cinema_tickets.storage.ticket_pdf_path, verbose_name='PDF Билет'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:01
+
+import cinema_tickets.storage
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_tickets', '0012_хранилище_pdf'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='АрхивБилетов',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID билета')),
+                ('дата_покупки', models.DateTimeField(verbose_name='Дата покупки')),
+                ('pdf_файл', models.FileField(blank=True, null=True, storage=cinema_tickets.storage.ХранилищеPDF(), upload_to=cinema_tickets.storage.ticket_pdf_path, verbose_name='PDF Билет')),
+                ('email_получателя', models.EmailField(blank=True, max_length=254, null=True, verbose_name='Email получателя при покупке')),
+                ('статус', models.CharField(choices=[('pending', 'Ожидает обработки'), ('rendered', 'PDF сгенерирован'), ('sent', 'Отправлен на email'), ('failed', 'Ошибка обработки')], max_length=20, verbose_name='Статус обработки')),
+                ('ошибка_обработки', models.TextField(blank=True, default='', verbose_name='Ошибка обработки')),
+                ('время_прохода', models.DateTimeField(blank=True, null=True, verbose_name='Время прохода')),
+                ('дата_архивации', models.DateTimeField(auto_now_add=True, verbose_name='Дата архивации')),
+                ('заказ', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='архивные_билеты', to='cinema_tickets.заказы', verbose_name='Заказ')),
+                ('клиент', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='архивные_билеты', to='cinema_tickets.физическиелица', verbose_name='Клиент')),
+                ('место', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='архивные_билеты', to='cinema_tickets.меставзале', verbose_name='Место')),
+                ('сеанс', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='архивные_билеты', to='cinema_tickets.сеансыфильмов', verbose_name='Сеанс')),
+            ],
+            options={
+                'verbose_name': 'Архивный билет',
+                'verbose_name_plural': 'Архив билетов',
+                'ordering': ['-дата_покупки'],
+                'indexes': [models.Index(fields=['клиент', '-дата_покупки', '-id'], name='архив_клиент_дата_idx')],
+            },
+        ),
+    ]
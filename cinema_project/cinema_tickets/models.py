@@ -1,10 +1,13 @@
 # cinema_tickets/models.py
 from django.db import models
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from datetime import timedelta
 
+from .storage import order_pdf_path, pdf_storage, ticket_pdf_path
+
 class ФизическиеЛица(models.Model):
-    фамилия = models.CharField("Фамилия", max_length=100)
+    фамилия = models.CharField("Фамилия", max_length=100, db_index=True) # Поиск клиента в админке
     имя = models.CharField("Имя", max_length=100)
     отчество = models.CharField("Отчество", max_length=100, blank=True, null=True)
     номер_телефона = models.CharField("Номер телефона", max_length=20, unique=True)
@@ -23,7 +26,23 @@ class ФизическиеЛица(models.Model):
         verbose_name_plural = "Физические лица"
         ordering = ['фамилия', 'имя']
 
+class Залы(models.Model):
+    """Кинозал. Места и сеансы привязаны к залу, занятость мест считается по залу сеанса."""
+    # Зал, в который попали места и сеансы, созданные до появления залов
+    НАЗВАНИЕ_ПО_УМОЛЧАНИЮ = 'Основной зал'
+
+    название = models.CharField("Название", max_length=100, unique=True)
+
+    def __str__(self):
+        return self.название
+
+    class Meta:
+        verbose_name = "Зал"
+        verbose_name_plural = "Залы"
+        ordering = ['название']
+
 class СеансыФильмов(models.Model):
+    зал = models.ForeignKey(Залы, on_delete=models.PROTECT, related_name='сеансы', verbose_name="Зал")
     название_фильма = models.CharField("Название фильма", max_length=200)
     время_начала = models.DateTimeField("Время начала")
     время_окончания = models.DateTimeField("Время окончания")
@@ -55,9 +74,28 @@ class СеансыФильмов(models.Model):
         verbose_name = "Сеанс фильма"
         verbose_name_plural = "Сеансы фильмов"
         ordering = ['время_начала']
+        indexes = [
+            # Ключ пагинации списка ближайших сеансов (listing.py)
+            models.Index(fields=['время_начала', 'id'], name='сеансы_начало_id_idx'),
+        ]
 
 class МестаВЗале(models.Model):
-    номер_места = models.PositiveIntegerField("Номер места", unique=True)
+    зал = models.ForeignKey(Залы, on_delete=models.PROTECT, related_name='места', verbose_name="Зал")
+    # Сквозной номер места в зале: по нему места выбираются при покупке и в карте занятости
+    номер_места = models.PositiveIntegerField("Номер места")
+    # Положение в схеме зала (у мест, созданных без схемы, не заполнено)
+    секция = models.CharField("Секция", max_length=50, blank=True, default='')
+    ряд = models.PositiveIntegerField("Ряд", blank=True, null=True)
+    место_в_ряду = models.PositiveIntegerField("Место в ряду", blank=True, null=True)
+
+    @property
+    def обозначение(self):
+        """Место так, как его ищет зритель: "Балкон, ряд 3, место 7" или "№27"."""
+        if self.ряд is None or self.место_в_ряду is None:
+            return f"№{self.номер_места}"
+        parts = [self.секция] if self.секция else []
+        parts.append(f"ряд {self.ряд}, место {self.место_в_ряду}")
+        return ", ".join(parts)
 
     def __str__(self):
         return f"Место №{self.номер_места}"
@@ -65,17 +103,45 @@ class МестаВЗале(models.Model):
     class Meta:
         verbose_name = "Место в зале"
         verbose_name_plural = "Места в зале"
-        ordering = ['номер_места']
+        ordering = ['зал', 'номер_места']
+        constraints = [
+            models.UniqueConstraint(fields=['зал', 'номер_места'], name='место_уникально_в_зале'),
+        ]
 
 class КупленныеБилеты(models.Model):
+    # Статусы фоновой обработки билета (PDF + email), клиент может их опрашивать
+    СТАТУС_ОЖИДАЕТ = 'pending'
+    СТАТУС_PDF_ГОТОВ = 'rendered'
+    СТАТУС_ОТПРАВЛЕН = 'sent'
+    СТАТУС_ОШИБКА = 'failed'
+    СТАТУСЫ = [
+        (СТАТУС_ОЖИДАЕТ, 'Ожидает обработки'),
+        (СТАТУС_PDF_ГОТОВ, 'PDF сгенерирован'),
+        (СТАТУС_ОТПРАВЛЕН, 'Отправлен на email'),
+        (СТАТУС_ОШИБКА, 'Ошибка обработки'),
+    ]
+
     клиент = models.ForeignKey(ФизическиеЛица, on_delete=models.PROTECT, verbose_name="Клиент")
     сеанс = models.ForeignKey(СеансыФильмов, on_delete=models.PROTECT, verbose_name="Сеанс")
     место = models.ForeignKey(МестаВЗале, on_delete=models.PROTECT, verbose_name="Место")
     дата_покупки = models.DateTimeField("Дата покупки", auto_now_add=True)
-    pdf_файл = models.FileField("PDF Билет", upload_to='tickets/', blank=True, null=True)
+    # Раскладка по каталогам по ID и чтение из пакетов прошедших сеансов - см. storage.py
+    pdf_файл = models.FileField("PDF Билет", upload_to=ticket_pdf_path, storage=pdf_storage, blank=True, null=True)
     # <-- Новое поле для хранения email, на который был отправлен билет -->
     # Это полезно, т.к. email клиента в ФизическиеЛица может измениться позже
-    email_получателя = models.EmailField("Email получателя при покупке", blank=True, null=True)
+    email_получателя = models.EmailField("Email получателя при покупке", blank=True, null=True, db_index=True)
+    статус = models.CharField("Статус обработки", max_length=20, choices=СТАТУСЫ, default=СТАТУС_ОЖИДАЕТ)
+    # Последняя ошибка генерации PDF/отправки email (покупка при этом не откатывается)
+    ошибка_обработки = models.TextField("Ошибка обработки", blank=True, default='')
+    # Билеты групповой покупки имеют общий PDF в заказе
+    заказ = models.ForeignKey('Заказы', on_delete=models.PROTECT, null=True, blank=True,
+                              related_name='билеты', verbose_name="Заказ")
+    # Первый проход по билету на входе (условный UPDATE при скане, см. checkin.py)
+    время_прохода = models.DateTimeField("Время прохода", null=True, blank=True)
+
+    def clean(self):
+        if self.сеанс_id and self.место_id and self.место.зал_id != self.сеанс.зал_id:
+            raise ValidationError("Место находится в другом зале, чем сеанс.")
 
     def __str__(self):
         return f"Билет №{self.id} - {self.клиент} на {self.сеанс}"
@@ -84,4 +150,126 @@ class КупленныеБилеты(models.Model):
         verbose_name = "Купленный билет"
         verbose_name_plural = "Купленные билеты"
         unique_together = ('сеанс', 'место')
-        ordering = ['-дата_покупки']
\ No newline at end of file
+        ordering = ['-дата_покупки']
+        indexes = [
+            # Ключ пагинации билетов клиента (api/clients/<id>/tickets/)
+            models.Index(fields=['клиент', '-дата_покупки', '-id'], name='билеты_клиент_дата_idx'),
+            # Порядок списка билетов в админке и фильтр по дате покупки
+            models.Index(fields=['-дата_покупки', '-id'], name='билеты_дата_покупки_idx'),
+        ]
+
+class Заказы(models.Model):
+    """Групповая покупка нескольких мест на один сеанс: один PDF и одно письмо на заказ."""
+    клиент = models.ForeignKey(ФизическиеЛица, on_delete=models.PROTECT, verbose_name="Клиент")
+    сеанс = models.ForeignKey(СеансыФильмов, on_delete=models.PROTECT, verbose_name="Сеанс")
+    дата_создания = models.DateTimeField("Дата создания", auto_now_add=True)
+    email_получателя = models.EmailField("Email получателя при покупке", blank=True, null=True)
+    pdf_файл = models.FileField("PDF со всеми билетами", upload_to=order_pdf_path, storage=pdf_storage,
+                                blank=True, null=True)
+    статус = models.CharField("Статус обработки", max_length=20, choices=КупленныеБилеты.СТАТУСЫ,
+                              default=КупленныеБилеты.СТАТУС_ОЖИДАЕТ)
+    ошибка_обработки = models.TextField("Ошибка обработки", blank=True, default='')
+
+    def __str__(self):
+        return f"Заказ №{self.id} - {self.клиент} на {self.сеанс}"
+
+    class Meta:
+        verbose_name = "Заказ"
+        verbose_name_plural = "Заказы"
+        ordering = ['-дата_создания']
+
+
+class АрхивБилетов(models.Model):
+    """
+    Билеты прошедших сеансов, перенесенные из КупленныеБилеты командой
+    manage.py archive_tickets, чтобы рабочая таблица содержала только
+    актуальные продажи. ID билета сохраняется: ссылки на PDF и коды
+    архивных билетов продолжают работать (см. archive.find_ticket).
+    """
+    СТАТУС_ОЖИДАЕТ = КупленныеБилеты.СТАТУС_ОЖИДАЕТ
+    СТАТУС_PDF_ГОТОВ = КупленныеБилеты.СТАТУС_PDF_ГОТОВ
+
+    id = models.BigIntegerField("ID билета", primary_key=True)
+    клиент = models.ForeignKey(ФизическиеЛица, on_delete=models.PROTECT, related_name='архивные_билеты',
+                               verbose_name="Клиент")
+    сеанс = models.ForeignKey(СеансыФильмов, on_delete=models.PROTECT, related_name='архивные_билеты',
+                              verbose_name="Сеанс")
+    место = models.ForeignKey(МестаВЗале, on_delete=models.PROTECT, related_name='архивные_билеты',
+                              verbose_name="Место")
+    дата_покупки = models.DateTimeField("Дата покупки")
+    pdf_файл = models.FileField("PDF Билет", upload_to=ticket_pdf_path, storage=pdf_storage, blank=True, null=True)
+    email_получателя = models.EmailField("Email получателя при покупке", blank=True, null=True)
+    статус = models.CharField("Статус обработки", max_length=20, choices=КупленныеБилеты.СТАТУСЫ)
+    ошибка_обработки = models.TextField("Ошибка обработки", blank=True, default='')
+    заказ = models.ForeignKey(Заказы, on_delete=models.PROTECT, null=True, blank=True,
+                              related_name='архивные_билеты', verbose_name="Заказ")
+    время_прохода = models.DateTimeField("Время прохода", null=True, blank=True)
+    дата_архивации = models.DateTimeField("Дата архивации", auto_now_add=True)
+
+    def __str__(self):
+        return f"Архивный билет №{self.id} - {self.клиент} на {self.сеанс}"
+
+    class Meta:
+        verbose_name = "Архивный билет"
+        verbose_name_plural = "Архив билетов"
+        ordering = ['-дата_покупки']
+        indexes = [
+            # Ключ пагинации билетов клиента вместе с архивом (api/clients/<id>/tickets/?archive=1)
+            models.Index(fields=['клиент', '-дата_покупки', '-id'], name='архив_клиент_дата_idx'),
+        ]
+
+
+class ЗаданияОбработки(models.Model):
+    """
+    Очередь фоновых заданий (генерация PDF, отправка email), хранится в БД.
+    Задания выполняет команда manage.py run_ticket_worker.
+    """
+    ТИП_PDF = 'render'
+    ТИП_EMAIL = 'email'
+    ТИП_PDF_ЗАКАЗА = 'render_order'
+    ТИП_EMAIL_ЗАКАЗА = 'email_order'
+    ТИП_УВЕДОМЛЕНИЕ_СЕАНСА = 'notify_session'
+    ТИПЫ = [
+        (ТИП_PDF, 'Генерация PDF'),
+        (ТИП_EMAIL, 'Отправка email'),
+        (ТИП_PDF_ЗАКАЗА, 'Генерация PDF заказа'),
+        (ТИП_EMAIL_ЗАКАЗА, 'Отправка email по заказу'),
+        (ТИП_УВЕДОМЛЕНИЕ_СЕАНСА, 'Рассылка об изменении сеанса'),
+    ]
+
+    СТАТУС_ОЖИДАЕТ = 'pending'
+    СТАТУС_ВЫПОЛНЯЕТСЯ = 'running'
+    СТАТУС_ВЫПОЛНЕНО = 'done'
+    СТАТУС_ОТЛОЖЕНО = 'retry'
+    СТАТУС_МЕРТВОЕ = 'dead'
+    СТАТУСЫ = [
+        (СТАТУС_ОЖИДАЕТ, 'Ожидает'),
+        (СТАТУС_ВЫПОЛНЯЕТСЯ, 'Выполняется'),
+        (СТАТУС_ВЫПОЛНЕНО, 'Выполнено'),
+        (СТАТУС_ОТЛОЖЕНО, 'Ожидает повтора'),
+        (СТАТУС_МЕРТВОЕ, 'Не выполнено (исчерпаны попытки)'),
+    ]
+
+    тип = models.CharField("Тип задания", max_length=20, choices=ТИПЫ)
+    билет = models.ForeignKey(КупленныеБилеты, on_delete=models.CASCADE, null=True, blank=True,
+                              related_name='задания', verbose_name="Билет")
+    параметры = models.JSONField("Параметры", default=dict, blank=True)
+    статус = models.CharField("Статус", max_length=20, choices=СТАТУСЫ, default=СТАТУС_ОЖИДАЕТ)
+    попытки = models.PositiveIntegerField("Выполнено попыток", default=0)
+    макс_попыток = models.PositiveIntegerField("Максимум попыток", default=5)
+    выполнить_после = models.DateTimeField("Выполнить не раньше", default=timezone.now)
+    последняя_ошибка = models.TextField("Последняя ошибка", blank=True, default='')
+    создано = models.DateTimeField("Создано", auto_now_add=True)
+    обновлено = models.DateTimeField("Обновлено", auto_now=True)
+
+    def __str__(self):
+        return f"Задание №{self.id} ({self.get_тип_display()}, {self.get_статус_display()})"
+
+    class Meta:
+        verbose_name = "Задание обработки"
+        verbose_name_plural = "Задания обработки"
+        ordering = ['выполнить_после', 'id']
+        indexes = [
+            # Выборка готовых к выполнению заданий воркером
+            models.Index(fields=['статус', 'выполнить_после'], name='задания_статус_время_idx'),
+        ]
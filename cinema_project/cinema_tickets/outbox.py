@@ -0,0 +1,146 @@
+# cinema_tickets/outbox.py
+"""
+Пакетная отправка писем через одно соединение с почтовым сервером.
+
+EmailMessage.send() открывает и закрывает соединение (для SMTP - TCP, TLS,
+авторизация) на каждое письмо. ПочтовыйЯщик копит письма и отправляет их
+пачками: на пачку открывается одно соединение get_connection(), а письма
+уходят по одному через send_messages, чтобы ошибка одного адреса не роняла
+остальные и результат был известен для каждого письма.
+"""
+import smtplib
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+from .models import КупленныеБилеты, Заказы
+from .utils import build_session_change_email, render_stage
+
+DEFAULT_BATCH_SIZE = 50
+
+
+def email_batch_size():
+    return getattr(settings, 'TICKET_EMAIL_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+class ПочтовыйЯщик:
+    """
+    Очередь исходящих писем. add() добавляет письмо с ключом (например, ID
+    задания), при наборе batch_size писем пачка отправляется автоматически.
+    Результаты копятся в results как пары (ключ, ошибка или None).
+
+        with ПочтовыйЯщик() as outbox:
+            for message in messages:
+                outbox.add(message)
+        print(outbox.sent, outbox.rate)
+    """
+
+    def __init__(self, batch_size=None, backend=None):
+        self.batch_size = max(1, batch_size or email_batch_size())
+        self.backend = backend
+        self._queue = []
+        self.results = []
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def rate(self):
+        """Писем в секунду (по времени, проведенному в отправке)."""
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def add(self, message, key=None):
+        self._queue.append((key, message))
+        if len(self._queue) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Отправляет накопленные письма одной пачкой. Возвращает результаты этой пачки."""
+        batch, self._queue = self._queue, []
+        if not batch:
+            return []
+        started = time.perf_counter()
+        connection = get_connection(self.backend, fail_silently=False)
+        results = []
+        try:
+            connection_error = self._open(connection)
+            for key, message in batch:
+                if connection_error is not None:
+                    results.append((key, connection_error))
+                    continue
+                error, broken = self._send(connection, message)
+                results.append((key, error))
+                if broken:
+                    # Соединение могло разорваться - переоткрываем для остальных писем
+                    connection.close()
+                    connection_error = self._open(connection)
+        finally:
+            connection.close()
+        self.elapsed += time.perf_counter() - started
+        self.batches += 1
+        for key, error in results:
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+                print(f"Письмо {key if key is not None else ''} не отправлено: {error}")
+        self.results.extend(results)
+        return results
+
+    @staticmethod
+    def _open(connection):
+        try:
+            with render_stage('email_connect'):
+                connection.open()
+        except Exception as e:
+            return f"Нет соединения с почтовым сервером: {e}"
+        return None
+
+    @staticmethod
+    def _send(connection, message):
+        """Возвращает (ошибка или None, нужно ли переоткрыть соединение)."""
+        try:
+            with render_stage('email_send'):
+                sent = connection.send_messages([message])
+            if not sent:
+                return "Почтовый сервер не принял письмо", False
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+            # Сервер отказал в этом письме, но соединение осталось рабочим
+            return str(e), False
+        except Exception as e:
+            return str(e) or type(e).__name__, True
+        return None, False
+
+
+def session_recipients(session):
+    """Адреса всех держателей билетов сеанса (без повторов), в стабильном порядке."""
+    emails = set(КупленныеБилеты.objects.filter(сеанс=session).exclude(email_получателя__isnull=True)
+                 .exclude(email_получателя='').values_list('email_получателя', flat=True))
+    emails.update(Заказы.objects.filter(сеанс=session).exclude(email_получателя__isnull=True)
+                  .exclude(email_получателя='').values_list('email_получателя', flat=True))
+    return sorted(emails)
+
+
+def notify_session_change(session, message='', emails=None, batch_size=None):
+    """
+    Рассылает письмо об изменении сеанса каждому держателю билета
+    (по одному письму на адрес). Возвращает ПочтовыйЯщик со статистикой.
+    """
+    if emails is None:
+        emails = session_recipients(session)
+    with ПочтовыйЯщик(batch_size=batch_size) as outbox:
+        for email in emails:
+            outbox.add(build_session_change_email(session, email, message), key=email)
+    return outbox
@@ -0,0 +1,205 @@
+# cinema_tickets/pdfcompact.py
+"""
+Компактный профиль PDF билетов (TICKET_PDF_PROFILE = 'compact', включается явно).
+
+Больше всего места в PDF билета занимает шрифт: ReportLab встраивает
+подмножество DejaVuSans только с нужными глифами, но копирует в него хинтинг
+(таблицы cvt/fpgm/prep и инструкции каждого глифа) и всю таблицу name с
+текстом лицензии. Для PDF хинтинг не нужен - глифы растеризуются при любом
+масштабе без него, - поэтому в компактном профиле подмножество шрифта
+пересобирается без хинтинга и с минимальной таблицей name.
+
+Кроме того:
+- сжатие потоков страниц включается явно для каждого Canvas (pageCompression);
+  глобальные настройки rl_config не трогаются - PDF рисуются и в потоках;
+- QR и штрихкод в режиме 'image' встраиваются 1-битными картинками
+  "один пиксель на модуль" вместо RGB PNG в экранном разрешении.
+
+Профиль опирается на внутренности ReportLab (подмена face.makeSubset,
+PDFDocument.idToObject/addForm, Canvas._formsinuse), поэтому работает только с
+проверенными версиями COMPACT_REPORTLAB_VERSIONS. С другой версией PDF рисуются
+по профилю 'standard', а manage.py check предупреждает об этом.
+"""
+import struct
+import threading
+import zlib
+
+import reportlab
+from django.conf import settings
+from reportlab.pdfbase import pdfdoc
+from reportlab.pdfbase.ttfonts import TTFont, TTFontMaker
+
+# Составной глиф: флаги компонентов (спецификация TrueType, таблица glyf)
+_ARG_1_AND_2_ARE_WORDS = 0x0001
+_WE_HAVE_A_SCALE = 0x0008
+_MORE_COMPONENTS = 0x0020
+_WE_HAVE_AN_X_AND_Y_SCALE = 0x0040
+_WE_HAVE_A_TWO_BY_TWO = 0x0080
+_WE_HAVE_INSTRUCTIONS = 0x0100
+
+_HINTING_TABLES = ('cvt ', 'fpgm', 'prep')
+
+# Версии ReportLab, с которыми компактный профиль проверен (префиксы reportlab.Version)
+COMPACT_REPORTLAB_VERSIONS = ('5.0.',)
+
+
+def pdf_profile():
+    """Профиль PDF: 'standard' - как раньше, 'compact' - см. описание модуля."""
+    return getattr(settings, 'TICKET_PDF_PROFILE', 'standard')
+
+
+def compact_supported():
+    return reportlab.Version.startswith(COMPACT_REPORTLAB_VERSIONS)
+
+
+def is_compact():
+    return pdf_profile() == 'compact' and compact_supported()
+
+
+def _read_tables(data):
+    num_tables = struct.unpack('>H', data[4:6])[0]
+    tables = {}
+    for i in range(num_tables):
+        tag, _, offset, length = struct.unpack('>4sLLL', data[12 + 16 * i:28 + 16 * i])
+        tables[tag.decode('latin1')] = data[offset:offset + length]
+    return tables
+
+
+def _strip_glyph(glyph):
+    """Глиф без инструкций хинтинга."""
+    if len(glyph) < 10:
+        return glyph
+    contours = struct.unpack('>h', glyph[:2])[0]
+    if contours >= 0:
+        # Простой глиф: после концов контуров - длина инструкций и сами инструкции
+        start = 10 + 2 * contours
+        length = struct.unpack('>H', glyph[start:start + 2])[0]
+        return glyph[:start] + b'\0\0' + glyph[start + 2 + length:]
+    # Составной глиф: инструкции идут после последнего компонента, если у него есть флаг
+    position = 10
+    while True:
+        flags = struct.unpack('>H', glyph[position:position + 2])[0]
+        flags_at = position
+        position += 4 + (4 if flags & _ARG_1_AND_2_ARE_WORDS else 2)
+        if flags & _WE_HAVE_A_SCALE:
+            position += 2
+        elif flags & _WE_HAVE_AN_X_AND_Y_SCALE:
+            position += 4
+        elif flags & _WE_HAVE_A_TWO_BY_TWO:
+            position += 8
+        if not flags & _MORE_COMPONENTS:
+            break
+    if not flags & _WE_HAVE_INSTRUCTIONS:
+        return glyph
+    flags &= ~_WE_HAVE_INSTRUCTIONS
+    return glyph[:flags_at] + struct.pack('>H', flags) + glyph[flags_at + 2:position]
+
+
+def _name_table(family, style, postscript_name):
+    """Таблица name только с семейством, начертанием, полным и PostScript именем."""
+    records = [(1, family), (2, style), (4, f'{family} {style}'), (6, postscript_name)]
+    strings = b''
+    entries = b''
+    for name_id, value in records:
+        encoded = value.encode('utf-16-be')
+        # Платформа 3 (Windows), кодировка 1 (Unicode BMP), язык 0x409
+        entries += struct.pack('>6H', 3, 1, 0x409, name_id, len(encoded), len(strings))
+        strings += encoded
+    return struct.pack('>3H', 0, len(records), 6 + 12 * len(records)) + entries + strings
+
+
+def compact_truetype(data, postscript_name='Font'):
+    """Пересобирает TrueType подмножество без хинтинга и с минимальной таблицей name."""
+    tables = _read_tables(data)
+    head = tables['head']
+    long_loca = struct.unpack('>h', head[50:52])[0] == 1
+    num_glyphs = struct.unpack('>H', tables['maxp'][4:6])[0]
+    loca = tables['loca']
+    if long_loca:
+        offsets = struct.unpack(f'>{num_glyphs + 1}L', loca[:4 * (num_glyphs + 1)])
+    else:
+        offsets = [offset * 2 for offset in struct.unpack(f'>{num_glyphs + 1}H', loca[:2 * (num_glyphs + 1)])]
+
+    glyf = tables['glyf']
+    glyphs = []
+    new_offsets = [0]
+    for i in range(num_glyphs):
+        glyph = _strip_glyph(glyf[offsets[i]:offsets[i + 1]])
+        glyph += b'\0' * (-len(glyph) % 4)
+        glyphs.append(glyph)
+        new_offsets.append(new_offsets[-1] + len(glyph))
+
+    output = TTFontMaker()
+    for tag, table in tables.items():
+        if tag not in _HINTING_TABLES and tag not in ('glyf', 'loca', 'name', 'head'):
+            output.add(tag, table)
+    output.add('glyf', b''.join(glyphs))
+    if new_offsets[-1] >> 1 > 0xFFFF:
+        output.add('loca', struct.pack(f'>{len(new_offsets)}L', *new_offsets))
+        output.add('head', head[:50] + struct.pack('>h', 1) + head[52:])
+    else:
+        output.add('loca', struct.pack(f'>{len(new_offsets)}H', *[offset >> 1 for offset in new_offsets]))
+        output.add('head', head[:50] + struct.pack('>h', 0) + head[52:])
+    output.add('name', _name_table(postscript_name, 'Book', postscript_name))
+    return output.makeStream()
+
+
+class КомпактныйTTFont(TTFont):
+    """
+    TTFont, подмножества которого в компактном профиле встраиваются без
+    хинтинга. Профиль проверяется при каждой сборке PDF, поэтому шрифт
+    регистрируется один раз на процесс.
+
+    Шрифт общий для всех потоков, а makeSubset читает файл шрифта через общую
+    позицию (seek/read), поэтому подмножества собираются по одному.
+    """
+
+    def __init__(self, name, filename, **kwargs):
+        super().__init__(name, filename, **kwargs)
+        make_subset = self.face.makeSubset
+        lock = threading.Lock()
+
+        def make_compact_subset(subset):
+            with lock:
+                data = make_subset(subset)
+            return compact_truetype(data, name) if is_compact() else data
+        self.face.makeSubset = make_compact_subset
+
+
+def draw_bilevel_image(c, rows, x, y, width, height):
+    """
+    Рисует 1-битную картинку: rows - строки пикселей сверху вниз, True - черный.
+    Картинка встраивается один раз на PDF (повтор с теми же пикселями - ссылка).
+    """
+    pixel_width = len(rows[0])
+    packed = bytearray()
+    for row in rows:
+        bits = 0
+        for index, dark in enumerate(row):
+            # В DeviceGray 1 бит = белый, 0 = черный; строка дополняется до байта
+            if not dark:
+                bits |= 1 << (7 - index % 8)
+            if index % 8 == 7:
+                packed.append(bits)
+                bits = 0
+        if pixel_width % 8:
+            packed.append(bits)
+    name = f'bilevel{zlib.crc32(packed):08x}x{pixel_width}'
+    reg_name = c._doc.getXObjectName(name)
+    if reg_name not in c._doc.idToObject:
+        image = pdfdoc.PDFImageXObject(name)
+        image.width, image.height = pixel_width, len(rows)
+        image.bitsPerComponent = 1
+        image.colorSpace = 'DeviceGray'
+        image.streamContent = zlib.compress(bytes(packed), 9)
+        image._filters = ('FlateDecode',)
+        c._setXObjects(image)
+        c._doc.Reference(image, reg_name)
+        c._doc.addForm(name, image)
+    c._currentPageHasImages = 1
+    c.saveState()
+    c.translate(x, y)
+    c.scale(width, height)
+    c._code.append(f'/{reg_name} Do')
+    c.restoreState()
+    c._formsinuse.append(name)
@@ -0,0 +1,94 @@
+# cinema_tickets/qrtoken.py
+"""
+Подписанный токен билета для QR-кода.
+
+Вместо текстового блока (фильм, сеанс, место, ФИО клиента - около 150 байт
+UTF-8, QR версии 8-10) в QR кладется 25 байт: версия формата, ID билета,
+ID сеанса, номер места, срок действия и 10 байт HMAC-SHA1. В base32 это
+40 символов из алфавитно-цифрового набора QR, то есть QR версии 2: рисуется
+быстрее, в PDF меньше, сканер читает его с большего расстояния.
+ID от 2**32 или номер места от 65536 в эти поля не помещаются - такой билет
+получает токен широкого формата (версия 2, 35 байт, 56 символов, QR версии 3).
+
+Подпись проверяется без БД (ключ - из TICKET_QR_SECRET или SECRET_KEY через
+salted_hmac), так что сканер с тем же ключом проверяет билет и без сети.
+Отметку прохода по-прежнему ставит api/checkin/ - токен лишь доказывает,
+что билет выпущен кинотеатром и не подправлен.
+"""
+import base64
+import binascii
+import struct
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+TOKEN_VERSION = 1
+WIDE_TOKEN_VERSION = 2
+# версия, ID билета, ID сеанса, номер места, срок действия (секунды UNIX)
+_PAYLOADS = {
+    TOKEN_VERSION: struct.Struct('>BIIHI'),
+    WIDE_TOKEN_VERSION: struct.Struct('>BQQII'),
+}
+_SIGNATURE_SIZE = 10
+_KEY_SALT = 'cinema_tickets.qrtoken'
+
+# Сколько токен действует после окончания сеанса, если не задано TICKET_QR_GRACE
+DEFAULT_GRACE = 6 * 60 * 60
+
+ТокенБилета = namedtuple('ТокенБилета', 'ticket_id session_id seat_number expires_at')
+
+
+class НеверныйТокен(ValueError):
+    """Строка не является токеном билета или подпись не совпала."""
+
+
+class ТокенИстек(НеверныйТокен):
+    """Подпись верна, но срок действия токена прошел."""
+
+
+def _sign(payload):
+    secret = getattr(settings, 'TICKET_QR_SECRET', None) or settings.SECRET_KEY
+    return salted_hmac(_KEY_SALT, payload, secret=secret, algorithm='sha1').digest()[:_SIGNATURE_SIZE]
+
+
+def encode_token(ticket_id, session_id, seat_number, expires_at):
+    """Токен из полей билета. expires_at - datetime с часовым поясом."""
+    fields = (ticket_id, session_id, seat_number, int(expires_at.timestamp()))
+    try:
+        payload = _PAYLOADS[TOKEN_VERSION].pack(TOKEN_VERSION, *fields)
+    except struct.error:
+        payload = _PAYLOADS[WIDE_TOKEN_VERSION].pack(WIDE_TOKEN_VERSION, *fields)
+    return base64.b32encode(payload + _sign(payload)).decode('ascii').rstrip('=')
+
+
+def make_ticket_token(ticket):
+    """Токен для QR-кода билета: действует до конца сеанса плюс TICKET_QR_GRACE секунд."""
+    grace = getattr(settings, 'TICKET_QR_GRACE', DEFAULT_GRACE)
+    expires_at = ticket.сеанс.время_окончания.timestamp() + grace
+    return encode_token(ticket.id, ticket.сеанс_id, ticket.место.номер_места,
+                        datetime.fromtimestamp(expires_at, tz=dt_timezone.utc))
+
+
+def decode_token(token, now=None, check_expiry=True):
+    """
+    Проверяет подпись и срок действия, возвращает ТокенБилета.
+    Выбрасывает НеверныйТокен (формат, подпись) или ТокенИстек.
+    """
+    token = str(token).strip().upper()
+    try:
+        raw = base64.b32decode(token + '=' * (-len(token) % 8))
+    except (binascii.Error, ValueError):
+        raise НеверныйТокен('Код не является токеном билета.')
+    layout = _PAYLOADS.get(raw[0]) if raw else None
+    if layout is None or len(raw) != layout.size + _SIGNATURE_SIZE:
+        raise НеверныйТокен('Код не является токеном билета.')
+    payload, signature = raw[:layout.size], raw[layout.size:]
+    if not constant_time_compare(signature, _sign(payload)):
+        raise НеверныйТокен('Подпись токена не совпала.')
+    _, ticket_id, session_id, seat_number, expires = layout.unpack(payload)
+    expires_at = datetime.fromtimestamp(expires, tz=dt_timezone.utc)
+    if check_expiry and (now or datetime.now(dt_timezone.utc)) > expires_at:
+        raise ТокенИстек(f'Срок действия билета истек {expires_at:%d.%m.%Y %H:%M} UTC.')
+    return ТокенБилета(ticket_id, session_id, seat_number, expires_at)
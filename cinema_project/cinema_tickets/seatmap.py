@@ -0,0 +1,219 @@
+# cinema_tickets/seatmap.py
+"""
+Карта занятости мест по сеансу, хранится в кэше Django.
+
+Карта - битовая строка, где бит N означает "место N занято". Она строится
+одним запросом по индексу (сеанс, место) - вместе с билетами, перенесенными в
+АрхивБилетов, - и хранится вместе с версией, по которой построена.
+Версия сеанса лежит в отдельном ключе, и каждая продажа атомарно увеличивает ее
+(cache.incr), а не переписывает карту: при общем кэше продажи из разных процессов
+не затирают друг друга. Карта с устаревшей версией перестраивается при следующем
+чтении, а версия используется как ETag.
+Номера мест сквозные в пределах зала, поэтому карта сеанса - это карта его зала.
+
+Здесь же справочники для покупки: строка сеанса (в кэше Django) и места залов
+(в памяти процесса), чтобы покупка не тратила на них запросы к БД.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .checkin import invalidate_index
+from .listing import sessions_changed
+from .models import АрхивБилетов, КупленныеБилеты, МестаВЗале, СеансыФильмов
+
+# Карта живет в кэше ограниченное время: это страховка от рассинхронизации,
+# если билет изменили в обход сигналов (например, через .update())
+SEAT_MAP_TIMEOUT = 10 * 60
+
+
+_lock = threading.Lock()
+
+_SESSION_FIELDS = [f.attname for f in СеансыФильмов._meta.concrete_fields]
+_SEAT_FIELDS = [f.attname for f in МестаВЗале._meta.concrete_fields]
+_SEAT_NUMBER_INDEX = _SEAT_FIELDS.index('номер_места')
+
+# Места залов в памяти процесса: {зал: (версия, {номер_места: строка})}.
+# Версия мест зала хранится в общем кэше и меняется при любом изменении мест,
+# так что устаревший словарь замечают все процессы, а не только тот, где места изменили
+_hall_seats = {}
+
+
+def _cache_key(session_id):
+    return f'seatmap:session:{session_id}'
+
+
+def _seat_count_key(hall_id):
+    return f'seatmap:seat_count:{hall_id}'
+
+
+def _session_key(session_id):
+    return f'seatmap:session_row:{session_id}'
+
+
+def _version_key(session_id):
+    return f'seatmap:version:{session_id}'
+
+
+def _seats_version_key(hall_id):
+    return f'seatmap:seats_version:{hall_id}'
+
+
+def _build_bitmap(seat_numbers):
+    seat_numbers = list(seat_numbers)
+    bitmap = bytearray((max(seat_numbers, default=0) >> 3) + 1)
+    for номер in seat_numbers:
+        bitmap[номер >> 3] |= 1 << (номер & 7)
+    return bitmap
+
+
+def get_seat_count(hall_id):
+    """Общее число мест в зале (кэшируется, сбрасывается при изменении мест)."""
+    count = cache.get(_seat_count_key(hall_id))
+    if count is None:
+        count = МестаВЗале.objects.filter(зал_id=hall_id).count()
+        cache.set(_seat_count_key(hall_id), count, SEAT_MAP_TIMEOUT)
+    return count
+
+
+def get_session(session_id):
+    """
+    Сеанс по ID из кэша (строка таблицы кэшируется, сбрасывается при сохранении сеанса).
+    Для несуществующего сеанса выбрасывает СеансыФильмов.DoesNotExist.
+    """
+    row = cache.get(_session_key(session_id))
+    if row is None:
+        row = СеансыФильмов.objects.filter(pk=session_id).values_list(*_SESSION_FIELDS).first()
+        if row is None:
+            raise СеансыФильмов.DoesNotExist(f"Сеанс {session_id} не найден.")
+        cache.set(_session_key(session_id), row, SEAT_MAP_TIMEOUT)
+    return СеансыФильмов.from_db(DEFAULT_DB_ALIAS, _SESSION_FIELDS, row)
+
+
+def get_session_hall_id(session_id):
+    """
+    ID зала сеанса (из закэшированного сеанса).
+    Для несуществующего сеанса выбрасывает СеансыФильмов.DoesNotExist.
+    """
+    return get_session(session_id).зал_id
+
+
+def _seats_version(hall_id):
+    version = cache.get(_seats_version_key(hall_id))
+    if version is None:
+        # add: если другой процесс уже назначил версию, берем его
+        cache.add(_seats_version_key(hall_id), time.time_ns(), SEAT_MAP_TIMEOUT)
+        version = cache.get(_seats_version_key(hall_id))
+    return version
+
+
+def get_seat(hall_id, seat_number):
+    """
+    Место зала по номеру без запроса к БД: все места зала загружаются одним
+    запросом в память процесса и перечитываются, когда меняется версия мест зала.
+    Для несуществующего места выбрасывает МестаВЗале.DoesNotExist.
+    """
+    version = _seats_version(hall_id)
+    entry = _hall_seats.get(hall_id)
+    if entry is None or entry[0] != version:
+        rows = МестаВЗале.objects.filter(зал_id=hall_id).values_list(*_SEAT_FIELDS)
+        entry = (version, {row[_SEAT_NUMBER_INDEX]: row for row in rows})
+        with _lock:
+            _hall_seats[hall_id] = entry
+    try:
+        row = entry[1][int(seat_number)]
+    except (KeyError, TypeError, ValueError):
+        raise МестаВЗале.DoesNotExist(f"Место {seat_number} в зале {hall_id} не найдено.")
+    return МестаВЗале.from_db(DEFAULT_DB_ALIAS, _SEAT_FIELDS, row)
+
+
+def _session_version(session_id):
+    version = cache.get(_version_key(session_id))
+    if version is None:
+        # Начальная версия - время, чтобы после вытеснения ключа версии
+        # не повторялись и старый ETag не совпал с новой картой
+        cache.add(_version_key(session_id), time.time_ns(), SEAT_MAP_TIMEOUT)
+        version = cache.get(_version_key(session_id))
+    return version
+
+
+def get_seat_map(session_id):
+    """
+    Возвращает (версия, bitmap) для сеанса. Если карты нет или она построена по
+    старой версии, карта строится одним запросом только по билетам этого сеанса.
+    Для несуществующего сеанса выбрасывает СеансыФильмов.DoesNotExist.
+    """
+    cached = cache.get_many([_version_key(session_id), _cache_key(session_id)])
+    version = cached.get(_version_key(session_id))
+    entry = cached.get(_cache_key(session_id))
+    if entry is not None and version is not None and entry[0] == version:
+        return entry
+    get_session_hall_id(session_id)
+    # Версия читается до запроса: продажа, закоммиченная после него, увеличит
+    # версию, и карта без этого места не будет принята за актуальную
+    version = _session_version(session_id)
+    # Один запрос UNION ALL; сортировка по умолчанию в частях UNION недопустима
+    taken = (КупленныеБилеты.objects.filter(сеанс_id=session_id).order_by()
+             .values_list('место__номер_места', flat=True)
+             .union(АрхивБилетов.objects.filter(сеанс_id=session_id).order_by()
+                    .values_list('место__номер_места', flat=True), all=True))
+    entry = (version, bytes(_build_bitmap(taken)))
+    cache.set(_cache_key(session_id), entry, SEAT_MAP_TIMEOUT)
+    return entry
+
+
+def invalidate_seat_map(session_id):
+    """
+    Отмечает, что места сеанса изменились (продажа, удаление или перенос билета):
+    версия карты увеличивается, и карта перестраивается при следующем чтении.
+    """
+    # Число свободных мест в списке сеансов и билеты для прохода тоже изменились
+    sessions_changed()
+    invalidate_index(session_id)
+    try:
+        cache.incr(_version_key(session_id))
+    except ValueError:
+        # Версии нет - при следующем чтении будет назначена новая
+        pass
+
+
+def seats_from_bitmap(bitmap):
+    """Номера занятых мест из битовой карты."""
+    return [index * 8 + bit
+            for index, byte in enumerate(bitmap) if byte
+            for bit in range(8) if byte & (1 << bit)]
+
+
+# --- Обработчики сигналов (подключаются в CinemaTicketsConfig.ready) ---
+
+def ticket_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Новый билет, либо билет могли перенести на другое место или сеанс
+    if created or update_fields is None or {'сеанс', 'место'} & set(update_fields):
+        transaction.on_commit(lambda: invalidate_seat_map(instance.сеанс_id))
+
+
+def ticket_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_seat_map(instance.сеанс_id))
+
+
+def seats_changed(sender, instance=None, **kwargs):
+    if instance is not None:
+        halls_changed([instance.зал_id])
+
+
+def halls_changed(hall_ids):
+    """
+    Сбрасывает число мест и версию мест залов (вызывается и после массового
+    изменения мест: bulk_create не шлет сигналы).
+    """
+    cache.delete_many([key for hall_id in hall_ids
+                       for key in (_seat_count_key(hall_id), _seats_version_key(hall_id))])
+    sessions_changed()
+
+
+def session_saved(sender, instance, **kwargs):
+    # Сеанс могли перенести в другой зал, изменить или удалить
+    cache.delete(_session_key(instance.pk))
+    invalidate_seat_map(instance.pk)
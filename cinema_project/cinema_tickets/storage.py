@@ -0,0 +1,220 @@
+# cinema_tickets/storage.py
+"""
+Хранилище PDF билетов и заказов.
+
+Раскладка по каталогам: файл билета с ID 1234567 лежит в
+tickets/001/234/ticket_1234567.pdf - не больше тысячи файлов и подкаталогов
+в одном каталоге, вместо одного плоского каталога на миллионы файлов.
+
+Пакеты: PDF прошедших сеансов можно сложить в один файл пакета
+(tickets/packs/session_<id>.pack, только дописывается) с индексом смещений
+рядом (session_<id>.idx, JSON {файл: [смещение, длина, mtime]}). Такой PDF
+хранится в поле под именем "tickets/packs/session_<id>.pack/ticket_<id>.pdf",
+и хранилище читает его из пакета через mmap - без отдельного файла и inode на
+каждый билет. Складывает PDF в пакеты команда manage.py migrate_pdf_storage --pack.
+
+Удаление PDF из пакета (перегенерация билета) только убирает его из индекса:
+новый PDF пишется обычным файлом, место в пакете освобождается при пересборке.
+"""
+import io
+import json
+import mmap
+import os
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+PACK_SUFFIX = '.pack'
+INDEX_SUFFIX = '.idx'
+PACKS_DIR = 'tickets/packs'
+
+_lock = threading.Lock()
+_indexes = {}  # путь индекса -> (версия файла индекса, {файл: [смещение, длина, mtime]})
+_maps = {}  # путь пакета -> (размер, mmap)
+
+
+def shard_dir(pk):
+    """Два уровня каталогов по ID: 1234567 -> "001/234"."""
+    return f'{pk // 1_000_000 % 1000:03d}/{pk // 1000 % 1000:03d}'
+
+
+def ticket_pdf_path(instance, filename):
+    return f'tickets/{shard_dir(instance.pk)}/{filename}'
+
+
+def order_pdf_path(instance, filename):
+    return f'orders/{shard_dir(instance.pk)}/{filename}'
+
+
+def split_packed_name(name):
+    """(имя пакета, файл в пакете) для PDF из пакета, иначе None."""
+    pack, sep, member = name.partition(PACK_SUFFIX + '/')
+    if not sep or not member:
+        return None
+    return pack + PACK_SUFFIX, member
+
+
+def is_packed(name):
+    return split_packed_name(name or '') is not None
+
+
+class ФайлИзПакета(io.RawIOBase):
+    """Файл только для чтения - участок отображенного в память пакета."""
+
+    def __init__(self, buffer, offset, length):
+        super().__init__()
+        self._view = memoryview(buffer)[offset:offset + length]
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        chunk = self._view[self._position:self._position + len(target)]
+        target[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(offset, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+@deconstructible(path='cinema_tickets.storage.ХранилищеPDF')
+class ХранилищеPDF(FileSystemStorage):
+    """FileSystemStorage, который умеет читать PDF из пакетов (см. описание модуля)."""
+
+    # --- Пакеты ---
+
+    def _read_index(self, pack):
+        index_path = self.path(pack[:-len(PACK_SUFFIX)] + INDEX_SUFFIX)
+        try:
+            stat = os.stat(index_path)
+        except FileNotFoundError:
+            return {}
+        # Индекс всегда заменяется новым файлом, так что inode меняется при каждой записи
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with _lock:
+            cached = _indexes.get(index_path)
+            if cached and cached[0] == version:
+                return cached[1]
+        with open(index_path, encoding='utf-8') as f:
+            members = json.load(f)
+        with _lock:
+            _indexes[index_path] = (version, members)
+        return members
+
+    def _write_index(self, pack, members):
+        # Индекс заменяется атомарно: читатели видят либо старый, либо новый
+        index_path = self.path(pack[:-len(PACK_SUFFIX)] + INDEX_SUFFIX)
+        tmp_path = f'{index_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(members, f)
+        os.replace(tmp_path, index_path)
+
+    def _member(self, name):
+        pack, member = split_packed_name(name)
+        entry = self._read_index(pack).get(member)
+        if entry is None:
+            raise FileNotFoundError(f'{member} нет в пакете {pack}')
+        return pack, entry
+
+    def _map(self, pack, needed):
+        pack_path = self.path(pack)
+        with _lock:
+            cached = _maps.get(pack_path)
+            if cached and cached[0] >= needed:
+                return cached[1]
+        # Пакет дописан после отображения - отображаем заново (старое
+        # отображение закроется, когда его отпустят открытые читатели)
+        with open(pack_path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with _lock:
+            _maps[pack_path] = (len(mapped), mapped)
+        return mapped
+
+    def append_to_pack(self, pack, files):
+        """
+        Дописывает файлы [(имя в пакете, байты, mtime), ...] в конец пакета и
+        обновляет индекс. mtime (секунды UNIX) - время изменения исходного файла,
+        чтобы ETag и Last-Modified при упаковке не менялись; None - текущее время.
+        Возвращает имена для поля (пакет/файл). Пакет не должен одновременно
+        пополняться из двух процессов.
+        """
+        pack_path = self.path(pack)
+        os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+        members = dict(self._read_index(pack))
+        now = timezone.now().timestamp()
+        names = []
+        with open(pack_path, 'ab') as f:
+            offset = f.tell()
+            for member, data, mtime in files:
+                f.write(data)
+                members[member] = [offset, len(data), now if mtime is None else mtime]
+                offset += len(data)
+                names.append(f'{pack}/{member}')
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_index(pack, members)
+        return names
+
+    # --- Интерфейс Storage ---
+
+    def _open(self, name, mode='rb'):
+        if not is_packed(name):
+            return super()._open(name, mode)
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('PDF в пакете доступен только для чтения.')
+        pack, (offset, length, _) = self._member(name)
+        return File(ФайлИзПакета(self._map(pack, offset + length), offset, length), name)
+
+    def exists(self, name):
+        if is_packed(name):
+            pack, member = split_packed_name(name)
+            return member in self._read_index(pack)
+        return super().exists(name)
+
+    def size(self, name):
+        if is_packed(name):
+            return self._member(name)[1][1]
+        return super().size(name)
+
+    def get_modified_time(self, name):
+        if is_packed(name):
+            return datetime.fromtimestamp(self._member(name)[1][2], tz=dt_timezone.utc)
+        return super().get_modified_time(name)
+
+    def delete(self, name):
+        if not is_packed(name):
+            return super().delete(name)
+        pack, member = split_packed_name(name)
+        members = dict(self._read_index(pack))
+        if members.pop(member, None) is not None:
+            self._write_index(pack, members)
+
+    def path(self, name):
+        if is_packed(name):
+            raise NotImplementedError('У PDF в пакете нет собственного пути на диске.')
+        return super().path(name)
+
+
+pdf_storage = ХранилищеPDF()
@@ -1,3 +1,1824 @@
-from django.test import TestCase
+import io
+import json
+import os
+import re
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import reportlab
+from reportlab.pdfbase import pdfmetrics
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .admin import ОценочныйПагинатор
+from .archive import archive_session
+from . import checkin, holds, seatmap
+from .checks import check_pdf_profile, check_shared_cache
+from .dbretry import retry_on_lock, БДПерегружена
+from .dbstats import estimated_row_count, refresh_row_estimate
+from .jobs import run_pending_jobs
+from .listing import client_tickets, upcoming_sessions
+from . import metrics
+from .outbox import ПочтовыйЯщик
+from .storage import is_packed, pdf_storage
+from .seatmap import get_seat_map, seats_from_bitmap
+from .qrtoken import decode_token, make_ticket_token, НеверныйТокен, ТокенИстек
+from .utils import (build_ticket_email, ensure_ticket_pdf, generate_ticket_pdf, qr_matrix, register_ticket_font,
+                    render_tickets_pdf, send_ticket_email)
+from .models import (ФизическиеЛица, Залы, СеансыФильмов, МестаВЗале, КупленныеБилеты, Заказы, ЗаданияОбработки,
+                     АрхивБилетов)
+
+try:
+    import pymupdf
+except ImportError:  # независимая проверка PDF компактного профиля пропускается
+    pymupdf = None
+
+TEST_MEDIA_ROOT = tempfile.mkdtemp(prefix='cinema_test_media_')
+
+
+@override_settings(
+    MEDIA_ROOT=TEST_MEDIA_ROOT,
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+)
+class CinemaTestCase(TestCase):
+    """Общие тестовые данные: клиент, сеанс и несколько мест."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.клиент = ФизическиеЛица.objects.create(
+            фамилия='Иванов', имя='Иван', отчество='Иванович',
+            номер_телефона='+79000000001', дата_рождения=date(1990, 1, 1),
+        )
+        cls.зал = Залы.objects.create(название='Зал 1')
+        начало = timezone.now() + timedelta(days=1)
+        cls.сеанс = СеансыФильмов.objects.create(
+            зал=cls.зал,
+            название_фильма='Тестовый фильм',
+            время_начала=начало,
+            время_окончания=начало + timedelta(minutes=95),
+        )
+        for номер in range(1, 11):
+            МестаВЗале.objects.create(зал=cls.зал, номер_места=номер)
+
+    def purchase(self, seat_number, email='ivanov@example.com', **extra):
+        payload = {
+            'client_id': self.клиент.pk,
+            'session_id': self.сеанс.pk,
+            'seat_number': seat_number,
+            'client_email': email,
+        }
+        payload.update(extra)
+        return self.client.post(reverse('cinema_tickets:purchase_ticket'),
+                                data=json.dumps(payload), content_type='application/json')
+
+
+class TicketJobQueueTests(CinemaTestCase):
+
+    def test_purchase_enqueues_jobs_and_returns_immediately(self):
+        response = self.purchase(1)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['status'], КупленныеБилеты.СТАТУС_ОЖИДАЕТ)
+
+        билет = КупленныеБилеты.objects.get(pk=data['ticket_id'])
+        self.assertFalse(билет.pdf_файл)
+        self.assertEqual(
+            sorted(билет.задания.values_list('тип', flat=True)),
+            [ЗаданияОбработки.ТИП_EMAIL, ЗаданияОбработки.ТИП_PDF],
+        )
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_worker_renders_and_sends(self):
+        ticket_id = self.purchase(2).json()['ticket_id']
+        run_pending_jobs()
+
+        билет = КупленныеБилеты.objects.get(pk=ticket_id)
+        self.assertTrue(билет.pdf_файл)
+        self.assertEqual(билет.статус, КупленныеБилеты.СТАТУС_ОТПРАВЛЕН)
+        self.assertEqual(len(mail.outbox), 1)
+
+        status = self.client.get(reverse('cinema_tickets:get_ticket_status', args=[ticket_id])).json()
+        self.assertEqual(status['status'], КупленныеБилеты.СТАТУС_ОТПРАВЛЕН)
+        self.assertTrue(status['pdf_ready'])
+
+    def test_failing_job_is_retried_then_dead_lettered(self):
+        ticket_id = self.purchase(3).json()['ticket_id']
+        задание = ЗаданияОбработки.objects.get(билет_id=ticket_id, тип=ЗаданияОбработки.ТИП_EMAIL)
+        задание.макс_попыток = 2
+        задание.save()
+
+        # PDF еще не сгенерирован, поэтому email-задание уходит на повтор
+        ЗаданияОбработки.objects.filter(тип=ЗаданияОбработки.ТИП_PDF).delete()
+        run_pending_jobs()
+        задание.refresh_from_db()
+        self.assertEqual(задание.статус, ЗаданияОбработки.СТАТУС_ОТЛОЖЕНО)
+        self.assertGreater(задание.выполнить_после, timezone.now())
+
+        ЗаданияОбработки.objects.filter(pk=задание.pk).update(выполнить_после=timezone.now())
+        run_pending_jobs()
+        задание.refresh_from_db()
+        self.assertEqual(задание.статус, ЗаданияОбработки.СТАТУС_МЕРТВОЕ)
+        self.assertEqual(КупленныеБилеты.objects.get(pk=ticket_id).статус, КупленныеБилеты.СТАТУС_ОШИБКА)
+
+    def test_worker_survives_database_errors(self):
+        command = 'cinema_tickets.management.commands.run_ticket_worker'
+        задание = object()
+        out = io.StringIO()
+        with mock.patch(f'{command}.claim_job',
+                        side_effect=[OperationalError('database is locked'), задание, None]) as claim, \
+                mock.patch(f'{command}.run_claimed_job', return_value=(1, 0)) as run, \
+                self.assertLogs(command, 'ERROR') as logs:
+            call_command('run_ticket_worker', '--workers', '1', '--once', '--poll-interval', '0', stdout=out)
+        # После ошибки поток не завершился, а выполнил следующее задание
+        self.assertEqual(claim.call_count, 3)
+        run.assert_called_once_with(задание)
+        self.assertIn('database is locked', logs.output[0])
+        self.assertIn('Выполнено заданий: 1', out.getvalue())
+
+
+@override_settings(TICKET_JOBS_EAGER=True)
+class EagerProcessingTests(CinemaTestCase):
+
+    def test_artifacts_are_generated_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.purchase(4)
+        билет = КупленныеБилеты.objects.get(pk=response.json()['ticket_id'])
+        self.assertEqual(билет.статус, КупленныеБилеты.СТАТУС_ОТПРАВЛЕН)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_render_failure_does_not_roll_back_sale(self):
+        with mock.patch('cinema_tickets.jobs.generate_ticket_pdf', side_effect=RuntimeError('reportlab упал')):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.purchase(5)
+
+        self.assertEqual(response.status_code, 201)
+        билет = КупленныеБилеты.objects.get(pk=response.json()['ticket_id'])
+        self.assertIn('reportlab упал', билет.ошибка_обработки)
+        # Задание осталось в очереди для повтора воркером
+        self.assertTrue(билет.задания.filter(статус=ЗаданияОбработки.СТАТУС_ОТЛОЖЕНО).exists())
+
+
+class OrderTests(CinemaTestCase):
+
+    def order(self, seat_numbers, email='ivanov@example.com'):
+        payload = {
+            'client_id': self.клиент.pk,
+            'session_id': self.сеанс.pk,
+            'seat_numbers': seat_numbers,
+            'client_email': email,
+        }
+        return self.client.post(reverse('cinema_tickets:create_order'),
+                                data=json.dumps(payload), content_type='application/json')
+
+    def test_order_claims_all_seats_and_sends_one_email(self):
+        response = self.order([3, 1, 2])
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual([t['seat'] for t in data['tickets']], [1, 2, 3])
+        self.assertEqual(ЗаданияОбработки.objects.count(), 2)
+
+        run_pending_jobs()
+        заказ = Заказы.objects.get(pk=data['order_id'])
+        self.assertTrue(заказ.pdf_файл)
+        self.assertEqual(заказ.pdf_файл.read().count(b'/Type /Page\n'), 3)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(set(заказ.билеты.values_list('статус', flat=True)), {КупленныеБилеты.СТАТУС_ОТПРАВЛЕН})
+
+        # PDF отдельного билета из заказа - общий PDF заказа
+        ticket_id = data['tickets'][0]['ticket_id']
+        pdf_response = self.client.get(reverse('cinema_tickets:get_ticket_pdf', args=[ticket_id]))
+        self.assertEqual(pdf_response.status_code, 200)
+
+    def test_order_is_all_or_nothing(self):
+        self.assertEqual(self.purchase(5).status_code, 201)
+        response = self.order([4, 5, 6])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['taken_seats'], [5])
+        self.assertEqual(КупленныеБилеты.objects.count(), 1)
+        self.assertFalse(Заказы.objects.exists())
+
+    def test_order_validates_seat_list(self):
+        self.assertEqual(self.order([1, 1]).status_code, 400)
+        self.assertEqual(self.order('1,2').status_code, 400)
+        self.assertEqual(self.order(list(range(1, 12))).status_code, 400)
+        self.assertEqual(self.order([1, 99]).status_code, 404)
+
+
+class SeatMapTests(CinemaTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def seats(self, **headers):
+        return self.client.get(reverse('cinema_tickets:session_seats', args=[self.сеанс.pk]), **headers)
+
+    def test_seat_map_follows_sales(self):
+        self.purchase(2)
+        first = self.seats()
+        self.assertEqual(first.json()['occupied'], [2])
+        self.assertEqual(first.json()['free'], 9)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.purchase(7)
+        # После продажи карта перестраивается одним запросом, затем читается из кэша
+        with self.assertNumQueries(1):
+            second = self.seats()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.seats()['ETag'], second['ETag'])
+        self.assertEqual(second.json()['occupied'], [2, 7])
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+    def test_interleaved_sales_are_not_lost(self):
+        version, stale = get_seat_map(self.сеанс.pk)
+        # Две продажи коммитятся одновременно в разных процессах: каждая только
+        # увеличивает версию, а не переписывает прочитанную карту
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.purchase(3)
+            self.purchase(4)
+        for callback in callbacks:
+            callback()
+        # Карта, построенная по старой версии, записана после продаж
+        cache.set(seatmap._cache_key(self.сеанс.pk), (version, stale))
+        new_version, bitmap = get_seat_map(self.сеанс.pk)
+        self.assertEqual(seats_from_bitmap(bitmap), [3, 4])
+        self.assertEqual(new_version, version + 2)
+
+    def test_conditional_get_returns_304(self):
+        etag = self.seats()['ETag']
+        with self.assertNumQueries(0):
+            response = self.seats(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_unknown_session(self):
+        response = self.client.get(reverse('cinema_tickets:session_seats', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+
+class SeatHoldTests(CinemaTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def hold(self, seat_numbers):
+        return self.client.post(reverse('cinema_tickets:create_hold'),
+                                data=json.dumps({'session_id': self.сеанс.pk, 'seat_numbers': seat_numbers}),
+                                content_type='application/json')
+
+    def test_held_seat_is_rejected_before_touching_tickets(self):
+        self.assertEqual(self.hold([1, 2]).status_code, 201)
+        # Конкурент отсеивается на проверке удержания, без единого запроса к БД
+        with self.assertNumQueries(0):
+            response = self.purchase(2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.hold([2, 3]).status_code, 409)
+        # Неудачная попытка удержания не оставляет за собой занятых мест
+        self.assertEqual(self.hold([3]).status_code, 201)
+
+    def test_purchase_confirms_hold(self):
+        token = self.hold([4]).json()['hold_token']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.purchase(4, hold_token=token)
+        self.assertEqual(response.status_code, 201)
+        # После покупки удержание снято, а место продано
+        release = self.client.delete(reverse('cinema_tickets:release_hold', args=[token]))
+        self.assertEqual(release.status_code, 404)
+        self.assertEqual(self.hold([4]).status_code, 409)
+
+    def test_partial_purchase_keeps_rest_of_hold(self):
+        token = self.hold([5, 6, 7]).json()['hold_token']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.purchase(6, hold_token=token).status_code, 201)
+        # Купленное место снято с удержания, остальные по-прежнему за покупателем
+        self.assertEqual(holds.get_hold(token).seat_numbers, [5, 7])
+        self.assertEqual(self.hold([5]).status_code, 409)
+        payload = {'client_id': self.клиент.pk, 'session_id': self.сеанс.pk, 'seat_numbers': [7],
+                   'client_email': 'ivanov@example.com', 'hold_token': token}
+        response = self.client.post(reverse('cinema_tickets:create_order'), data=json.dumps(payload),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.purchase(5, hold_token=token).status_code, 201)
+        # Все места удержания проданы - токен больше не действует
+        with self.assertRaises(holds.НеверноеУдержание):
+            holds.get_hold(token)
+
+    def test_foreign_or_expired_token_is_rejected(self):
+        self.assertEqual(self.purchase(5, hold_token='нет-такого').status_code, 409)
+        token = self.hold([6]).json()['hold_token']
+        self.assertEqual(self.purchase(7, hold_token=token).status_code, 409)
+
+    def test_release_frees_seats(self):
+        token = self.hold([8]).json()['hold_token']
+        self.assertEqual(self.client.delete(reverse('cinema_tickets:release_hold', args=[token])).status_code, 204)
+        self.assertEqual(self.purchase(8).status_code, 201)
+
+    def test_release_near_expiry_leaves_seats_to_ttl(self):
+        удержание = holds.create_hold(self.сеанс.pk, [9])
+        key = holds._seat_key(self.сеанс.pk, 9)
+        # Удержание вот-вот истечет, и место может успеть достаться другому покупателю
+        # уже после чтения владельца: снятие не должно удалить чужой ключ
+        удержание.expires_at = timezone.now() + timedelta(seconds=holds.RELEASE_MARGIN / 2)
+        cache.set(key, 'чужой-токен')
+        with mock.patch.object(cache, 'get_many', return_value={key: удержание.token}):
+            удержание.release()
+        self.assertEqual(cache.get(key), 'чужой-токен')
+
+    def test_deploy_check_requires_shared_cache(self):
+        self.assertEqual([e.id for e in check_shared_cache(None)], ['cinema_tickets.E001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                              'LOCATION': 'redis://127.0.0.1:6379'}}
+        with self.settings(CACHES=shared):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class TicketRenderTests(CinemaTestCase):
+
+    def make_ticket(self, seat_number=1):
+        return КупленныеБилеты.objects.create(
+            клиент=self.клиент, сеанс=self.сеанс,
+            место=МестаВЗале.objects.get(номер_места=seat_number),
+            email_получателя='ivanov@example.com',
+        )
+
+    def test_prefetched_ticket_renders_without_extra_queries(self):
+        ticket_id = self.make_ticket().pk
+        билет = КупленныеБилеты.objects.select_related('сеанс', 'место', 'клиент').get(pk=ticket_id)
+        # Единственный запрос - сохранение пути к PDF
+        with self.assertNumQueries(1):
+            generate_ticket_pdf(билет)
+        self.assertTrue(билет.pdf_файл.read().startswith(b'%PDF'))
+
+    def test_bare_ticket_loads_relations_in_one_query(self):
+        билет = КупленныеБилеты.objects.get(pk=self.make_ticket().pk)
+        with self.assertNumQueries(2):
+            generate_ticket_pdf(билет)
+
+    def test_static_part_is_shared_between_pages(self):
+        билеты = [self.make_ticket(n) for n in (1, 2, 3)]
+        pdf = render_tickets_pdf(билеты)
+        # Статическая часть описана в документе один раз и используется на всех страницах
+        self.assertEqual(pdf.count(b'/Subtype /Form'), 1)
+
+    @override_settings(TICKET_PDF_PROFILE='standard')
+    def test_vector_codes_embed_no_images(self):
+        билет = self.make_ticket()
+        with self.settings(TICKET_CODES_RENDER='vector'):
+            vector_pdf = render_tickets_pdf([билет])
+        with self.settings(TICKET_CODES_RENDER='image'):
+            image_pdf = render_tickets_pdf([билет])
+        self.assertNotIn(b'/Subtype /Image', vector_pdf)
+        self.assertIn(b'/Subtype /Image', image_pdf)
+        self.assertLess(len(vector_pdf), len(image_pdf))
+
+
+class CompactPdfProfileTests(CinemaTestCase):
+    # Бюджет размера PDF на билет в компактном профиле (сейчас около 13 КБ на один билет;
+    # в PDF заказа шрифт и статическая часть общие, поэтому на билет выходит меньше)
+    SINGLE_TICKET_BUDGET = 16 * 1024
+    ORDER_TICKET_BUDGET = 6 * 1024
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.билеты = [КупленныеБилеты.objects.create(клиент=cls.клиент, сеанс=cls.сеанс,
+                                                     место=МестаВЗале.objects.get(номер_места=номер),
+                                                     email_получателя='ivanov@example.com')
+                      for номер in range(1, 6)]
+
+    def render(self, profile, tickets, codes='vector'):
+        with self.settings(TICKET_PDF_PROFILE=profile, TICKET_CODES_RENDER=codes):
+            return render_tickets_pdf(tickets)
+
+    def test_size_budget(self):
+        single = self.render('compact', self.билеты[:1])
+        self.assertLess(len(single), self.SINGLE_TICKET_BUDGET)
+        order = self.render('compact', self.билеты)
+        self.assertLess(len(order) / len(self.билеты), self.ORDER_TICKET_BUDGET)
+
+    def test_compact_is_smaller_than_standard(self):
+        for codes in ('vector', 'image'):
+            standard = self.render('standard', self.билеты[:1], codes)
+            compact = self.render('compact', self.билеты[:1], codes)
+            self.assertLess(len(compact), len(standard) * 0.6, codes)
+
+    def test_profile_does_not_leak_between_threads(self):
+        # Профиль задается на Canvas, а не в общем rl_config: PDF, собранные
+        # параллельно в потоках (воркер заданий, сервер), совпадают с собранным в одиночку
+        expected = self.strip_ids(self.render('compact', self.билеты[:1]))
+        results, errors = [], []
+
+        def worker():
+            try:
+                for _ in range(5):
+                    results.append(self.strip_ids(render_tickets_pdf(self.билеты[:1])))
+            except Exception as e:
+                errors.append(e)
+
+        with self.settings(TICKET_CODES_RENDER='vector', TICKET_PDF_PROFILE='compact'):
+            threads = [threading.Thread(target=worker) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [expected] * 20)
+
+    def test_font_subsets_are_built_one_at_a_time(self):
+        # Файл шрифта читается через общую позицию (seek/read): второе подмножество,
+        # собранное посреди первого, сдвинуло бы позицию, и первое не нашло бы
+        # составные части глифа "é"
+        register_ticket_font()
+        face = pdfmetrics.getFont('DejaVuSans').face
+        subsets = [[ord('é')], list(range(0x410, 0x450))]
+        expected = [face.makeSubset(subset) for subset in subsets]
+        paused, resume = threading.Event(), threading.Event()
+        seek = face.seek
+        seeks = []
+        results = {}
+
+        def pausing_seek(pos):
+            seek(pos)
+            if threading.current_thread().name == 'first':
+                seeks.append(pos)
+                # Пауза перед чтением глифа "é" (первый seek - глиф 0)
+                if len(seeks) == 2:
+                    paused.set()
+                    resume.wait(5)
+
+        def build(n):
+            try:
+                results[n] = face.makeSubset(subsets[n]) == expected[n]
+            except Exception as e:
+                results[n] = e
+
+        with mock.patch.object(face, 'seek', pausing_seek):
+            first = threading.Thread(target=build, args=(0,), name='first')
+            first.start()
+            self.assertTrue(paused.wait(5))
+            second = threading.Thread(target=build, args=(1,))
+            second.start()
+            second.join(0.5)
+            resume.set()
+            first.join()
+            second.join()
+        self.assertEqual(results, {0: True, 1: True})
+
+    @staticmethod
+    def strip_ids(pdf):
+        # Дата создания и /ID документа разные у каждого PDF
+        return re.sub(rb'/(CreationDate|ModDate) \(D:[^)]*\)|/ID\s*\[[^]]*\]', b'', pdf)
+
+    def test_unsupported_reportlab_falls_back_to_standard(self):
+        with self.settings(TICKET_PDF_PROFILE='compact'):
+            self.assertEqual(check_pdf_profile(None), [])
+            with mock.patch.object(reportlab, 'Version', '99.0.0'):
+                self.assertEqual([w.id for w in check_pdf_profile(None)], ['cinema_tickets.W001'])
+                pdf = render_tickets_pdf(self.билеты[:1])
+        self.assertEqual(self.strip_ids(pdf), self.strip_ids(self.render('standard', self.билеты[:1])))
+
+    @skipUnless(pymupdf, 'нужен PyMuPDF')
+    def test_independent_parser_reads_compact_pdf(self):
+        # Шрифт и картинки компактного профиля собраны вручную - проверяем их сторонним парсером PDF
+        pages = {}
+        for profile in ('standard', 'compact'):
+            for codes in ('vector', 'image'):
+                pymupdf.TOOLS.mupdf_warnings(reset=True)
+                document = pymupdf.open(stream=self.render(profile, self.билеты[:1], codes), filetype='pdf')
+                page = document[0]
+                fonts = {}
+                for xref, ext, font_type, basefont, *_ in page.get_fonts():
+                    if ext == 'ttf':
+                        buffer = document.extract_font(xref)[3]
+                        fonts[basefont] = (font_type, pymupdf.Font(fontbuffer=buffer).glyph_count)
+                images = [(width, height, bpc, colorspace)
+                          for _, _, width, height, bpc, colorspace, *_ in page.get_images(full=True)]
+                for xref, *_ in page.get_images(full=True):
+                    pymupdf.Pixmap(document, xref)  # картинка декодируется
+                pages[profile, codes] = (page.get_text(), fonts, images, page.get_pixmap(dpi=100).samples)
+                self.assertEqual(pymupdf.TOOLS.mupdf_warnings(), '', (profile, codes))
+
+        text, fonts, images, pixels = pages['compact', 'vector']
+        self.assertIn('Тестовый фильм', text)
+        self.assertEqual(fonts, pages['standard', 'vector'][1])
+        self.assertEqual(list(fonts.values())[0][0], 'TrueType')
+        self.assertEqual(images, [])
+        # Без хинтинга глифы растеризуются так же
+        self.assertEqual(pixels, pages['standard', 'vector'][3])
+
+        text, fonts, images, _ = pages['compact', 'image']
+        self.assertEqual(text, pages['standard', 'image'][0])
+        qr_side = len(qr_matrix(make_ticket_token(self.билеты[0])))
+        self.assertIn((qr_side, qr_side, 1, 'DeviceGray'), images)
+        self.assertEqual([image[2:] for image in images], [(1, 'DeviceGray')] * 2)
+
+    def test_image_codes_are_one_bit(self):
+        pdf = self.render('compact', self.билеты[:1], codes='image')
+        self.assertEqual(pdf.count(b'/Subtype /Image'), 2)
+        self.assertEqual(pdf.count(b'/BitsPerComponent 1'), 2)
+        self.assertNotIn(b'/DeviceRGB', pdf)
+
+    def test_compact_font_keeps_glyphs_and_metrics(self):
+        from reportlab.pdfbase.ttfonts import TTFontFile
+        from .pdfcompact import compact_truetype
+        font = TTFontFile(os.path.join(settings.BASE_DIR, 'static', 'fonts', 'DejaVuSans.ttf'))
+        subset = font.makeSubset([ord(char) for char in 'Билет №123'])
+        compact = compact_truetype(subset, 'DejaVuSans')
+        self.assertLess(len(compact), len(subset) / 2)
+        parsed = TTFontFile(io.BytesIO(compact))
+        self.assertNotIn('fpgm', parsed.table)
+        self.assertEqual(len(parsed.glyphPos), len(TTFontFile(io.BytesIO(subset)).glyphPos))
+
+
+class TicketPdfDownloadTests(CinemaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.билет = КупленныеБилеты.objects.create(
+            клиент=cls.клиент, сеанс=cls.сеанс, место=МестаВЗале.objects.get(номер_места=1),
+        )
+
+    def setUp(self):
+        generate_ticket_pdf(self.билет)
+        self.url = reverse('cinema_tickets:get_ticket_pdf', args=[self.билет.pk])
+        self.content = self.билет.pdf_файл.read()
+
+    def test_streams_with_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_conditional_get(self):
+        first = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"другой"').status_code, 200)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-99')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[:100])
+        self.assertEqual(response['Content-Range'], f'bytes 0-99/{len(self.content)}')
+
+        tail = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(tail.streaming_content), self.content[-10:])
+
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-').status_code, 416)
+        # Устаревший If-Range - отдаем файл целиком
+        stale = self.client.get(self.url, HTTP_RANGE='bytes=0-99', HTTP_IF_RANGE='"старый"')
+        self.assertEqual(stale.status_code, 200)
+
+    @override_settings(TICKET_PDF_SENDFILE='x-accel-redirect', TICKET_PDF_ACCEL_PREFIX='/protected/')
+    def test_accel_redirect_offload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.билет.pdf_файл.name)
+        self.assertEqual(response.content, b'')
+
+
+@override_settings(TICKET_PDF_LAZY=True)
+class LazyPdfTests(CinemaTestCase):
+
+    def test_purchase_skips_render_and_download_renders_once(self):
+        ticket_id = self.purchase(1).json()['ticket_id']
+        self.assertEqual(list(ЗаданияОбработки.objects.values_list('тип', flat=True)), [ЗаданияОбработки.ТИП_EMAIL])
+
+        url = reverse('cinema_tickets:get_ticket_pdf', args=[ticket_id])
+        with mock.patch('cinema_tickets.utils.generate_ticket_pdf', wraps=generate_ticket_pdf) as generate:
+            self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(КупленныеБилеты.objects.get(pk=ticket_id).статус, КупленныеБилеты.СТАТУС_PDF_ГОТОВ)
+
+    def test_email_job_renders_on_demand(self):
+        ticket_id = self.purchase(2).json()['ticket_id']
+        run_pending_jobs()
+        self.assertTrue(КупленныеБилеты.objects.get(pk=ticket_id).pdf_файл)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(TICKET_PDF_LAZY=True, MEDIA_ROOT=TEST_MEDIA_ROOT)
+class LazyPdfConcurrencyTests(TransactionTestCase):
+
+    def test_concurrent_first_requests_render_once(self):
+        клиент = ФизическиеЛица.objects.create(фамилия='Петров', имя='Петр', номер_телефона='+79000000002',
+                                               дата_рождения=date(1985, 5, 5))
+        зал = Залы.objects.create(название='Зал')
+        начало = timezone.now() + timedelta(days=1)
+        сеанс = СеансыФильмов.objects.create(зал=зал, название_фильма='Фильм', время_начала=начало,
+                                             время_окончания=начало + timedelta(hours=2))
+        билет = КупленныеБилеты.objects.create(клиент=клиент, сеанс=сеанс,
+                                               место=МестаВЗале.objects.create(зал=зал, номер_места=1))
+        cache.clear()
+
+        def slow_generate(ticket):
+            time.sleep(0.2)
+            return generate_ticket_pdf(ticket)
+
+        errors = []
+
+        def worker():
+            try:
+                ensure_ticket_pdf(КупленныеБилеты.objects.select_related('сеанс', 'место', 'клиент').get(pk=билет.pk))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        with mock.patch('cinema_tickets.utils.generate_ticket_pdf', side_effect=slow_generate) as generate:
+            threads = [threading.Thread(target=worker) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(generate.call_count, 1)
+
+
+class RegenerateTicketsCommandTests(CinemaTestCase):
+
+    def setUp(self):
+        # ID билетов повторяются от теста к тесту - PDF прошлого теста дали бы имени суффикс
+        shutil.rmtree(os.path.join(TEST_MEDIA_ROOT, 'tickets'), ignore_errors=True)
+        self.билеты = []
+        for номер in (1, 2, 3):
+            билет = КупленныеБилеты.objects.create(клиент=self.клиент, сеанс=self.сеанс,
+                                                   место=МестаВЗале.objects.get(номер_места=номер))
+            generate_ticket_pdf(билет)
+            self.билеты.append(билет)
+        self.state_file = os.path.join(TEST_MEDIA_ROOT, 'regenerate.state.json')
+
+    def regenerate(self, *args):
+        call_command('regenerate_tickets', '--processes', '2', '--chunk-size', '2',
+                     '--state-file', self.state_file, *args, stdout=io.StringIO())
+
+    def test_regenerates_and_removes_old_files(self):
+        old_names = [билет.pdf_файл.name for билет in self.билеты]
+        self.regenerate('--session', str(self.сеанс.pk))
+        for билет, old_name in zip(self.билеты, old_names):
+            билет.refresh_from_db()
+            # Новый файл пишется рядом со старым, старый удаляется после записи имени в БД
+            self.assertNotEqual(билет.pdf_файл.name, old_name)
+            self.assertTrue(билет.pdf_файл.storage.exists(билет.pdf_файл.name))
+            self.assertFalse(билет.pdf_файл.storage.exists(old_name))
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_failed_save_keeps_old_file(self):
+        билет = self.билеты[0]
+        old_name = билет.pdf_файл.name
+        with mock.patch.object(type(билет.pdf_файл.storage), 'save', side_effect=OSError('диск заполнен')):
+            with self.assertRaises(OSError):
+                generate_ticket_pdf(билет)
+        билет.refresh_from_db()
+        self.assertEqual(билет.pdf_файл.name, old_name)
+        self.assertTrue(билет.pdf_файл.storage.exists(old_name))
+
+    def write_state(self, **filters):
+        filters = {'sessions': [], 'date_from': None, 'date_to': None, 'ids': [], 'all': False, **filters}
+        with open(self.state_file, 'w') as f:
+            json.dump({'filters': filters, 'last_ticket_id': self.билеты[1].pk, 'last_order_id': 0, 'done': 2}, f)
+
+    def test_resume_skips_processed_tickets(self):
+        self.write_state()
+        with mock.patch('cinema_tickets.management.commands.regenerate_tickets.store_pdf',
+                        return_value=None) as store:
+            self.regenerate('--resume')
+        self.assertEqual([c.args[0].pk for c in store.call_args_list], [self.билеты[2].pk])
+
+    def test_resume_with_other_filters_is_refused(self):
+        self.write_state(sessions=[self.сеанс.pk])
+        with self.assertRaisesMessage(CommandError, 'с другими фильтрами'):
+            self.regenerate('--resume', '--all')
+        self.assertTrue(os.path.exists(self.state_file))
+
+    def test_regenerated_tickets_leave_failed_status(self):
+        КупленныеБилеты.objects.filter(pk=self.билеты[0].pk).update(
+            статус=КупленныеБилеты.СТАТУС_ОШИБКА, ошибка_обработки='Ошибка отрисовки')
+        КупленныеБилеты.objects.filter(pk=self.билеты[1].pk).update(статус=КупленныеБилеты.СТАТУС_ОТПРАВЛЕН)
+        self.regenerate('--all')
+        статусы = dict(КупленныеБилеты.objects.values_list('pk', 'статус'))
+        self.assertEqual([статусы[билет.pk] for билет in self.билеты],
+                         [КупленныеБилеты.СТАТУС_PDF_ГОТОВ, КупленныеБилеты.СТАТУС_ОТПРАВЛЕН,
+                          КупленныеБилеты.СТАТУС_PDF_ГОТОВ])
+        self.assertEqual(КупленныеБилеты.objects.get(pk=self.билеты[0].pk).ошибка_обработки, '')
+
+
+class BatchPrintTests(CinemaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for номер in range(1, 6):
+            КупленныеБилеты.objects.create(клиент=cls.клиент, сеанс=cls.сеанс,
+                                           место=МестаВЗале.objects.get(номер_места=номер))
+
+    def test_command_renders_session_into_one_document(self):
+        # Каталог медиа удаляется после каждого класса тестов - создаем его, если его еще нет
+        os.makedirs(TEST_MEDIA_ROOT, exist_ok=True)
+        output = os.path.join(TEST_MEDIA_ROOT, 'session.pdf')
+        call_command('print_tickets', '--session', str(self.сеанс.pk), '--per-page', '4',
+                     '--output', output, stdout=io.StringIO())
+        with open(output, 'rb') as f:
+            pdf = f.read()
+        # 5 билетов по 4 на лист - 2 листа, статическая часть описана один раз
+        self.assertEqual(pdf.count(b'/Type /Page\n'), 2)
+        self.assertEqual(pdf.count(b'/Subtype /Form'), 1)
+
+    def test_admin_action_returns_pdf(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.login(username='admin', password='pass')
+        response = self.client.post(
+            reverse('admin:cinema_tickets_сеансыфильмов_changelist'),
+            {'action': 'print_session_tickets', '_selected_action': [self.сеанс.pk]},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP-сервер: принимает письма и считает соединения."""
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.wfile.write(b'220 localhost ready\r\n')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip()
+            verb = command.split(' ', 1)[0].split(':', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.wfile.write(b'250 localhost\r\n')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                if address in server.rejected:
+                    self.wfile.write(b'550 mailbox unavailable\r\n')
+                else:
+                    recipients.append(address)
+                    self.wfile.write(b'250 OK\r\n')
+            elif verb == 'DATA':
+                self.wfile.write(b'354 end with .\r\n')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with server.lock:
+                    server.messages.append(recipients)
+                recipients = []
+                self.wfile.write(b'250 OK\r\n')
+            elif verb == 'QUIT':
+                self.wfile.write(b'221 bye\r\n')
+                return
+            else:
+                # MAIL, RSET, NOOP
+                if verb == 'RSET':
+                    recipients = []
+                self.wfile.write(b'250 OK\r\n')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, rejected=()):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        self.rejected = set(rejected)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+@override_settings(TICKET_PDF_LAZY=True)
+class EmailOutboxTests(CinemaTestCase):
+
+    def smtp_settings(self, server):
+        return self.settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                             EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.server_address[1],
+                             EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='')
+
+    def test_email_jobs_are_sent_over_one_connection(self):
+        for номер in (1, 2, 3):
+            self.purchase(номер, email=f'holder{номер}@example.com')
+        with SMTPStandIn() as server, self.smtp_settings(server):
+            run_pending_jobs()
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(sorted(server.messages),
+                         [['holder1@example.com'], ['holder2@example.com'], ['holder3@example.com']])
+        self.assertEqual(set(КупленныеБилеты.objects.values_list('статус', flat=True)),
+                         {КупленныеБилеты.СТАТУС_ОТПРАВЛЕН})
+
+    def test_refused_recipient_fails_only_its_job(self):
+        for номер in (1, 2, 3):
+            self.purchase(номер, email=f'holder{номер}@example.com')
+        with SMTPStandIn(rejected={'holder2@example.com'}) as server, self.smtp_settings(server):
+            run_pending_jobs()
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(len(server.messages), 2)
+        задание = ЗаданияОбработки.objects.get(параметры__email='holder2@example.com')
+        self.assertEqual(задание.статус, ЗаданияОбработки.СТАТУС_ОТЛОЖЕНО)
+        self.assertIn('550', задание.последняя_ошибка)
+        self.assertEqual(ЗаданияОбработки.objects.filter(статус=ЗаданияОбработки.СТАТУС_ВЫПОЛНЕНО).count(), 2)
+
+    def test_attachment_is_taken_from_memory(self):
+        билет = КупленныеБилеты.objects.create(клиент=self.клиент, сеанс=self.сеанс,
+                                               место=МестаВЗале.objects.get(номер_места=4))
+        ensure_ticket_pdf(билет)
+        with mock.patch('django.db.models.fields.files.FieldFile.open') as open_file:
+            with ПочтовыйЯщик() as outbox:
+                outbox.add(build_ticket_email(билет, 'holder@example.com'))
+        open_file.assert_not_called()
+        self.assertEqual(outbox.sent, 1)
+        self.assertTrue(mail.outbox[0].attachments[0][1].startswith(b'%PDF'))
+
+    def test_session_change_notifies_each_holder_once(self):
+        for номер, email in ((1, 'a@example.com'), (2, 'b@example.com'), (3, 'a@example.com'),
+                             (4, 'c@example.com'), (5, 'd@example.com')):
+            КупленныеБилеты.objects.create(клиент=self.клиент, сеанс=self.сеанс, email_получателя=email,
+                                           место=МестаВЗале.objects.get(номер_места=номер))
+        out = io.StringIO()
+        with SMTPStandIn() as server, self.smtp_settings(server):
+            call_command('notify_session', '--session', str(self.сеанс.pk), '--batch-size', '2', stdout=out)
+        # 4 адреса пачками по 2 - два соединения
+        self.assertEqual(server.connections, 2)
+        self.assertEqual(sorted(server.messages),
+                         [['a@example.com'], ['b@example.com'], ['c@example.com'], ['d@example.com']])
+        self.assertIn('писем/с', out.getvalue())
+
+    def test_admin_reschedule_enqueues_notification(self):
+        КупленныеБилеты.objects.create(клиент=self.клиент, сеанс=self.сеанс, email_получателя='a@example.com',
+                                       место=МестаВЗале.objects.get(номер_места=1))
+        User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.login(username='admin', password='pass')
+        начало = self.сеанс.время_начала + timedelta(hours=2)
+        окончание = self.сеанс.время_окончания + timedelta(hours=2)
+        response = self.client.post(
+            reverse('admin:cinema_tickets_сеансыфильмов_change', args=[self.сеанс.pk]),
+            {'зал': self.зал.pk, 'название_фильма': self.сеанс.название_фильма,
+             'время_начала_0': начало.strftime('%Y-%m-%d'), 'время_начала_1': начало.strftime('%H:%M:%S'),
+             'время_окончания_0': окончание.strftime('%Y-%m-%d'),
+             'время_окончания_1': окончание.strftime('%H:%M:%S')},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(ЗаданияОбработки.objects.filter(тип=ЗаданияОбработки.ТИП_УВЕДОМЛЕНИЕ_СЕАНСА).exists())
+        run_pending_jobs()
+        self.assertEqual([m.to for m in mail.outbox], [['a@example.com']])
+
+
+class HallLayoutTests(CinemaTestCase):
+
+    def write_layout(self, layout):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'layout.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(layout, f, ensure_ascii=False)
+        return path
+
+    def test_import_provisions_seats_in_few_queries(self):
+        path = self.write_layout({'hall': 'Большой зал', 'sections': [
+            {'name': 'Партер', 'rows': [{'rows': [1, 40], 'seats': 50}]},
+            {'name': 'Балкон', 'rows': [{'row': 1, 'seats': [1, 2, 5, 6]}]},
+        ]})
+        out = io.StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_hall_layout', path, stdout=out)
+        # Места вставляются пачками (в SQLite - до 999 параметров на запрос), а не по одному
+        self.assertLess(len(queries), 25)
+        зал = Залы.objects.get(название='Большой зал')
+        self.assertEqual(зал.места.count(), 2004)
+        последнее = зал.места.get(номер_места=2004)
+        self.assertEqual((последнее.секция, последнее.ряд, последнее.место_в_ряду), ('Балкон', 1, 6))
+        self.assertEqual(последнее.обозначение, 'Балкон, ряд 1, место 6')
+
+        # Повторный импорт ничего не дублирует
+        call_command('import_hall_layout', path, stdout=out)
+        self.assertEqual(зал.места.count(), 2004)
+
+    def test_purchase_and_seat_map_are_scoped_to_session_hall(self):
+        другой_зал = Залы.objects.create(название='Зал 2')
+        МестаВЗале.objects.bulk_create([МестаВЗале(зал=другой_зал, номер_места=n, ряд=1, место_в_ряду=n)
+                                        for n in range(1, 21)])
+        начало = timezone.now() + timedelta(days=2)
+        другой_сеанс = СеансыФильмов.objects.create(зал=другой_зал, название_фильма='Другой фильм',
+                                                    время_начала=начало,
+                                                    время_окончания=начало + timedelta(hours=2))
+        # Место 15 есть только во втором зале
+        self.assertEqual(self.purchase(15).status_code, 404)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.purchase(15, session_id=другой_сеанс.pk)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['seat_label'], 'ряд 1, место 15')
+        билет = КупленныеБилеты.objects.get(pk=response.json()['ticket_id'])
+        self.assertEqual(билет.место.зал, другой_зал)
+
+        # Тот же номер места в первом зале остается свободным
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.purchase(5).status_code, 201)
+            self.assertEqual(self.purchase(5, session_id=другой_сеанс.pk).status_code, 201)
+
+        seats = self.client.get(reverse('cinema_tickets:session_seats', args=[другой_сеанс.pk])).json()
+        self.assertEqual((seats['hall_id'], seats['total'], seats['occupied']), (другой_зал.pk, 20, [5, 15]))
+        seats = self.client.get(reverse('cinema_tickets:session_seats', args=[self.сеанс.pk])).json()
+        self.assertEqual((seats['total'], seats['occupied']), (10, [5]))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class BenchmarkSuiteTests(TransactionTestCase):
+
+    def test_writes_machine_readable_results(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        output = os.path.join(directory, 'results.json')
+        call_command('benchmark_suite', '--use-current-db', '--tickets', '300', '--clients', '20',
+                     '--hall-seats', '100', '--threads', '3', '--purchase-seats', '5', '--renders', '3',
+                     '--downloads', '6', '--output', output, stdout=io.StringIO())
+        with open(output, encoding='utf-8') as f:
+            results = json.load(f)
+
+        self.assertEqual(results['seed']['tickets'], 300)
+        # 3 потока пытаются купить одни и те же 5 мест: продано не больше 5
+        self.assertEqual(results['purchase']['count'], 15)
+        self.assertFalse(results['purchase']['oversold'])
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput'):
+            self.assertIn(key, results['purchase'])
+            self.assertIn(key, results['download'])
+        self.assertEqual(set(results['render']['stages']), {'load', 'text', 'qr', 'barcode', 'serialize', 'store', 'db'})
+
+
+class PurchaseLockRetryTests(TransactionTestCase):
+    """Повтор записи покупки при "database is locked" (вне TestCase, где все внутри atomic)."""
+
+    def setUp(self):
+        cache.clear()
+        self.клиент = ФизическиеЛица.objects.create(фамилия='Сидоров', имя='Сидор', номер_телефона='+79000000003',
+                                                    дата_рождения=date(1980, 3, 3))
+        зал = Залы.objects.create(название='Зал')
+        начало = timezone.now() + timedelta(days=1)
+        self.сеанс = СеансыФильмов.objects.create(зал=зал, название_фильма='Фильм', время_начала=начало,
+                                                  время_окончания=начало + timedelta(hours=2))
+        МестаВЗале.objects.create(зал=зал, номер_места=1)
+
+    def purchase_with_locks(self, locked_times):
+        create = КупленныеБилеты.objects.create
+        calls = []
+
+        def flaky_create(**kwargs):
+            calls.append(1)
+            if len(calls) <= locked_times:
+                raise OperationalError('database is locked')
+            return create(**kwargs)
+
+        payload = {'client_id': self.клиент.pk, 'session_id': self.сеанс.pk, 'seat_number': 1,
+                   'client_email': 'sidorov@example.com'}
+        with mock.patch.object(КупленныеБилеты.objects, 'create', side_effect=flaky_create), \
+                self.settings(DB_LOCK_RETRY_ATTEMPTS=3, DB_LOCK_RETRY_BASE_DELAY=0.001), \
+                mock.patch('builtins.print'):
+            return self.client.post(reverse('cinema_tickets:purchase_ticket'),
+                                    data=json.dumps(payload), content_type='application/json')
+
+    def test_purchase_retries_locked_database(self):
+        response = self.purchase_with_locks(2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(КупленныеБилеты.objects.count(), 1)
+
+    def test_exhausted_retries_return_503(self):
+        response = self.purchase_with_locks(3)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(КупленныеБилеты.objects.exists())
+        # Удержание места снято - повторный запрос не получит 409
+        self.assertEqual(self.purchase_with_locks(0).status_code, 201)
+
+
+class SQLiteConcurrencyTests(SimpleTestCase):
+    """
+    Нагрузочная проверка профиля SQLite на отдельной файловой БД: потоки выполняют
+    короткие транзакции "прочитать, затем записать" (как get_or_create внутри atomic).
+    """
+    THREADS = 8
+    ITERATIONS = 15
+
+    def stress(self, alias, options, retry_attempts):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        config = connections.configure_settings({
+            'default': settings.DATABASES['default'],
+            alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, 'stress.sqlite3'),
+                    'OPTIONS': options},
+        })[alias]
+        connections.settings[alias] = config
+        self.addCleanup(connections.settings.pop, alias)
+        # Алиас появился после настройки класса - разрешаем потокам подключаться к нему
+        allow = mock.patch.object(type(self), 'databases', type(self).databases | {alias})
+        allow.start()
+        self.addCleanup(allow.stop)
+        with connections[alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE stress_seats (id INTEGER PRIMARY KEY, seat INTEGER UNIQUE)')
+        connections[alias].close()
+        del connections[alias]
+
+        errors = []
+
+        @retry_on_lock(using=alias)
+        def book(seat):
+            with transaction.atomic(using=alias):
+                with connections[alias].cursor() as cursor:
+                    cursor.execute('SELECT COUNT(*) FROM stress_seats')
+                    time.sleep(0.002)
+                    cursor.execute('INSERT INTO stress_seats (seat) VALUES (%s)', [seat])
+
+        def worker(index):
+            try:
+                for i in range(self.ITERATIONS):
+                    try:
+                        book(index * 1000 + i)
+                    except (OperationalError, БДПерегружена) as e:
+                        errors.append(e)
+            finally:
+                connections[alias].close()
+                del connections[alias]
+
+        with self.settings(DB_LOCK_RETRY_ATTEMPTS=retry_attempts), mock.patch('builtins.print'):
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.THREADS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return len(errors) / (self.THREADS * self.ITERATIONS)
+
+    def test_profile_and_retry_remove_lock_errors(self):
+        # По умолчанию (DEFERRED, журнал DELETE) "повышение" чтения до записи упирается
+        # в чужую блокировку, и SQLite сразу отвечает "database is locked"
+        legacy_error_rate = self.stress('stress_legacy', {}, retry_attempts=1)
+        profile_error_rate = self.stress('stress_profile', settings.SQLITE_CONCURRENCY_OPTIONS, retry_attempts=5)
+        self.assertGreater(legacy_error_rate, 0)
+        self.assertEqual(profile_error_rate, 0)
+
+    def test_retry_gives_up_after_bounded_attempts(self):
+        calls = []
+        retried = metrics.db_lock_errors.value(outcome='retried')
+        gave_up = metrics.db_lock_errors.value(outcome='gave_up')
+
+        @retry_on_lock
+        def always_locked():
+            calls.append(1)
+            raise OperationalError('database is locked')
+
+        with self.settings(DB_LOCK_RETRY_ATTEMPTS=3, DB_LOCK_RETRY_BASE_DELAY=0.001), \
+                mock.patch('builtins.print'):
+            with self.assertRaises(БДПерегружена):
+                always_locked()
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(metrics.db_lock_errors.value(outcome='retried'), retried + 2)
+        self.assertEqual(metrics.db_lock_errors.value(outcome='gave_up'), gave_up + 1)
+
+
+class PurchaseQueryBudgetTests(CinemaTestCase):
+    """
+    Число запросов к БД при покупке. Внутри TestCase транзакция покупки - это
+    SAVEPOINT/RELEASE (2 запроса), в рабочем режиме вместо них BEGIN/COMMIT.
+    """
+
+    def setUp(self):
+        cache.clear()
+        # Прогрев: сеанс и места зала попадают в кэш
+        self.assertEqual(self.purchase(1).status_code, 201)
+
+    def test_warm_purchase_budget(self):
+        # клиент, SAVEPOINT, билет, задания, RELEASE
+        with self.assertNumQueries(5):
+            response = self.purchase(2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['seat_label'], '№2')
+
+    def test_email_change_is_one_conditional_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.purchase(2, email='new@example.com')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(queries), 6)
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('NOT', updates[0])
+        self.клиент.refresh_from_db()
+        self.assertEqual(self.клиент.email, 'new@example.com')
+
+    def test_cold_cache_adds_session_and_hall_seats(self):
+        cache.clear()
+        with self.assertNumQueries(7):
+            self.assertEqual(self.purchase(2).status_code, 201)
+
+    def test_sold_seat_is_rejected_by_constraint(self):
+        # Проверки "место занято" до вставки нет: ее заменяет уникальность (сеанс, место).
+        # клиент, SAVEPOINT, неудачная вставка, ROLLBACK TO и RELEASE SAVEPOINT
+        with self.assertNumQueries(5):
+            response = self.purchase(1)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(КупленныеБилеты.objects.filter(сеанс=self.сеанс).count(), 1)
+
+    def test_foreign_email_is_rejected_by_constraint(self):
+        ФизическиеЛица.objects.create(фамилия='Петров', имя='Петр', номер_телефона='+79000000009',
+                                      дата_рождения=date(1991, 1, 1), email='taken@example.com')
+        response = self.purchase(3, email='taken@example.com')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('другим клиентом', response.json()['error'])
+        self.assertFalse(КупленныеБилеты.objects.filter(место__номер_места=3).exists())
+
+    def test_seat_index_follows_hall_changes(self):
+        self.assertEqual(self.purchase(11).status_code, 404)
+        МестаВЗале.objects.create(зал=self.зал, номер_места=11, секция='Балкон', ряд=1, место_в_ряду=1)
+        response = self.purchase(11)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['seat_label'], 'Балкон, ряд 1, место 1')
+
+
+class HomeListingTests(CinemaTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_listing_is_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('cinema_tickets:home'))
+        self.assertContains(response, 'Тестовый фильм')
+        self.assertContains(response, '10 из 10')
+        with self.assertNumQueries(0):
+            self.client.get(reverse('cinema_tickets:home'))
+
+    def test_purchase_and_session_edit_invalidate_cached_page(self):
+        self.client.get(reverse('cinema_tickets:home'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.purchase(1).status_code, 201)
+        self.assertContains(self.client.get(reverse('cinema_tickets:home')), '9 из 10')
+
+        self.сеанс.название_фильма = 'Новое название'
+        self.сеанс.save()
+        self.assertContains(self.client.get(reverse('cinema_tickets:home')), 'Новое название')
+
+    @override_settings(HOME_SESSIONS_PAGE_SIZE=2)
+    def test_keyset_pagination_visits_every_session_once(self):
+        # Несколько сеансов с одинаковым временем начала: порядок задает id
+        for номер in range(4):
+            СеансыФильмов.objects.create(зал=self.зал, название_фильма=f'Фильм {номер}',
+                                         время_начала=self.сеанс.время_начала,
+                                         время_окончания=self.сеанс.время_окончания)
+        СеансыФильмов.objects.create(зал=self.зал, название_фильма='Прошедший',
+                                     время_начала=timezone.now() - timedelta(hours=3),
+                                     время_окончания=timezone.now() - timedelta(hours=1))
+        seen, after, pages = [], None, 0
+        while True:
+            sessions, after = upcoming_sessions(after)
+            seen.extend(сеанс.pk for сеанс in sessions)
+            pages += 1
+            if after is None:
+                break
+        upcoming = СеансыФильмов.objects.filter(время_начала__gte=timezone.now()).order_by('время_начала', 'pk')
+        self.assertEqual(seen, list(upcoming.values_list('pk', flat=True)))
+        self.assertEqual(pages, 3)
+
+        response = self.client.get(reverse('cinema_tickets:home'))
+        self.assertContains(response, '?after=')
+
+    def test_bad_cursor_is_rejected(self):
+        response = self.client.get(reverse('cinema_tickets:home'), {'after': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ClientTicketsApiTests(CinemaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # 30 сеансов x 10 мест = 300 билетов клиента, часть - с одинаковым временем покупки
+        начало = timezone.now() + timedelta(days=2)
+        сеансы = СеансыФильмов.objects.bulk_create([
+            СеансыФильмов(зал=cls.зал, название_фильма=f'Фильм {n}', время_начала=начало + timedelta(hours=n),
+                          время_окончания=начало + timedelta(hours=n, minutes=90))
+            for n in range(30)
+        ])
+        места = list(МестаВЗале.objects.filter(зал=cls.зал))
+        билеты = КупленныеБилеты.objects.bulk_create([
+            КупленныеБилеты(клиент=cls.клиент, сеанс=сеанс, место=место)
+            for сеанс in сеансы for место in места
+        ])
+        момент = timezone.now() - timedelta(days=1)
+        for index, билет in enumerate(билеты):
+            билет.дата_покупки = момент + timedelta(minutes=index // 3)
+        КупленныеБилеты.objects.bulk_update(билеты, ['дата_покупки'])
+
+    def url(self, client_id=None):
+        return reverse('cinema_tickets:client_tickets', args=[client_id or self.клиент.pk])
+
+    def test_pages_cover_all_tickets_newest_first(self):
+        seen, params = [], {'limit': 40}
+        while True:
+            with self.assertNumQueries(1):
+                data = self.client.get(self.url(), params).json()
+            seen.extend(t['ticket_id'] for t in data['tickets'])
+            if not data['next_cursor']:
+                break
+            params['after'] = data['next_cursor']
+        expected = КупленныеБилеты.objects.filter(клиент=self.клиент).order_by('-дата_покупки', '-pk')
+        self.assertEqual(seen, list(expected.values_list('pk', flat=True)))
+        self.assertEqual(len(seen), 300)
+
+    def test_deep_page_uses_index_without_sorting(self):
+        _, cursor = client_tickets(self.клиент.pk, limit=250)
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url(), {'after': cursor, 'limit': 20}).json()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(data['tickets']), 20)
+        self.assertEqual(data['tickets'][0]['seat_label'], '№' + str(data['tickets'][0]['seat']))
+
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + queries[0]['sql'])
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        # Глубокая страница - поиск по индексу сразу к курсору и чтение следующих строк,
+        # без сортировки и без просмотра билетов предыдущих страниц
+        self.assertIn('билеты_клиент_дата_idx (клиент_id=? AND дата_покупки<?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_unknown_client_and_bad_cursor(self):
+        self.assertEqual(self.client.get(self.url(client_id=999999)).status_code, 404)
+        self.assertEqual(self.client.get(self.url(), {'after': 'xyz'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url(), {'limit': 'many'}).status_code, 400)
+
+
+class TicketAdminScaleTests(CinemaTestCase):
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.login(username='admin', password='pass')
+        self.url = reverse('admin:cinema_tickets_купленныебилеты_changelist')
+
+    def add_tickets(self, sessions):
+        начало = timezone.now() + timedelta(days=3)
+        сеансы = СеансыФильмов.objects.bulk_create([
+            СеансыФильмов(зал=self.зал, название_фильма=f'Фильм {n}', время_начала=начало + timedelta(hours=n),
+                          время_окончания=начало + timedelta(hours=n, minutes=90))
+            for n in range(sessions)
+        ])
+        места = list(МестаВЗале.objects.filter(зал=self.зал))
+        КупленныеБилеты.objects.bulk_create([
+            КупленныеБилеты(клиент=self.клиент, сеанс=сеанс, место=место, email_получателя=f'{сеанс.pk}@example.com')
+            for сеанс in сеансы for место in места
+        ])
+
+    def changelist_queries(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, [q['sql'] for q in queries]
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.add_tickets(2)
+        _, small = self.changelist_queries()
+        self.add_tickets(8)
+        response, large = self.changelist_queries()
+        self.assertContains(response, 'Иванов Иван Иванович')
+        self.assertEqual(len(small), len(large))
+        # Ни выборки различных значений для фильтров, ни полного COUNT(*) по таблице билетов
+        self.assertFalse([sql for sql in large if 'DISTINCT' in sql])
+        self.assertFalse([sql for sql in large
+                          if 'COUNT(*)' in sql and 'купленныебилеты' in sql and 'LIMIT' not in sql])
+
+    def test_estimated_count_for_unfiltered_list(self):
+        self.add_tickets(3)
+        with mock.patch.object(ОценочныйПагинатор, 'MAX_EXACT_COUNT', 10):
+            # Без статистики таблицы полный список тоже считается не дальше MAX_EXACT_COUNT
+            response, _ = self.changelist_queries()
+            self.assertEqual(response.context['cl'].result_count, 10)
+            refresh_row_estimate(КупленныеБилеты)
+            response, queries = self.changelist_queries()
+            self.assertEqual(response.context['cl'].result_count, 30)
+            self.assertTrue([sql for sql in queries if 'sqlite_stat1' in sql])
+            # Отфильтрованный список считается не дальше MAX_EXACT_COUNT строк
+            response, _ = self.changelist_queries({'статус__exact': КупленныеБилеты.СТАТУС_ОЖИДАЕТ})
+            self.assertEqual(response.context['cl'].result_count, 10)
+
+    def test_estimate_follows_archival(self):
+        self.add_tickets(3)
+        refresh_row_estimate(КупленныеБилеты)
+        прошедшие = СеансыФильмов.objects.filter(название_фильма__in=['Фильм 0', 'Фильм 1'])
+        прошедшие.update(время_начала=timezone.now() - timedelta(days=10),
+                         время_окончания=timezone.now() - timedelta(days=10) + timedelta(minutes=90))
+        call_command('archive_tickets', '--older-than', '7', stdout=io.StringIO())
+        # id оставшихся билетов - самые большие, но оценка следует за удалением
+        self.assertEqual(estimated_row_count(КупленныеБилеты), 10)
+        self.assertEqual(КупленныеБилеты.objects.count(), 10)
+
+    def test_search_and_session_filter(self):
+        self.add_tickets(2)
+        сеанс = СеансыФильмов.objects.get(название_фильма='Фильм 1')
+        response, _ = self.changelist_queries({'q': f'{сеанс.pk}@example.com'})
+        self.assertEqual(response.context['cl'].result_count, 10)
+        response, _ = self.changelist_queries({'q': 'Иванов'})
+        self.assertEqual(response.context['cl'].result_count, 20)
+        response, _ = self.changelist_queries({'сеанс': str(сеанс.pk)})
+        self.assertEqual({билет.сеанс_id for билет in response.context['cl'].result_list}, {сеанс.pk})
+
+    def test_regenerate_action_enqueues_jobs(self):
+        self.add_tickets(1)
+        ids = list(КупленныеБилеты.objects.values_list('pk', flat=True)[:3])
+        with mock.patch('cinema_tickets.jobs.generate_ticket_pdf') as generate:
+            for _ in range(2):
+                response = self.client.post(self.url, {'action': 'regenerate_pdf', '_selected_action': ids})
+                self.assertEqual(response.status_code, 302)
+        # PDF не генерируется в запросе, а повторный запуск не дублирует задания
+        generate.assert_not_called()
+        self.assertEqual(ЗаданияОбработки.objects.filter(тип=ЗаданияОбработки.ТИП_PDF, билет_id__in=ids).count(), 3)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class MetricsTests(CinemaTestCase):
+
+    def metrics(self):
+        response = self.client.get(reverse('cinema_tickets:metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_request_latency_and_query_counts(self):
+        before = metrics.http_request_duration.count(view='cinema_tickets:purchase_ticket', method='POST', status='2xx')
+        self.assertEqual(self.purchase(1).status_code, 201)
+        self.assertEqual(
+            metrics.http_request_duration.count(view='cinema_tickets:purchase_ticket', method='POST', status='2xx'),
+            before + 1)
+        text = self.metrics()
+        self.assertIn('# TYPE cinema_http_request_duration_seconds histogram', text)
+        self.assertIn('cinema_http_request_duration_seconds_bucket{view="cinema_tickets:purchase_ticket",'
+                      'method="POST",status="2xx",le="+Inf"}', text)
+        self.assertIn('cinema_http_request_db_queries_count{view="cinema_tickets:purchase_ticket"}', text)
+
+    def test_unknown_methods_share_one_label(self):
+        url = reverse('cinema_tickets:session_seats', args=[self.сеанс.pk])
+        before = metrics.http_request_duration.count(view='cinema_tickets:session_seats', method='other', status='4xx')
+        for method in ('BREW', 'X-RANDOM-1'):
+            self.client.generic(method, url)
+        self.assertEqual(
+            metrics.http_request_duration.count(view='cinema_tickets:session_seats', method='other', status='4xx'),
+            before + 2)
+        self.assertNotIn('method="BREW"', self.metrics())
+
+    def test_conflict_counter(self):
+        sold = metrics.seat_conflicts.value(endpoint='purchase', reason='sold')
+        self.purchase(2)
+        self.assertEqual(self.purchase(2).status_code, 409)
+        self.assertEqual(metrics.seat_conflicts.value(endpoint='purchase', reason='sold'), sold + 1)
+        self.assertIn('cinema_seat_conflicts_total{endpoint="purchase",reason="sold"}', self.metrics())
+
+    def test_render_and_email_stages(self):
+        билет = КупленныеБилеты.objects.create(клиент=self.клиент, сеанс=self.сеанс,
+                                               место=МестаВЗале.objects.get(номер_места=3))
+        stages = ('load', 'text', 'qr', 'barcode', 'serialize', 'store', 'db', 'email_build', 'email_send')
+        before = {stage: metrics.render_stage_duration.count(stage=stage) for stage in stages}
+        generate_ticket_pdf(билет)
+        with mock.patch('builtins.print'):
+            self.assertTrue(send_ticket_email(билет, 'ivanov@example.com'))
+        for stage in stages:
+            self.assertEqual(metrics.render_stage_duration.count(stage=stage), before[stage] + 1, stage)
+        self.assertIn('cinema_render_stage_seconds_sum{stage="qr"}', self.metrics())
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_access_can_be_restricted(self):
+        self.assertEqual(self.client.get(reverse('cinema_tickets:metrics')).status_code, 403)
+        response = self.client.get(reverse('cinema_tickets:metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_access_is_local_by_default(self):
+        self.assertEqual(settings.METRICS_ALLOWED_IPS, ['127.0.0.1', '::1'])
+        response = self.client.get(reverse('cinema_tickets:metrics'), REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, 403)
+        for allowed in (None, []):
+            with self.settings(METRICS_ALLOWED_IPS=allowed):
+                self.assertEqual(self.client.get(reverse('cinema_tickets:metrics')).status_code, 403)
+
+    def test_label_values_are_escaped(self):
+        counter = metrics.Счетчик('test_escape_total', 'Проверка экранирования.', labels=('value',))
+        try:
+            counter.inc(value='a"b\\c\nd')
+            self.assertIn('test_escape_total{value="a\\"b\\\\c\\nd"} 1', metrics.render_metrics())
+        finally:
+            metrics._registry.remove(counter)
+
+
+class CheckInTests(CinemaTestCase):
+
+    def setUp(self):
+        cache.clear()
+        for номер in (1, 2, 3):
+            self.assertEqual(self.purchase(номер).status_code, 201)
+        self.билеты = list(КупленныеБилеты.objects.filter(сеанс=self.сеанс).order_by('место__номер_места'))
+
+    def scan(self, code, session_id=None, **headers):
+        payload = {'session_id': session_id or self.сеанс.pk, 'code': code}
+        return self.client.post(reverse('cinema_tickets:checkin'), data=json.dumps(payload),
+                                content_type='application/json', headers=headers)
+
+    def test_scan_is_answered_from_index(self):
+        checkin.build_index(self.сеанс.pk)
+        # Пропуск - только условный UPDATE, поиск билета идет по индексу
+        with CaptureQueriesContext(connection) as queries:
+            response = self.scan(f'TICKET-{self.билеты[0].pk}')
+        self.assertEqual([q['sql'].split()[0] for q in queries], ['UPDATE'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['result'], 'admitted')
+        self.assertEqual(response.json()['seat_label'], '№1')
+        self.assertIsNotNone(КупленныеБилеты.objects.get(pk=self.билеты[0].pk).время_прохода)
+        # Чужой билет отсекается индексом без БД
+        with self.assertNumQueries(0):
+            self.assertEqual(self.scan('TICKET-999999').status_code, 404)
+
+    def test_preload_needs_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, 'только в процессе команды'):
+            call_command('preload_checkin', stdout=io.StringIO())
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                              'LOCATION': directory}}
+        with self.settings(CACHES=shared):
+            out = io.StringIO()
+            call_command('preload_checkin', within=2 * 24 * 60, stdout=out)
+            self.assertIn('билетов: 3', out.getvalue())
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.scan(f'TICKET-{self.билеты[0].pk}').status_code, 200)
+        # К таблице билетов - только отметка прохода (остальное - обозначение места в пустом кэше)
+        self.assertEqual([q['sql'].split()[0] for q in queries if 'купленныебилеты' in q['sql']], ['UPDATE'])
+
+    def test_second_scan_is_rejected(self):
+        code = f'TICKET-{self.билеты[1].pk}'
+        self.assertEqual(self.scan(code).status_code, 200)
+        response = self.scan(code)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['result'], 'already_admitted')
+
+    def test_ticket_for_other_session(self):
+        начало = self.сеанс.время_начала + timedelta(hours=3)
+        другой = СеансыФильмов.objects.create(зал=self.зал, название_фильма='Другой фильм', время_начала=начало,
+                                              время_окончания=начало + timedelta(minutes=90))
+        response = self.scan(f'TICKET-{self.билеты[0].pk}', session_id=другой.pk)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['result'], 'not_found')
+
+    def test_bad_code(self):
+        self.assertEqual(self.scan('не билет').status_code, 400)
+        response = self.client.post(reverse('cinema_tickets:checkin'), data='{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_database_decides_admission_across_processes(self):
+        # Индекс построен до прохода - как в другом процессе со своим кэшем
+        checkin.build_index(self.сеанс.pk)
+        index = cache.get(checkin._index_key(self.сеанс.pk))
+        code = f'TICKET-{self.билеты[0].pk}'
+        first = self.scan(code).json()['admitted_at']
+        cache.set(checkin._index_key(self.сеанс.pk), index)
+        response = self.scan(code)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['admitted_at'], first)
+
+        # Перестроенный индекс берет время прохода из БД и отвечает без запросов
+        checkin.invalidate_index(self.сеанс.pk)
+        checkin.build_index(self.сеанс.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.scan(code).status_code, 409)
+
+    def test_scan_works_when_cache_rejects_index(self):
+        # Кэш не сохранил индекс (слишком большое значение, вытеснение): скан отвечает
+        # по только что построенным массивам, а не падает на пустом кэше
+        with mock.patch.object(checkin.cache, 'set'):
+            response = self.scan(f'TICKET-{self.билеты[1].pk}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['result'], 'admitted')
+            self.assertEqual(self.scan('TICKET-999999').status_code, 404)
+
+    def test_new_purchase_rebuilds_index(self):
+        checkin.build_index(self.сеанс.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.purchase(4).status_code, 201)
+        билет = КупленныеБилеты.objects.get(сеанс=self.сеанс, место__номер_места=4)
+        self.assertEqual(self.scan(f'TICKET-{билет.pk}').status_code, 200)
+
+    @override_settings(CHECKIN_API_TOKEN='secret')
+    def test_token_is_required_when_configured(self):
+        code = f'TICKET-{self.билеты[2].pk}'
+        self.assertEqual(self.scan(code).status_code, 403)
+        self.assertEqual(self.scan(code, **{'X-Checkin-Token': 'secret'}).status_code, 200)
+
+
+class QrTokenTests(CinemaTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.билет = КупленныеБилеты.objects.create(клиент=self.клиент, сеанс=self.сеанс,
+                                                    место=МестаВЗале.objects.get(номер_места=5))
+
+    def test_round_trip(self):
+        token = make_ticket_token(self.билет)
+        self.assertEqual(len(token), 40)
+        decoded = decode_token(token.lower())
+        self.assertEqual((decoded.ticket_id, decoded.session_id, decoded.seat_number),
+                         (self.билет.pk, self.сеанс.pk, 5))
+        self.assertGreater(decoded.expires_at, self.сеанс.время_окончания)
+
+    def test_large_ids_use_wide_token(self):
+        начало = self.сеанс.время_начала
+        сеанс = СеансыФильмов.objects.create(pk=2 ** 33, зал=self.зал, название_фильма='Фильм',
+                                             время_начала=начало, время_окончания=начало + timedelta(hours=2))
+        место = МестаВЗале.objects.create(зал=self.зал, номер_места=70000)
+        билет = КупленныеБилеты.objects.create(pk=2 ** 40, клиент=self.клиент, сеанс=сеанс, место=место)
+        token = make_ticket_token(билет)
+        self.assertEqual(len(token), 56)
+        decoded = decode_token(token)
+        self.assertEqual((decoded.ticket_id, decoded.session_id, decoded.seat_number), (2 ** 40, 2 ** 33, 70000))
+        # Билет с такими ID рисуется, а обычный токен остается коротким
+        self.assertTrue(render_tickets_pdf([билет]).startswith(b'%PDF'))
+        self.assertEqual(len(make_ticket_token(self.билет)), 40)
+
+    def test_tampered_and_foreign_tokens_are_rejected(self):
+        token = make_ticket_token(self.билет)
+        tampered = ('B' if token[5] == 'A' else 'A').join((token[:5], token[6:]))
+        with self.assertRaises(НеверныйТокен):
+            decode_token(tampered)
+        with self.assertRaises(НеверныйТокен):
+            decode_token('TICKET-1')
+        with override_settings(TICKET_QR_SECRET='другой ключ'):
+            with self.assertRaises(НеверныйТокен):
+                decode_token(token)
+
+    def test_expired_token(self):
+        token = make_ticket_token(self.билет)
+        with self.assertRaises(ТокенИстек):
+            decode_token(token, now=self.сеанс.время_окончания + timedelta(days=1))
+
+    def test_qr_is_much_smaller_than_text_block(self):
+        old_text = (f"Билет №: {self.билет.pk}\nФильм: {self.сеанс.название_фильма}\n"
+                    f"Сеанс: {self.сеанс.время_начала:%d.%m.%Y %H:%M}\nМесто: №5\n"
+                    f"Клиент: {self.клиент.get_full_name()}")
+        token_side = len(qr_matrix(make_ticket_token(self.билет)))
+        self.assertLessEqual(token_side, 33)  # версия 2 с рамкой
+        # Модулей (площадь кода) меньше по крайней мере вдвое
+        self.assertGreater(len(qr_matrix(old_text)) ** 2, 2 * token_side ** 2)
+
+    def test_verify_api_needs_no_database(self):
+        url = reverse('cinema_tickets:verify_ticket_token')
+        with self.assertNumQueries(0):
+            response = self.client.post(url, data=json.dumps({'code': make_ticket_token(self.билет)}),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['ticket_id'], self.билет.pk)
+        response = self.client.post(url, data=json.dumps({'code': 'A' * 40}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['valid'])
+
+    def test_checkin_accepts_token(self):
+        token = make_ticket_token(self.билет)
+        url = reverse('cinema_tickets:checkin')
+        начало = self.сеанс.время_начала + timedelta(hours=3)
+        другой = СеансыФильмов.objects.create(зал=self.зал, название_фильма='Другой фильм', время_начала=начало,
+                                              время_окончания=начало + timedelta(minutes=90))
+        response = self.client.post(url, data=json.dumps({'session_id': другой.pk, 'code': token}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(url, data=json.dumps({'session_id': self.сеанс.pk, 'code': token}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['ticket_id'], self.билет.pk)
+
+
+class PdfStorageTests(CinemaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        начало = timezone.now() - timedelta(days=3)
+        cls.прошедший = СеансыФильмов.objects.create(зал=cls.зал, название_фильма='Прошедший фильм',
+                                                     время_начала=начало, время_окончания=начало + timedelta(hours=2))
+        cls.билеты = [КупленныеБилеты.objects.create(клиент=cls.клиент, сеанс=cls.прошедший,
+                                                     место=МестаВЗале.objects.get(номер_места=номер))
+                      for номер in (1, 2)]
+
+    def pack(self):
+        call_command('migrate_pdf_storage', pack=True, closed_hours=0, sessions=[self.прошедший.pk],
+                     stdout=io.StringIO())
+
+    def test_new_pdfs_are_sharded_by_id(self):
+        билет = self.билеты[0]
+        generate_ticket_pdf(билет)
+        self.assertTrue(билет.pdf_файл.name.startswith(f'tickets/000/000/ticket_{билет.pk}'))
+
+    def test_shard_command_moves_flat_files(self):
+        билет = self.билеты[0]
+        flat = pdf_storage.save(f'tickets/ticket_{билет.pk}.pdf', io.BytesIO(b'%PDF-flat'))
+        КупленныеБилеты.objects.filter(pk=билет.pk).update(pdf_файл=flat)
+        call_command('migrate_pdf_storage', shard=True, stdout=io.StringIO())
+        билет.refresh_from_db()
+        self.assertEqual(билет.pdf_файл.name, f'tickets/000/000/ticket_{билет.pk}.pdf')
+        self.assertFalse(pdf_storage.exists(flat))
+        with билет.pdf_файл.open('rb') as f:
+            self.assertEqual(f.read(), b'%PDF-flat')
+
+    def test_packed_pdf_is_served_and_attached(self):
+        contents = {}
+        for билет in self.билеты:
+            generate_ticket_pdf(билет)
+            with билет.pdf_файл.open('rb') as f:
+                contents[билет.pk] = f.read()
+        loose_path = self.билеты[1].pdf_файл.path
+        url = reverse('cinema_tickets:get_ticket_pdf', args=[self.билеты[1].pk])
+        loose_response = self.client.get(url)
+        self.pack()
+
+        for билет in self.билеты:
+            билет.refresh_from_db()
+            self.assertTrue(is_packed(билет.pdf_файл.name))
+        self.assertFalse(os.path.exists(loose_path))
+
+        билет = self.билеты[1]
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), contents[билет.pk])
+        # Упаковка не меняет валидаторы: клиенты не скачивают тот же PDF заново
+        self.assertEqual(response['ETag'], loose_response['ETag'])
+        self.assertEqual(response['Last-Modified'], loose_response['Last-Modified'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=loose_response['ETag']).status_code, 304)
+        partial_response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(partial_response.status_code, 206)
+        self.assertEqual(b''.join(partial_response.streaming_content), contents[билет.pk][10:20])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with self.settings(TICKET_PDF_SENDFILE='x-accel-redirect'):
+            # Отдельного файла нет - пакет стримит сам Django
+            self.assertTrue(self.client.get(url).streaming)
+
+        email = build_ticket_email(КупленныеБилеты.objects.get(pk=билет.pk), 'ivanov@example.com')
+        self.assertEqual(email.attachments[0][1], contents[билет.pk])
+
+    def test_regenerated_packed_pdf_becomes_a_file_again(self):
+        билет = self.билеты[0]
+        generate_ticket_pdf(билет)
+        self.pack()
+        билет.refresh_from_db()
+        packed_name = билет.pdf_файл.name
+        generate_ticket_pdf(билет)
+        self.assertFalse(is_packed(билет.pdf_файл.name))
+        self.assertFalse(pdf_storage.exists(packed_name))
+        # Следующая упаковка дописывает новый PDF в тот же пакет
+        self.pack()
+        билет.refresh_from_db()
+        self.assertTrue(is_packed(билет.pdf_файл.name))
+        self.assertEqual(pdf_storage.size(билет.pdf_файл.name), len(билет.pdf_файл.read()))
+
+
+class ArchiveTests(CinemaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        начало = timezone.now() - timedelta(days=10)
+        cls.прошедший = СеансыФильмов.objects.create(зал=cls.зал, название_фильма='Старый фильм',
+                                                     время_начала=начало, время_окончания=начало + timedelta(hours=2))
+        cls.старые = [КупленныеБилеты.objects.create(клиент=cls.клиент, сеанс=cls.прошедший,
+                                                     место=МестаВЗале.objects.get(номер_места=номер))
+                      for номер in range(1, 6)]
+        cls.текущий = КупленныеБилеты.objects.create(клиент=cls.клиент, сеанс=cls.сеанс,
+                                                     место=МестаВЗале.objects.get(номер_места=1))
+
+    def archive(self, *args):
+        out = io.StringIO()
+        call_command('archive_tickets', '--older-than', '7', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_moves_finished_sessions_in_batches(self):
+        self.archive()
+        self.assertFalse(КупленныеБилеты.objects.filter(сеанс=self.прошедший).exists())
+        self.assertTrue(КупленныеБилеты.objects.filter(pk=self.текущий.pk).exists())
+        архив = АрхивБилетов.objects.get(pk=self.старые[0].pk)
+        self.assertEqual((архив.клиент_id, архив.место_id), (self.клиент.pk, self.старые[0].место_id))
+        self.assertEqual(архив.дата_покупки, self.старые[0].дата_покупки)
+        self.assertEqual(АрхивБилетов.objects.count(), 5)
+
+    def test_interrupted_run_is_resumed(self):
+        batches = archive_session(self.прошедший.pk, batch_size=2)
+        self.assertEqual(next(batches), 2)
+        batches.close()
+        self.assertIn('в архив 3 билетов', self.archive())
+        self.assertEqual(АрхивБилетов.objects.count(), 5)
+
+    def test_tickets_with_unfinished_jobs_stay(self):
+        ЗаданияОбработки.objects.create(тип=ЗаданияОбработки.ТИП_EMAIL, билет=self.старые[0])
+        self.archive()
+        self.assertTrue(КупленныеБилеты.objects.filter(pk=self.старые[0].pk).exists())
+        self.assertEqual(АрхивБилетов.objects.count(), 4)
+
+    def test_order_tickets_stay_until_order_jobs_finish(self):
+        заказ = Заказы.objects.create(клиент=self.клиент, сеанс=self.прошедший)
+        КупленныеБилеты.objects.filter(pk__in=[t.pk for t in self.старые[:3]]).update(заказ=заказ)
+        # Задание заказа привязано только к первому билету, но нужны ему все билеты заказа
+        задание = ЗаданияОбработки.objects.create(тип=ЗаданияОбработки.ТИП_EMAIL_ЗАКАЗА, билет=self.старые[0],
+                                                   параметры={'order_id': заказ.pk})
+        self.archive()
+        self.assertEqual(set(АрхивБилетов.objects.values_list('pk', flat=True)), {t.pk for t in self.старые[3:]})
+        self.assertEqual(заказ.билеты.count(), 3)
+
+        ЗаданияОбработки.objects.filter(pk=задание.pk).update(статус=ЗаданияОбработки.СТАТУС_ВЫПОЛНЕНО)
+        self.archive()
+        self.assertEqual(АрхивБилетов.objects.count(), 5)
+
+    def test_conflicting_archive_row_keeps_live_ticket(self):
+        билет = self.старые[2]
+        АрхивБилетов.objects.create(id=билет.pk, клиент=self.клиент, сеанс=self.прошедший, место=билет.место,
+                                    дата_покупки=билет.дата_покупки)
+        with self.assertRaisesMessage(CommandError, 'уже есть в архиве'):
+            self.archive()
+        # Порция с конфликтом откатилась целиком: билет не удален, хотя его копии в архиве нет
+        self.assertTrue(КупленныеБилеты.objects.filter(pk=билет.pk).exists())
+        self.assertEqual(list(КупленныеБилеты.objects.filter(сеанс=self.прошедший).order_by('pk')
+                              .values_list('pk', flat=True)),
+                         [t.pk for t in self.старые[2:]])
+
+    def test_dry_run_changes_nothing(self):
+        self.assertIn('Старый фильм', self.archive('--dry-run'))
+        self.assertFalse(АрхивБилетов.objects.exists())
+
+    def test_archived_ticket_pdf_and_status_are_still_served(self):
+        generate_ticket_pdf(self.старые[1])
+        with self.старые[1].pdf_файл.open('rb') as f:
+            content = f.read()
+        self.archive('--pack')
+        архив = АрхивБилетов.objects.get(pk=self.старые[1].pk)
+        self.assertTrue(is_packed(архив.pdf_файл.name))
+
+        response = self.client.get(reverse('cinema_tickets:get_ticket_pdf', args=[архив.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), content)
+        status = self.client.get(reverse('cinema_tickets:get_ticket_status', args=[архив.pk])).json()
+        self.assertTrue(status['archived'])
+        self.assertEqual(self.client.get(reverse('cinema_tickets:get_ticket_pdf', args=[999999])).status_code, 404)
+
+    def test_batch_invalidates_seat_map_once(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(list(archive_session(self.прошедший.pk, batch_size=2)), [2, 2, 1])
+        # По одному сбросу карты на порцию, а не на каждый удаленный билет
+        self.assertEqual(len(callbacks), 3)
+
+    def test_archived_seats_stay_sold(self):
+        cache.clear()
+        self.archive()
+        seats = self.client.get(reverse('cinema_tickets:session_seats', args=[self.прошедший.pk])).json()
+        self.assertEqual(seats['occupied'], [1, 2, 3, 4, 5])
+
+        payload = {'client_id': self.клиент.pk, 'session_id': self.прошедший.pk, 'client_email': 'ivanov@example.com'}
+        for url, extra in ((reverse('cinema_tickets:purchase_ticket'), {'seat_number': 1}),
+                           (reverse('cinema_tickets:create_order'), {'seat_numbers': [1, 2]}),
+                           (reverse('cinema_tickets:create_hold'), {'seat_numbers': [1]})):
+            response = self.client.post(url, data=json.dumps({**payload, **extra}), content_type='application/json')
+            self.assertEqual(response.status_code, 409, url)
+            self.assertIn('уже закончился', response.json()['error'])
+        self.assertFalse(КупленныеБилеты.objects.filter(сеанс=self.прошедший).exists())
+
+    def test_client_tickets_with_archive(self):
+        self.archive()
+        url = reverse('cinema_tickets:client_tickets', args=[self.клиент.pk])
+        self.assertEqual([t['ticket_id'] for t in self.client.get(url).json()['tickets']], [self.текущий.pk])
+
+        seen, params = [], {'archive': '1', 'limit': 2}
+        while True:
+            with self.assertNumQueries(2):
+                data = self.client.get(url, params).json()
+            seen.extend(t['ticket_id'] for t in data['tickets'])
+            if not data['next_cursor']:
+                break
+            params['after'] = data['next_cursor']
+        expected = sorted(self.старые + [self.текущий], key=lambda b: (b.дата_покупки, b.pk), reverse=True)
+        self.assertEqual(seen, [билет.pk for билет in expected])
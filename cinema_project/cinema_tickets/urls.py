@@ -11,6 +11,33 @@ urlpatterns = [
     # URL для "покупки" билета (принимает POST)
     path('purchase/', views.purchase_ticket_view, name='purchase_ticket'),
 
+    # URL для групповой покупки нескольких мест одним заказом (принимает POST)
+    path('api/orders/', views.create_order_view, name='create_order'),
+    path('api/orders/<int:order_id>/', views.get_order_status_api, name='get_order_status'),
+    path('api/orders/<int:order_id>/pdf/', views.get_order_pdf_api, name='get_order_pdf'),
+
+    # URL для временного удержания мест перед покупкой
+    path('api/holds/', views.create_hold_view, name='create_hold'),
+    path('api/holds/<str:token>/', views.release_hold_view, name='release_hold'),
+
+    # URL карты занятости мест на сеанс
+    path('api/sessions/<int:session_id>/seats/', views.session_seats_api, name='session_seats'),
+
+    # URL списка билетов клиента (пагинация по курсору)
+    path('api/clients/<int:client_id>/tickets/', views.client_tickets_api, name='client_tickets'),
+
     # URL для API получения PDF
     path('api/tickets/<int:ticket_id>/pdf/', views.get_ticket_pdf_api, name='get_ticket_pdf'),
+
+    # URL прохода по билету на входе (сканер контролера)
+    path('api/checkin/', views.checkin_view, name='checkin'),
+
+    # URL проверки QR-токена билета (без БД)
+    path('api/tickets/verify/', views.verify_ticket_token_view, name='verify_ticket_token'),
+
+    # URL метрик для Prometheus
+    path('metrics', views.metrics_view, name='metrics'),
+
+    # URL для опроса статуса фоновой обработки билета
+    path('api/tickets/<int:ticket_id>/status/', views.get_ticket_status_api, name='get_ticket_status'),
 ]
\ No newline at end of file
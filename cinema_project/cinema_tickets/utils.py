@@ -1,14 +1,19 @@
 # cinema_tickets/utils.py
 
+import contextlib
+import functools
 import io
 import os
+import threading
+import time
 from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A6  # Импорт размера страницы A6
+from reportlab.lib.pagesizes import A4, A6, landscape  # Размеры страниц: A6 - билет, A4 - лист для пакетной печати
 from reportlab.lib.units import mm
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.utils import ImageReader # Для вставки изображений
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.base import ContentFile
 from django.core.mail import EmailMessage # Для отправки email
 
@@ -17,173 +22,550 @@ import qrcode
 from barcode import get_barcode_class
 from barcode.writer import ImageWriter
 
-def generate_ticket_pdf(ticket):
-    """
-    Генерирует PDF для объекта КупленныеБилеты, включая QR (с информацией о билете)
-    и штрихкод, и сохраняет его в поле pdf_файл.
-    """
-    # --- Регистрация шрифта ---
+from .pdfcompact import draw_bilevel_image, is_compact, КомпактныйTTFont
+from .qrtoken import make_ticket_token
+
+def register_ticket_font():
+    """Регистрирует шрифт с кириллицей (один раз на процесс)."""
     font_path = os.path.join(settings.BASE_DIR, 'static', 'fonts', 'DejaVuSans.ttf')
     try:
         # Проверяем, зарегистрирован ли уже шрифт, чтобы избежать повторной регистрации
         # (хотя reportlab обычно сам с этим справляется)
         if 'DejaVuSans' not in pdfmetrics.getRegisteredFontNames():
-            pdfmetrics.registerFont(TTFont('DejaVuSans', font_path))
+            # Подмножества шрифта в компактном профиле встраиваются без хинтинга (pdfcompact.py)
+            pdfmetrics.registerFont(КомпактныйTTFont('DejaVuSans', font_path))
     except Exception as e:
          print(f"Ошибка регистрации шрифта: {e}. Убедитесь, что файл {font_path} существует.")
          # Можно попробовать использовать стандартный шрифт как запасной вариант
          # if 'DejaVuSans' not in pdfmetrics.getRegisteredFontNames():
          #     pdfmetrics.registerFont(TTFont('DejaVuSans', 'Helvetica'))
 
-    buffer = io.BytesIO()
-    # Используем размер A6, альбомная ориентация
-    page_width, page_height = A6[1], A6[0]
-    c = canvas.Canvas(buffer, pagesize=(page_width, page_height))
-    c.setFont('DejaVuSans', 10) # Устанавливаем основной шрифт и размер
-
-    # --- Данные для QR-кода (ИНФОРМАЦИЯ О БИЛЕТЕ) ---
-    qr_data = f"""Билет №: {ticket.id}
-Фильм: {ticket.сеанс.название_фильма}
-Сеанс: {ticket.сеанс.время_начала.strftime('%d.%m.%Y %H:%M')}
-Место: {ticket.место.номер_места}
-Клиент: {ticket.клиент.get_full_name()}"""
 
-    # --- Данные для ШТРИХКОДА (оставляем ID) ---
-    barcode_id_data = f"TICKET-{ticket.id}"
+# --- Замер стадий генерации PDF и отправки писем ---
+# Наблюдатели вызываются как observer(стадия, секунды). Пока их нет,
+# render_stage почти ничего не стоит; подключаются бенчмарком и метриками.
+_STAGE_OBSERVERS = []
+
+
+def add_stage_observer(observer):
+    _STAGE_OBSERVERS.append(observer)
+
+
+def remove_stage_observer(observer):
+    if observer in _STAGE_OBSERVERS:
+        _STAGE_OBSERVERS.remove(observer)
 
-    # --- Генерация QR-кода ---
+
+@contextlib.contextmanager
+def render_stage(name):
+    """
+    Отмечает стадию: генерация PDF - load, text (шрифт и текст), qr, barcode,
+    serialize (сборка canvas в PDF), store, db; письма - email_build, email_connect, email_send.
+    """
+    if not _STAGE_OBSERVERS:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        for observer in list(_STAGE_OBSERVERS):
+            observer(name, elapsed)
+
+
+# Используем размер A6, альбомная ориентация
+TICKET_PAGE_SIZE = (A6[1], A6[0])
+
+# Имя form XObject со статической частью билета внутри одного PDF
+TICKET_FORM_NAME = 'TicketStatic'
+
+# Подписи полей. Они рисуются один раз в статической части, а значения - справа от них
+TICKET_LABELS = ('Фильм: ', 'Сеанс: ', 'Продолж.: ', 'Место: ', 'Покупатель: ')
+
+
+class ШаблонБилета:
+    """
+    Неизменная часть билета: геометрия, подписи и их ширины.
+    Вычисляется один раз на процесс (см. get_ticket_template), поэтому на каждый
+    билет остается только отрисовка значений и кодов.
+    """
+
+    def __init__(self):
+        register_ticket_font()
+        self.page_width, self.page_height = TICKET_PAGE_SIZE
+        self.margin_left = 8 * mm
+        self.margin_right = 8 * mm
+        self.margin_top = 8 * mm
+        self.margin_bottom = 8 * mm
+        self.line_height = 5 * mm
+
+        self.title_y = self.page_height - self.margin_top - self.line_height
+        # Строки основной информации (левая часть): подпись и x, с которого начинается значение
+        self.info_y = self.title_y - self.line_height * 1.5
+        self.rows = []
+        for i, label in enumerate(TICKET_LABELS):
+            value_x = self.margin_left + pdfmetrics.stringWidth(label, 'DejaVuSans', 10)
+            self.rows.append((label, value_x, self.info_y - i * self.line_height))
+        self.email_y = self.info_y - len(TICKET_LABELS) * self.line_height
+
+        # --- Размещение кодов (правая часть) ---
+        self.qr_size = 25 * mm # Размер QR-кода
+        self.qr_x = self.page_width - self.margin_right - self.qr_size
+        # Размещаем QR справа, примерно на уровне начала информационного блока
+        self.qr_y = self.info_y - self.qr_size + self.line_height
+        self.barcode_height = 15 * mm
+        self.barcode_width = 50 * mm # Ширина штрихкода
+        self.barcode_x = self.page_width - self.margin_right - self.barcode_width
+        self.barcode_y = self.qr_y - self.barcode_height - 5 * mm # Ниже QR-кода с отступом
+
+        self.footer_y = self.margin_bottom / 2
+
+    def draw_static(self, c):
+        """Статическая часть: заголовок, подписи полей, нижняя надпись."""
+        c.setFont('DejaVuSans', 14)
+        c.drawCentredString(self.page_width / 2, self.title_y, "Билет в кино")
+        c.setFont('DejaVuSans', 10)
+        for label, _, y in self.rows:
+            c.drawString(self.margin_left, y, label)
+        c.setFont('DejaVuSans', 7) # Мелкий шрифт для служебной информации
+        c.drawString(self.margin_left, self.footer_y, "Приятного просмотра!")
+
+    def use_static_form(self, c):
+        """
+        Рисует статическую часть как form XObject: в одном PDF она описывается
+        один раз и на каждой следующей странице только переиспользуется.
+        """
+        defined = getattr(c, '_ticket_forms', None)
+        if defined is None:
+            defined = c._ticket_forms = set()
+        if TICKET_FORM_NAME not in defined:
+            c.beginForm(TICKET_FORM_NAME)
+            self.draw_static(c)
+            c.endForm()
+            defined.add(TICKET_FORM_NAME)
+        c.doForm(TICKET_FORM_NAME)
+
+
+@functools.lru_cache(maxsize=None)
+def get_ticket_template():
+    return ШаблонБилета()
+
+
+def with_related(ticket):
+    """
+    Возвращает билет с загруженными сеансом, местом и клиентом.
+    Если связи уже загружены (select_related), запросов к БД нет; иначе - один запрос.
+    """
+    fields = [ticket._meta.get_field(name) for name in ('сеанс', 'место', 'клиент')]
+    if ticket.pk is None or all(field.is_cached(ticket) for field in fields):
+        return ticket
+    return type(ticket).objects.select_related('сеанс', 'место', 'клиент').get(pk=ticket.pk)
+
+
+def _make_qr_reader(ticket, qr_data):
+    """QR-код как изображение для ReportLab (или None при ошибке)."""
     qr_buffer = io.BytesIO()
     try:
         qr_img = qrcode.make(qr_data, error_correction=qrcode.constants.ERROR_CORRECT_L)
         qr_img.save(qr_buffer, format='PNG')
         qr_buffer.seek(0)
-        qr_reader = ImageReader(qr_buffer)
+        return ImageReader(qr_buffer)
     except Exception as e:
         print(f"Ошибка генерации QR-кода для билета {ticket.id}: {e}")
-        qr_reader = None # Не удалось создать QR
+        return None # Не удалось создать QR
+
 
-    # --- Генерация штрихкода ---
+def _make_barcode_reader(ticket, barcode_id_data):
+    """Штрихкод Code128 как изображение для ReportLab (или None при ошибке)."""
     barcode_buffer = io.BytesIO()
-    barcode_reader = None # По умолчанию штрихкода нет
     try:
         Code128 = get_barcode_class('code128')
         # Убедимся, что данные только ASCII для Code128
         barcode_ascii_data = barcode_id_data.encode('ascii', errors='ignore').decode('ascii')
-        if barcode_ascii_data:
-            code128_barcode = Code128(barcode_ascii_data, writer=ImageWriter())
-            code128_barcode.write(barcode_buffer, options={
-                'module_height': 8.0, # Высота штрихов
-                'write_text': False,  # Не писать текст под штрихкодом
-                'text_distance': 1.0, # Расстояние текста (не используется при write_text=False)
-                'quiet_zone': 2.0     # Отступы по бокам
-            })
-            barcode_buffer.seek(0)
-            barcode_reader = ImageReader(barcode_buffer)
+        if not barcode_ascii_data:
+            return None
+        code128_barcode = Code128(barcode_ascii_data, writer=ImageWriter())
+        code128_barcode.write(barcode_buffer, options={
+            'module_height': 8.0, # Высота штрихов
+            'write_text': False,  # Не писать текст под штрихкодом
+            'text_distance': 1.0, # Расстояние текста (не используется при write_text=False)
+            'quiet_zone': 2.0     # Отступы по бокам
+        })
+        barcode_buffer.seek(0)
+        return ImageReader(barcode_buffer)
     except Exception as e:
         print(f"Ошибка генерации штрихкода для билета {ticket.id}: {e}")
-        barcode_reader = None # Не удалось создать штрихкод
-
-    # --- Рисуем содержимое билета ---
-    margin_left = 8 * mm
-    margin_right = 8 * mm
-    margin_top = 8 * mm
-    margin_bottom = 8 * mm
-    line_height = 5 * mm
-    current_y = page_height - margin_top - line_height
-
-    # Заголовок
-    c.setFont('DejaVuSans', 14)
-    c.drawCentredString(page_width / 2, current_y, "Билет в кино")
-    current_y -= line_height * 1.5
-    c.setFont('DejaVuSans', 10) # Возвращаем основной размер шрифта
-
-    # Основная информация (левая часть)
-    info_block_y_start = current_y
-    c.drawString(margin_left, current_y, f"Фильм: {ticket.сеанс.название_фильма}")
-    current_y -= line_height
-    c.drawString(margin_left, current_y, f"Сеанс: {ticket.сеанс.время_начала.strftime('%d.%m.%Y %H:%M')}")
-    current_y -= line_height
-    c.drawString(margin_left, current_y, f"Продолж.: {ticket.сеанс.продолжительность}")
-    current_y -= line_height
-    c.drawString(margin_left, current_y, f"Место: {ticket.место.номер_места}")
-    current_y -= line_height
-    c.drawString(margin_left, current_y, f"Покупатель: {ticket.клиент.get_full_name()}")
-    current_y -= line_height
-    if ticket.email_получателя:
-         c.drawString(margin_left, current_y, f"Email: {ticket.email_получателя}")
-
-    # --- Размещение кодов (правая часть) ---
-    qr_size = 25 * mm # Размер QR-кода
-    qr_x = page_width - margin_right - qr_size
-    # Размещаем QR справа, примерно на уровне начала информационного блока
-    qr_y = info_block_y_start - qr_size + line_height
-    if qr_reader:
+        return None # Не удалось создать штрихкод
+
+
+# Ширина "тихой зоны" штрихкода в модулях по бокам (как quiet_zone=2 мм при модуле 0.2 мм у ImageWriter)
+BARCODE_QUIET_MODULES = 10
+
+
+def codes_render_mode():
+    """
+    Режим отрисовки кодов: 'vector' - модули QR и штрихи Code128 рисуются
+    прямоугольниками прямо на canvas, без PIL и PNG; 'image' - прежний способ через картинки.
+    """
+    return getattr(settings, 'TICKET_CODES_RENDER', 'vector')
+
+
+def _fill_runs(c, runs):
+    """Заливает набор прямоугольников (x, y, w, h) одним путем."""
+    path = c.beginPath()
+    for x, y, w, h in runs:
+        path.rect(x, y, w, h)
+    c.drawPath(path, stroke=0, fill=1)
+
+
+def qr_matrix(qr_data):
+    """Матрица модулей QR-кода (включая рамку), True - темный модуль."""
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L)
+    qr.add_data(qr_data)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def draw_qr_vector(c, qr_data, x, y, size):
+    """Рисует QR-код векторно: соседние темные модули строки сливаются в один прямоугольник."""
+    matrix = qr_matrix(qr_data)
+    module = size / len(matrix)
+    runs = []
+    for row_index, row in enumerate(matrix):
+        row_y = y + size - (row_index + 1) * module
+        start = None
+        for col_index, dark in enumerate(row + [False]):
+            if dark and start is None:
+                start = col_index
+            elif not dark and start is not None:
+                runs.append((x + start * module, row_y, (col_index - start) * module, module))
+                start = None
+    _fill_runs(c, runs)
+
+
+def draw_barcode_vector(c, barcode_data, x, y, width, height):
+    """Рисует Code128 векторно: каждый штрих - прямоугольник на всю высоту."""
+    Code128 = get_barcode_class('code128')
+    modules = Code128(barcode_data).build()[0]
+    module = width / (len(modules) + 2 * BARCODE_QUIET_MODULES)
+    runs = []
+    start = None
+    for index, bit in enumerate(modules + '0'):
+        if bit == '1' and start is None:
+            start = index
+        elif bit != '1' and start is not None:
+            runs.append((x + (BARCODE_QUIET_MODULES + start) * module, y, (index - start) * module, height))
+            start = None
+    _fill_runs(c, runs)
+
+
+def _draw_codes_vector(c, t, ticket, qr_data, barcode_id_data):
+    with render_stage('qr'):
         try:
-            c.drawImage(qr_reader, qr_x, qr_y, width=qr_size, height=qr_size, mask='auto')
+            draw_qr_vector(c, qr_data, t.qr_x, t.qr_y, t.qr_size)
         except Exception as e:
-            print(f"Ошибка отрисовки QR кода для билета {ticket.id}: {e}")
-        finally:
-             qr_buffer.close() # Закрываем буфер QR в любом случае
+            print(f"Ошибка генерации QR-кода для билета {ticket.id}: {e}")
+    with render_stage('barcode'):
+        try:
+            barcode_ascii_data = barcode_id_data.encode('ascii', errors='ignore').decode('ascii')
+            if barcode_ascii_data:
+                draw_barcode_vector(c, barcode_ascii_data, t.barcode_x, t.barcode_y, t.barcode_width, t.barcode_height)
+        except Exception as e:
+            print(f"Ошибка генерации штрихкода для билета {ticket.id}: {e}")
+
+
+def _draw_codes_image(c, t, ticket, qr_data, barcode_id_data):
+    with render_stage('qr'):
+        qr_reader = _make_qr_reader(ticket, qr_data)
+        if qr_reader:
+            try:
+                c.drawImage(qr_reader, t.qr_x, t.qr_y, width=t.qr_size, height=t.qr_size, mask='auto')
+            except Exception as e:
+                print(f"Ошибка отрисовки QR кода для билета {ticket.id}: {e}")
 
-    barcode_height = 15 * mm
-    barcode_width = 50 * mm # Ширина штрихкода
-    barcode_x = page_width - margin_right - barcode_width
-    barcode_y = qr_y - barcode_height - 5 * mm # Ниже QR-кода с отступом
-    if barcode_reader:
+    with render_stage('barcode'):
+        barcode_reader = _make_barcode_reader(ticket, barcode_id_data)
+        if barcode_reader:
+            try:
+                c.drawImage(barcode_reader, t.barcode_x, t.barcode_y, width=t.barcode_width, height=t.barcode_height, mask='auto')
+            except Exception as e:
+                 print(f"Ошибка отрисовки штрихкода для билета {ticket.id}: {e}")
+
+
+def _draw_codes_bilevel(c, t, ticket, qr_data, barcode_id_data):
+    """Режим 'image' в компактном профиле: 1-битные картинки, пиксель на модуль."""
+    with render_stage('qr'):
         try:
-            c.drawImage(barcode_reader, barcode_x, barcode_y, width=barcode_width, height=barcode_height, mask='auto')
+            draw_bilevel_image(c, qr_matrix(qr_data), t.qr_x, t.qr_y, t.qr_size, t.qr_size)
         except Exception as e:
-             print(f"Ошибка отрисовки штрихкода для билета {ticket.id}: {e}")
-        finally:
-            barcode_buffer.close() # Закрываем буфер штрихкода
+            print(f"Ошибка генерации QR-кода для билета {ticket.id}: {e}")
+    with render_stage('barcode'):
+        try:
+            barcode_ascii_data = barcode_id_data.encode('ascii', errors='ignore').decode('ascii')
+            if barcode_ascii_data:
+                modules = get_barcode_class('code128')(barcode_ascii_data).build()[0]
+                quiet = [False] * BARCODE_QUIET_MODULES
+                row = quiet + [bit == '1' for bit in modules] + quiet
+                draw_bilevel_image(c, [row], t.barcode_x, t.barcode_y, t.barcode_width, t.barcode_height)
+        except Exception as e:
+            print(f"Ошибка генерации штрихкода для билета {ticket.id}: {e}")
 
-    # --- Нижняя информация ---
-    c.setFont('DejaVuSans', 7) # Мелкий шрифт для служебной информации
-    c.drawRightString(page_width - margin_right, margin_bottom / 2, f"Билет №{ticket.id} | Покупка: {ticket.дата_покупки.strftime('%d.%m.%Y %H:%M')}")
-    c.drawString(margin_left, margin_bottom / 2, "Приятного просмотра!")
 
-    # --- Завершение PDF ---
-    c.showPage()
-    c.save()
+def draw_ticket_page(c, ticket):
+    """
+    Рисует одну страницу билета (текст, QR с подписанным токеном билета и штрихкод)
+    на переданном canvas. Статическая часть берется из шаблона, здесь рисуются
+    только значения полей и коды. Страница не завершается - это делает вызывающий код.
+    """
+    t = get_ticket_template()
+    сеанс, место, клиент = ticket.сеанс, ticket.место, ticket.клиент
+    время_сеанса = сеанс.время_начала.strftime('%d.%m.%Y %H:%M')
+    имя_клиента = клиент.get_full_name()
+
+    # --- Данные для QR-кода: подписанный токен (см. qrtoken.py), сведения о билете - текстом на странице ---
+    qr_data = make_ticket_token(ticket)
+
+    # --- Данные для ШТРИХКОДА (оставляем ID) ---
+    barcode_id_data = f"TICKET-{ticket.id}"
 
-    # --- Сохранение PDF в модель ---
-    buffer.seek(0)
+    with render_stage('text'):
+        t.use_static_form(c)
+
+        # Основная информация (левая часть) - значения справа от подписей
+        c.setFont('DejaVuSans', 10)
+        values = (сеанс.название_фильма, время_сеанса, сеанс.продолжительность, место.обозначение, имя_клиента)
+        for (_, value_x, y), value in zip(t.rows, values):
+            c.drawString(value_x, y, str(value))
+        if ticket.email_получателя:
+             c.drawString(t.margin_left, t.email_y, f"Email: {ticket.email_получателя}")
+
+        # --- Нижняя информация ---
+        c.setFont('DejaVuSans', 7) # Мелкий шрифт для служебной информации
+        c.drawRightString(t.page_width - t.margin_right, t.footer_y, f"Билет №{ticket.id} | Покупка: {ticket.дата_покупки.strftime('%d.%m.%Y %H:%M')}")
+
+    # --- Коды (правая часть) ---
+    if codes_render_mode() == 'image' and is_compact():
+        _draw_codes_bilevel(c, t, ticket, qr_data, barcode_id_data)
+    elif codes_render_mode() == 'image':
+        _draw_codes_image(c, t, ticket, qr_data, barcode_id_data)
+    else:
+        _draw_codes_vector(c, t, ticket, qr_data, barcode_id_data)
+
+
+def new_canvas(output, pagesize):
+    """Canvas для PDF билетов; в компактном профиле сжатие потоков включено явно."""
+    return canvas.Canvas(output, pagesize=pagesize, pageCompression=1 if is_compact() else None)
+
+
+def render_tickets_pdf(tickets):
+    """Рисует билеты (по одному на страницу) в один PDF и возвращает его байты."""
+    get_ticket_template()
+    buffer = io.BytesIO()
+    c = new_canvas(buffer, TICKET_PAGE_SIZE)
+    for ticket in tickets:
+        draw_ticket_page(c, ticket)
+        c.showPage()
+    with render_stage('serialize'):
+        c.save()
     pdf_data = buffer.getvalue()
     buffer.close()
+    return pdf_data
+
+
+# Раскладки для пакетной печати: билетов на лист -> (размер листа, колонок, рядов).
+# A6 - это четверть A4, поэтому 2 и 4 билета помещаются на A4 без масштабирования
+SHEET_LAYOUTS = {
+    1: (TICKET_PAGE_SIZE, 1, 1),
+    2: (A4, 1, 2),
+    4: (landscape(A4), 2, 2),
+    8: (A4, 2, 4),
+}
+
+
+def render_ticket_sheets(tickets, output, per_page=1, cut_marks=True):
+    """
+    Печатает любое количество билетов в один PDF (output - путь или файловый объект),
+    по per_page билетов на лист. Все страницы идут в один canvas: шрифт и
+    статическая часть билета (form XObject) описываются в документе один раз.
+    Возвращает число напечатанных билетов.
+    """
+    if per_page not in SHEET_LAYOUTS:
+        raise ValueError(f"Поддерживается {', '.join(map(str, SHEET_LAYOUTS))} билетов на лист.")
+    t = get_ticket_template()
+    (sheet_width, sheet_height), cols, rows = SHEET_LAYOUTS[per_page]
+    cell_width, cell_height = sheet_width / cols, sheet_height / rows
+    scale = min(1.0, cell_width / t.page_width, cell_height / t.page_height)
+    offset_x = (cell_width - t.page_width * scale) / 2
+    offset_y = (cell_height - t.page_height * scale) / 2
+
+    c = new_canvas(output, (sheet_width, sheet_height))
+    count = 0
+    for count, ticket in enumerate(tickets, start=1):
+        slot = (count - 1) % per_page
+        col, row = slot % cols, slot // cols
+        c.saveState()
+        # Ряды заполняются сверху вниз
+        c.translate(col * cell_width + offset_x, sheet_height - (row + 1) * cell_height + offset_y)
+        c.scale(scale, scale)
+        draw_ticket_page(c, ticket)
+        c.restoreState()
+        if per_page > 1 and cut_marks:
+            c.saveState()
+            c.setStrokeGray(0.7)
+            c.setLineWidth(0.3)
+            c.setDash(2, 2)
+            c.rect(col * cell_width + offset_x, sheet_height - (row + 1) * cell_height + offset_y,
+                   t.page_width * scale, t.page_height * scale, stroke=1, fill=0)
+            c.restoreState()
+        if slot == per_page - 1:
+            c.showPage()
+    if count % per_page:
+        c.showPage()
+    c.save()
+    return count
+
+
+def store_pdf(obj, file_name, pdf_data):
+    """
+    Записывает PDF в поле pdf_файл объекта (без сохранения в БД).
+    Возвращает имя прежнего файла (None, если его не было): при перегенерации
+    его удаляют через discard_pdf после того, как в БД записано новое имя.
+    Пока строка ссылается на прежний файл, он существует - сбой между шагами
+    оставляет лишний файл, а не ссылку на удаленный.
+    """
+    old_name = obj.pdf_файл.name or None
+    obj.pdf_файл.save(file_name, ContentFile(pdf_data), save=False)
+    # Байты остаются на объекте: письмо, собранное сразу после генерации,
+    # прикрепит их без повторного чтения файла
+    obj._pdf_data = pdf_data
+    return old_name if old_name != obj.pdf_файл.name else None
+
+
+def discard_pdf(obj, old_name):
+    """
+    Удаляет прежний PDF объекта (имя из store_pdf), чтобы хранилище не копило
+    копии вида ticket_1_AbCdEf.pdf. Вызывается после сохранения нового имени в БД.
+    """
+    if old_name:
+        obj.pdf_файл.storage.delete(old_name)
 
-    file_name = f'ticket_{ticket.id}.pdf'
-    # Сохраняем PDF в поле модели. save=True обновит запись в БД.
-    # Это важно, чтобы изменения (путь к файлу) сохранились
-    ticket.pdf_файл.save(file_name, ContentFile(pdf_data), save=True)
+
+def generate_ticket_pdf(ticket):
+    """
+    Генерирует PDF для объекта КупленныеБилеты, включая QR (с информацией о билете)
+    и штрихкод, и сохраняет его в поле pdf_файл.
+    Лучше передавать билет с уже загруженными сеансом, местом и клиентом
+    (select_related), иначе они будут дозагружены одним запросом.
+    """
+    with render_stage('load'):
+        loaded = with_related(ticket)
+    pdf_data = render_tickets_pdf([loaded])
+
+    # Сохраняем PDF в поле модели и обновляем в БД только путь к файлу
+    with render_stage('store'):
+        old_name = store_pdf(ticket, f'ticket_{ticket.id}.pdf', pdf_data)
+    with render_stage('db'):
+        ticket.save(update_fields=['pdf_файл'])
+    discard_pdf(ticket, old_name)
 
     # Возвращаем путь к сохраненному файлу (может быть полезно)
     return ticket.pdf_файл.path
 
 
-# --- Функция для отправки email ---
-def send_ticket_email(ticket, recipient_email):
+def generate_order_pdf(order):
     """
-    Отправляет email с PDF билетом в качестве вложения.
+    Генерирует один многостраничный PDF со всеми билетами заказа
+    и сохраняет его в поле pdf_файл заказа.
     """
-    if not recipient_email:
-        print(f"Email для билета {ticket.id} не указан. Отправка невозможна.")
-        return False
+    tickets = list(order.билеты.select_related('клиент', 'сеанс', 'место').order_by('место__номер_места'))
+    pdf_data = render_tickets_pdf(tickets)
+    old_name = store_pdf(order, f'order_{order.id}.pdf', pdf_data)
+    order.save(update_fields=['pdf_файл'])
+    discard_pdf(order, old_name)
+    return order.pdf_файл.path
 
-    # Убедимся, что у билета есть связанный PDF файл и путь к нему
-    if not ticket.pdf_файл or not hasattr(ticket.pdf_файл, 'path') or not ticket.pdf_файл.path:
-        print(f"PDF файл для билета {ticket.id} отсутствует или путь не определен. Отправка email невозможна.")
-        # Попробуем сгенерировать PDF заново, если его нет (на всякий случай)
+
+def pdf_lazy_mode():
+    """
+    Ленивый режим: PDF не генерируется при покупке, а создается при первом
+    обращении (скачивание или отправка email) и дальше отдается из хранилища.
+    """
+    return getattr(settings, 'TICKET_PDF_LAZY', False)
+
+
+# Полосатые блокировки для объединения одновременных запросов на генерацию
+# одного и того же PDF внутри процесса (число блокировок фиксировано)
+_RENDER_LOCKS = [threading.Lock() for _ in range(64)]
+# Блокировка в кэше объединяет запросы из разных процессов
+RENDER_LOCK_TIMEOUT = 60
+RENDER_LOCK_POLL = 0.05
+
+
+def _ensure_pdf(obj, generate, lock_name):
+    """
+    Генерирует PDF объекта ровно один раз, даже если его одновременно запросили
+    несколько потоков или процессов: первый генерирует, остальные ждут и берут
+    готовый файл из хранилища.
+    """
+    if obj.pdf_файл:
+        return obj.pdf_файл
+    lock_key = f'render-lock:{lock_name}'
+    with _RENDER_LOCKS[hash(lock_key) % len(_RENDER_LOCKS)]:
+        obj.refresh_from_db(fields=['pdf_файл'])
+        if obj.pdf_файл:
+            return obj.pdf_файл
+        deadline = time.monotonic() + RENDER_LOCK_TIMEOUT
+        while not cache.add(lock_key, 1, RENDER_LOCK_TIMEOUT):
+            # Этот PDF прямо сейчас генерирует другой процесс - ждем результата
+            time.sleep(RENDER_LOCK_POLL)
+            obj.refresh_from_db(fields=['pdf_файл'])
+            if obj.pdf_файл:
+                return obj.pdf_файл
+            if time.monotonic() > deadline:
+                print(f"Не дождались генерации PDF ({lock_name}), генерируем сами.")
+                break
         try:
-            print(f"Попытка повторной генерации PDF для билета {ticket.id} перед отправкой email.")
-            generate_ticket_pdf(ticket)
-            if not ticket.pdf_файл or not ticket.pdf_файл.path:
-                 print(f"Повторная генерация PDF не удалась. Отправка email отменена.")
-                 return False
-        except Exception as e:
-            print(f"Ошибка при повторной генерации PDF перед отправкой email: {e}")
-            return False
+            obj.refresh_from_db(fields=['pdf_файл'])
+            if not obj.pdf_файл:
+                generate(obj)
+        finally:
+            cache.delete(lock_key)
+    return obj.pdf_файл
+
+
+def ensure_ticket_pdf(ticket):
+    """Возвращает PDF билета, при необходимости генерируя его (один раз)."""
+    had_pdf = bool(ticket.pdf_файл)
+    pdf_файл = _ensure_pdf(ticket, generate_ticket_pdf, f'ticket:{ticket.pk}')
+    if not had_pdf:
+        type(ticket).objects.filter(pk=ticket.pk, статус=type(ticket).СТАТУС_ОЖИДАЕТ).update(
+            статус=type(ticket).СТАТУС_PDF_ГОТОВ
+        )
+    return pdf_файл
+
+
+def ensure_order_pdf(order):
+    """Возвращает общий PDF заказа, при необходимости генерируя его (один раз)."""
+    return _ensure_pdf(order, generate_order_pdf, f'order:{order.pk}')
+
+
+# --- Письма с билетами ---
+def _pdf_bytes(obj):
+    """
+    Содержимое PDF для вложения. Если PDF только что сгенерирован в этом
+    процессе, байты берутся из памяти, иначе читаются из хранилища один раз
+    (без attach_file, которому нужен путь на локальном диске).
+    """
+    pdf_data = getattr(obj, '_pdf_data', None)
+    if pdf_data is not None:
+        return pdf_data
+    with obj.pdf_файл.open('rb') as f:
+        return f.read()
 
 
+def build_ticket_email(ticket, recipient_email, pdf_data=None):
+    """Собирает (но не отправляет) письмо с PDF билета во вложении."""
     subject = f"Ваш билет в кино: {ticket.сеанс.название_фильма} (Билет №{ticket.id})"
     body = f"""
 Здравствуйте, {ticket.клиент.get_full_name()}!
@@ -192,7 +574,7 @@ def send_ticket_email(ticket, recipient_email):
 
 Детали сеанса:
 Дата и время: {ticket.сеанс.время_начала.strftime('%d.%m.%Y %H:%M')}
-Место: {ticket.место.номер_места}
+Место: {ticket.место.обозначение}
 
 Ваш электронный билет прикреплен к этому письму в формате PDF.
 Пожалуйста, сохраните его или распечатайте. Его можно показать на входе в зал.
@@ -204,24 +586,122 @@ def send_ticket_email(ticket, recipient_email):
     """
     # Используем email из настроек Django
     # Убедитесь, что DEFAULT_FROM_EMAIL задан в settings.py
-    from_email = settings.DEFAULT_FROM_EMAIL
+    email = EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [recipient_email])
+    email.attach(f'ticket_{ticket.id}.pdf', pdf_data if pdf_data is not None else _pdf_bytes(ticket),
+                 'application/pdf')
+    return email
+
+
+def build_order_email(order, recipient_email, pdf_data=None):
+    """Собирает письмо с общим PDF на все билеты заказа."""
+    seats = ', '.join(str(номер) for номер in order.билеты.order_by('место__номер_места')
+                      .values_list('место__номер_места', flat=True))
+    subject = f"Ваши билеты в кино: {order.сеанс.название_фильма} (Заказ №{order.id})"
+    body = f"""
+Здравствуйте, {order.клиент.get_full_name()}!
+
+Вы успешно приобрели билеты на фильм "{order.сеанс.название_фильма}".
+
+Детали сеанса:
+Дата и время: {order.сеанс.время_начала.strftime('%d.%m.%Y %H:%M')}
+Места: {seats}
+
+Все билеты заказа прикреплены к этому письму одним PDF файлом (по билету на страницу).
+Пожалуйста, сохраните его или распечатайте. Его можно показать на входе в зал.
+
+Приятного просмотра!
+
+С уважением,
+Ваш Кинотеатр
+    """
+    email = EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [recipient_email])
+    email.attach(f'order_{order.id}.pdf', pdf_data if pdf_data is not None else _pdf_bytes(order),
+                 'application/pdf')
+    return email
+
+
+def build_session_change_email(session, recipient_email, message=''):
+    """Письмо держателю билета об изменении сеанса (без вложений)."""
+    subject = f"Изменение сеанса: {session.название_фильма}"
+    body = f"""
+Здравствуйте!
+
+В сеансе фильма "{session.название_фильма}", на который у вас есть билет, произошли изменения.
+
+Актуальное время сеанса:
+Начало: {session.время_начала.strftime('%d.%m.%Y %H:%M')}
+Окончание: {session.время_окончания.strftime('%d.%m.%Y %H:%M')}
+{message}
+Ваш билет остается действительным, обменивать его не нужно.
+
+С уважением,
+Ваш Кинотеатр
+    """
+    return EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [recipient_email])
+
+
+# --- Функция для отправки email ---
+def send_ticket_email(ticket, recipient_email):
+    """
+    Отправляет email с PDF билетом в качестве вложения.
+    Для отправки многих писем через одно соединение см. outbox.ПочтовыйЯщик.
+    """
+    if not recipient_email:
+        print(f"Email для билета {ticket.id} не указан. Отправка невозможна.")
+        return False
+
+    # Убедимся, что у билета есть связанный PDF файл
+    if not ticket.pdf_файл:
+        print(f"PDF файл для билета {ticket.id} отсутствует. Отправка email невозможна.")
+        # Попробуем сгенерировать PDF заново, если его нет (на всякий случай)
+        try:
+            print(f"Попытка повторной генерации PDF для билета {ticket.id} перед отправкой email.")
+            ensure_ticket_pdf(ticket)
+            if not ticket.pdf_файл:
+                 print(f"Повторная генерация PDF не удалась. Отправка email отменена.")
+                 return False
+        except Exception as e:
+            print(f"Ошибка при повторной генерации PDF перед отправкой email: {e}")
+            return False
 
     try:
-        email = EmailMessage(
-            subject,
-            body,
-            from_email,
-            [recipient_email] # Адрес получателя должен быть списком
-        )
-        # Прикрепляем PDF файл, используя его путь
-        email.attach_file(ticket.pdf_файл.path)
-        email.send(fail_silently=False) # fail_silently=False вызовет исключение при ошибке отправки
+        with render_stage('email_build'):
+            email = build_ticket_email(ticket, recipient_email)
+        with render_stage('email_send'):
+            email.send(fail_silently=False) # fail_silently=False вызовет исключение при ошибке отправки
         print(f"Email с билетом {ticket.id} успешно отправлен на {recipient_email}")
         return True
     except FileNotFoundError:
-        print(f"Ошибка при отправке email: файл PDF для билета {ticket.id} не найден по пути {ticket.pdf_файл.path}")
+        print(f"Ошибка при отправке email: файл PDF для билета {ticket.id} не найден ({ticket.pdf_файл.name})")
         return False
     except Exception as e:
         print(f"Ошибка при отправке email для билета {ticket.id} на {recipient_email}: {e}")
         # Здесь можно добавить более детальное логирование ошибки
-        return False
\ No newline at end of file
+        return False
+
+# --- Функция для отправки email по заказу из нескольких билетов ---
+def send_order_email(order, recipient_email):
+    """
+    Отправляет одно письмо с общим PDF на все билеты заказа.
+    """
+    if not recipient_email:
+        print(f"Email для заказа {order.id} не указан. Отправка невозможна.")
+        return False
+
+    if not order.pdf_файл:
+        print(f"PDF файл для заказа {order.id} отсутствует. Отправка email невозможна.")
+        return False
+
+    try:
+        with render_stage('email_build'):
+            email = build_order_email(order, recipient_email)
+        with render_stage('email_send'):
+            email.send(fail_silently=False)
+        print(f"Email с заказом {order.id} успешно отправлен на {recipient_email}")
+        return True
+    except FileNotFoundError:
+        print(f"Ошибка при отправке email: файл PDF для заказа {order.id} не найден ({order.pdf_файл.name})")
+        return False
+    except Exception as e:
+        print(f"Ошибка при отправке email для заказа {order.id} на {recipient_email}: {e}")
+        return False
@@ -1,27 +1,50 @@
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, HttpResponse, Http404, HttpResponseBadRequest
-from django.views.decorators.http import require_POST
+from django.http import JsonResponse, HttpResponse, Http404, HttpResponseBadRequest, HttpResponseNotModified
+from django.views.decorators.http import require_POST, require_GET, require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.db import transaction, IntegrityError
-from .models import ФизическиеЛица, СеансыФильмов, МестаВЗале, КупленныеБилеты
-from .utils import generate_ticket_pdf, send_ticket_email
+from django.utils import timezone
+from .models import ФизическиеЛица, СеансыФильмов, МестаВЗале, КупленныеБилеты, Заказы, АрхивБилетов
+from .jobs import enqueue_ticket_jobs, enqueue_order_jobs, run_ticket_jobs
+from .seatmap import (get_seat, get_seat_map, get_seat_count, get_session, get_session_hall_id, invalidate_seat_map,
+                      seats_from_bitmap)
+from .downloads import serve_stored_file
+from .archive import find_ticket
+from .listing import client_tickets, render_sessions_page, НеверныйКурсор
+from .metrics import checkins, render_metrics, seat_conflicts
+from .checkin import check_in, РезультатПрохода, НеверныйКод
+from .qrtoken import decode_token, НеверныйТокен, ТокенИстек
+from .utils import ensure_order_pdf, ensure_ticket_pdf, pdf_lazy_mode, with_related
+from .dbretry import retry_on_lock, БДПерегружена
+from .holds import acquire_for_purchase, create_hold, get_hold, МестаУдерживаются, НеверноеУдержание
+from django.conf import settings
+from functools import partial
+import base64
 import json
 import os
 # <<<--- Добавьте эту функцию --->>>
 def home_view(request):
-    # Здесь можно получить список ближайших сеансов, например
-    # upcoming_sessions = СеансыФильмов.objects.filter(время_начала__gte=timezone.now()).order_by('время_начала')[:10]
-    # context = {'sessions': upcoming_sessions}
-    context = {'welcome_message': 'Добро пожаловать в систему продажи билетов!'} # Простой контекст для начала
+    # Список ближайших сеансов - готовый HTML из кэша (см. listing.py), страницы по курсору ?after=
+    after = request.GET.get('after')
+    try:
+        sessions_html = render_sessions_page(after)
+    except НеверныйКурсор as e:
+        return HttpResponseBadRequest(str(e))
+    context = {
+        'welcome_message': 'Добро пожаловать в систему продажи билетов!',
+        'sessions_html': sessions_html,
+        'after': after,
+    }
     return render(request, 'cinema_tickets/home.html', context)
 # Пример View для "покупки" билета (упрощенный)
 # Ожидает POST запрос с JSON: {"client_id": ID, "session_id": ID, "seat_number": номер}
 @csrf_exempt
 @require_POST
-@transaction.atomic
 def purchase_ticket_view(request):
+    удержание = None
+    purchased = False
     try:
         data = json.loads(request.body)
         client_id = data.get('client_id')
@@ -41,67 +64,49 @@ def purchase_ticket_view(request):
         except ValidationError:
              return JsonResponse({'error': 'Некорректный формат email адреса.'}, status=400)
 
+        # --- Удержание места ---
+        # Дешевая проверка в кэше до любых запросов к БД: конкуренты за то же место
+        # получают отказ здесь, а не на вставке в таблицу билетов
+        try:
+            удержание = acquire_for_purchase(session_id, [seat_number], data.get('hold_token'))
+        except МестаУдерживаются:
+            seat_conflicts.inc(endpoint='purchase', reason='held')
+            return JsonResponse({'error': f'Место {seat_number} сейчас оформляет другой покупатель.'}, status=409)
+        except НеверноеУдержание as e:
+            return JsonResponse({'error': str(e)}, status=409)
 
-        клиент = get_object_or_404(ФизическиеЛица, pk=client_id)
-        сеанс = get_object_or_404(СеансыФильмов, pk=session_id)
-        место = get_object_or_404(МестаВЗале, номер_места=seat_number)
-
-        # --- Обновление/проверка Email клиента ---
-        # Если у клиента еще нет email или он отличается, обновим его
-        if not клиент.email or клиент.email != client_email:
-            # Проверим, не занят ли этот email другим клиентом
-            if ФизическиеЛица.objects.filter(email=client_email).exclude(pk=клиент.pk).exists():
-                 return JsonResponse({'error': f'Email {client_email} уже используется другим клиентом.'}, status=409) # Conflict
-            клиент.email = client_email
-            клиент.save() # Сохраняем обновленный email клиента
-
-        # Проверка, не куплен ли уже билет
-        if КупленныеБилеты.objects.filter(сеанс=сеанс, место=место).exists():
-             return JsonResponse({'error': f'Место {seat_number} на сеанс "{сеанс.название_фильма}" уже занято.'}, status=409)
+        # Запрос к БД до записи - только клиент. Сеанс и место берутся из кэша
+        # (сбрасываются при изменении сеанса и мест зала), номер места сквозной в пределах зала
+        клиент = ФизическиеЛица.objects.get(pk=client_id)
+        сеанс = get_session(session_id)
+        if _session_finished(сеанс):
+            return _session_finished_response(сеанс)
+        место = get_seat(сеанс.зал_id, seat_number)
 
-        # Создание билета
-        новый_билет = КупленныеБилеты.objects.create(
-            клиент=клиент,
-            сеанс=сеанс,
-            место=место,
-            email_получателя=client_email # <-- Сохраняем email, на который отправим
-        )
-
-        # Генерация и сохранение PDF (теперь с кодами)
-        try:
-            generate_ticket_pdf(новый_билет)
-            pdf_generated = True
-        except Exception as e:
-            pdf_generated = False
-            print(f"Ошибка генерации PDF для билета {новый_билет.id}: {e}")
-            # transaction.atomic сам откатит создание билета при ошибке здесь
-            return JsonResponse({'error': 'Ошибка при генерации PDF билета.'}, status=500)
-
-        # --- Отправка email ---
-        email_sent_status = False
-        if pdf_generated and новый_билет.pdf_файл:
-             email_sent_status = send_ticket_email(новый_билет, client_email)
-        else:
-             print(f"PDF не был сгенерирован для билета {новый_билет.id}, email не отправлен.")
+        # Занятость места и email отдельными запросами не проверяются: повторную продажу
+        # места и чужой email отсекают уникальные ограничения (IntegrityError -> 409 ниже)
+        email_changed = клиент.email != client_email
 
+        новый_билет = _save_purchase(клиент, email_changed, сеанс, место, client_email)
+        клиент.email = client_email
+        purchased = True
+        if getattr(settings, 'TICKET_JOBS_EAGER', False):
+            новый_билет.refresh_from_db(fields=['статус', 'pdf_файл', 'ошибка_обработки'])
 
         # Формируем ответ
         response_data = {
-            'message': 'Билет успешно куплен.',
+            'message': f'Билет успешно куплен. PDF будет сгенерирован и отправлен на {client_email}.',
             'ticket_id': новый_билет.id,
             'client': новый_билет.клиент.get_full_name(),
             'movie': новый_билет.сеанс.название_фильма,
             'session_time': новый_билет.сеанс.время_начала.isoformat(),
             'seat': новый_билет.место.номер_места,
+            'seat_label': новый_билет.место.обозначение,
+            'status': новый_билет.статус,
+            'processing_error': новый_билет.ошибка_обработки or None,
+            'status_url': request.build_absolute_uri(f'/api/tickets/{новый_билет.id}/status/'),
             'pdf_url': request.build_absolute_uri(f'/api/tickets/{новый_билет.id}/pdf/')
         }
-        if pdf_generated:
-             response_data['message'] += ' PDF сгенерирован.'
-        if email_sent_status:
-             response_data['message'] += f' Копия отправлена на {client_email}.'
-        elif pdf_generated:
-             response_data['message'] += ' Не удалось отправить копию на email.'
-
 
         return JsonResponse(response_data, status=201) # 201 Created
 
@@ -113,49 +118,483 @@ def purchase_ticket_view(request):
         return JsonResponse({'error': 'Сеанс не найден.'}, status=404)
     except МестаВЗале.DoesNotExist:
         return JsonResponse({'error': 'Место не найдено.'}, status=404)
+    except БДПерегружена:
+        return _db_busy_response()
     except IntegrityError as e:
-        # Проверяем, связана ли ошибка с unique_together
-        if 'UNIQUE constraint failed: cinema_tickets_купленныебилеты.сеанс_id, cinema_tickets_купленныебилеты.место_id' in str(e):
-             # Пытаемся получить сеанс и место для сообщения об ошибке, если возможно
-             seat_num_str = data.get('seat_number', '???')
-             session_name_str = "???"
-             try:
-                 session_id_for_error = data.get('session_id')
-                 if session_id_for_error:
-                    session_for_error = СеансыФильмов.objects.get(pk=session_id_for_error)
-                    session_name_str = f'"{session_for_error.название_фильма}"'
-             except СеансыФильмов.DoesNotExist:
-                 pass # Оставляем "???"
-             return JsonResponse({'error': f'Место {seat_num_str} на сеанс {session_name_str} уже занято (ошибка целостности).'}, status=409)
+        if 'купленныебилеты' in str(e):
+            # Нарушена уникальность (сеанс, место): место уже продано
+            seat_conflicts.inc(endpoint='purchase', reason='sold')
+            return JsonResponse({'error': f'Место {seat_number} на сеанс "{сеанс.название_фильма}" уже занято.'}, status=409)
+        elif 'физическиелица.email' in str(e):
+            return JsonResponse({'error': f'Email {client_email} уже используется другим клиентом.'}, status=409) # Conflict
         else:
-             # Другая ошибка целостности (например, email клиента)
+             # Другая ошибка целостности
              print(f"Неожиданная ошибка IntegrityError при покупке билета: {e}")
              return JsonResponse({'error': 'Ошибка целостности данных при сохранении.'}, status=409)
 
     except Exception as e:
         print(f"Неожиданная ошибка при покупке билета: {e}")
         return JsonResponse({'error': 'Внутренняя ошибка сервера.'}, status=500)
+    finally:
+        # Место продано (или покупка не удалась при неявном удержании) - удержание места больше
+        # не нужно. Остальные места явного удержания и само удержание при неудаче сохраняются
+        if удержание is not None and (purchased or удержание.implicit):
+            удержание.release([seat_number])
+
+@retry_on_lock
+def _save_purchase(клиент, email_changed, сеанс, место, client_email):
+    """
+    Записывает покупку. Транзакция охватывает только запись: email клиента, билет
+    и задания на обработку, поэтому блокировка записи (в SQLite - на всю БД)
+    держится минимальное время, а при "database is locked" транзакцию можно повторить.
+    """
+    with transaction.atomic():
+        if email_changed:
+            # Условный UPDATE: email пишется, только если он действительно другой
+            ФизическиеЛица.objects.filter(pk=клиент.pk).exclude(email=client_email).update(email=client_email)
+
+        # Создание билета
+        новый_билет = КупленныеБилеты.objects.create(
+            клиент=клиент,
+            сеанс=сеанс,
+            место=место,
+            email_получателя=client_email # <-- Сохраняем email, на который отправим
+        )
+
+        # Генерация PDF и отправка email выполняются в фоне (manage.py run_ticket_worker).
+        # Задания пишутся в той же транзакции, что и билет, поэтому не потеряются.
+        enqueue_ticket_jobs(новый_билет, client_email)
+
+        # В режиме TICKET_JOBS_EAGER задания выполняются сразу после коммита,
+        # ошибки записываются в билет и не откатывают уже совершенную покупку
+        if getattr(settings, 'TICKET_JOBS_EAGER', False):
+            transaction.on_commit(partial(run_ticket_jobs, новый_билет.pk))
+    return новый_билет
+
+def _session_finished(сеанс):
+    # Билеты закончившегося сеанса могут быть уже в архиве, где уникальность
+    # (сеанс, место) не проверяется, - такие места не продаются
+    return сеанс.время_окончания <= timezone.now()
+
+def _session_finished_response(сеанс):
+    return JsonResponse({'error': f'Сеанс "{сеанс.название_фильма}" уже закончился.'}, status=409)
+
+def _db_busy_response():
+    # Покупка не записана - клиент может безопасно повторить запрос
+    response = JsonResponse({'error': 'Сервер перегружен, повторите попытку через секунду.'}, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+def _validate_seat_numbers(seat_numbers):
+    """Проверяет список номеров мест из запроса. Возвращает ответ с ошибкой или None."""
+    max_seats = getattr(settings, 'TICKET_ORDER_MAX_SEATS', 10)
+    if (not isinstance(seat_numbers, list)
+            or not all(isinstance(n, int) and not isinstance(n, bool) and n > 0 for n in seat_numbers)):
+        return JsonResponse({'error': 'seat_numbers должен быть списком номеров мест.'}, status=400)
+    if len(set(seat_numbers)) != len(seat_numbers):
+        return JsonResponse({'error': 'Номера мест в заказе не должны повторяться.'}, status=400)
+    if len(seat_numbers) > max_seats:
+        return JsonResponse({'error': f'В одном заказе можно купить не более {max_seats} мест.'}, status=400)
+    return None
+
+# View для временного удержания мест перед покупкой
+# Ожидает POST запрос с JSON: {"session_id": ID, "seat_numbers": [номер, ...]}
+# Полученный hold_token передается в purchase/ или api/orders/
+@csrf_exempt
+@require_POST
+def create_hold_view(request):
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Неверный формат JSON в теле запроса.'}, status=400)
+
+    session_id = data.get('session_id')
+    seat_numbers = data.get('seat_numbers')
+    if not session_id or not seat_numbers:
+        return JsonResponse({'error': 'Не все поля предоставлены. Требуются session_id и seat_numbers.'}, status=400)
+    error_response = _validate_seat_numbers(seat_numbers)
+    if error_response:
+        return error_response
+
+    # Проданные места отсекаем по закэшированной карте мест, без запроса к билетам
+    try:
+        сеанс = get_session(session_id)
+        _, bitmap = get_seat_map(session_id)
+    except (СеансыФильмов.DoesNotExist, ValueError):
+        return JsonResponse({'error': 'Сеанс не найден.'}, status=404)
+    if _session_finished(сеанс):
+        return _session_finished_response(сеанс)
+    sold = sorted(set(seats_from_bitmap(bitmap)) & set(seat_numbers))
+    if sold:
+        seat_conflicts.inc(endpoint='hold', reason='sold')
+        return JsonResponse({'error': f'Места {", ".join(map(str, sold))} уже проданы.', 'taken_seats': sold}, status=409)
+
+    try:
+        удержание = create_hold(session_id, seat_numbers)
+    except МестаУдерживаются as e:
+        seat_conflicts.inc(endpoint='hold', reason='held')
+        return JsonResponse({'error': str(e), 'held_seats': e.seat_numbers}, status=409)
+
+    return JsonResponse({
+        'hold_token': удержание.token,
+        'session_id': удержание.session_id,
+        'seat_numbers': удержание.seat_numbers,
+        'expires_at': удержание.expires_at.isoformat(),
+    }, status=201)
+
+# View для досрочного снятия удержания (DELETE)
+@csrf_exempt
+@require_http_methods(['DELETE'])
+def release_hold_view(request, token):
+    try:
+        удержание = get_hold(token)
+    except НеверноеУдержание as e:
+        return JsonResponse({'error': str(e)}, status=404)
+    удержание.release()
+    return HttpResponse(status=204)
+
+# View для групповой покупки нескольких мест на один сеанс
+# Ожидает POST запрос с JSON: {"client_id": ID, "session_id": ID, "seat_numbers": [номер, ...], "client_email": email}
+@csrf_exempt
+@require_POST
+def create_order_view(request):
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Неверный формат JSON в теле запроса.'}, status=400)
+
+    client_id = data.get('client_id')
+    session_id = data.get('session_id')
+    seat_numbers = data.get('seat_numbers')
+    client_email = data.get('client_email')
+
+    if not all([client_id, session_id, seat_numbers, client_email]):
+        missing = [k for k, v in {'client_id': client_id, 'session_id': session_id, 'seat_numbers': seat_numbers, 'client_email': client_email}.items() if not v]
+        return JsonResponse({'error': f'Не все поля предоставлены. Отсутствуют: {", ".join(missing)}'}, status=400)
+
+    error_response = _validate_seat_numbers(seat_numbers)
+    if error_response:
+        return error_response
+
+    try:
+        validate_email(client_email)
+    except ValidationError:
+        return JsonResponse({'error': 'Некорректный формат email адреса.'}, status=400)
+
+    # Удержание всех мест заказа до обращения к таблице билетов
+    try:
+        удержание = acquire_for_purchase(session_id, seat_numbers, data.get('hold_token'))
+    except МестаУдерживаются as e:
+        seat_conflicts.inc(endpoint='order', reason='held')
+        return JsonResponse({'error': str(e), 'held_seats': e.seat_numbers}, status=409)
+    except НеверноеУдержание as e:
+        return JsonResponse({'error': str(e)}, status=409)
+
+    try:
+        response = _create_order(request, client_id, session_id, seat_numbers, client_email)
+    except Exception:
+        if удержание.implicit:
+            удержание.release()
+        raise
+    # Снимаются только места заказа: остальные места удержания покупатель еще оформляет
+    if response.status_code == 201 or удержание.implicit:
+        удержание.release(seat_numbers)
+    return response
+
+def _create_order(request, client_id, session_id, seat_numbers, client_email):
+    клиент = get_object_or_404(ФизическиеЛица, pk=client_id)
+    сеанс = get_object_or_404(СеансыФильмов, pk=session_id)
+    if _session_finished(сеанс):
+        return _session_finished_response(сеанс)
+
+    # Все места заказа - одним запросом
+    места = list(МестаВЗале.objects.filter(зал_id=сеанс.зал_id, номер_места__in=seat_numbers))
+    if len(места) != len(seat_numbers):
+        found = {место.номер_места for место in места}
+        missing = sorted(set(seat_numbers) - found)
+        return JsonResponse({'error': f'Места не найдены: {", ".join(map(str, missing))}'}, status=404)
+
+    taken = sorted(КупленныеБилеты.objects.filter(сеанс=сеанс, место__in=места)
+                   .values_list('место__номер_места', flat=True))
+    if taken:
+        seat_conflicts.inc(endpoint='order', reason='sold')
+        return JsonResponse({'error': f'Места {", ".join(map(str, taken))} на сеанс "{сеанс.название_фильма}" уже заняты.',
+                             'taken_seats': taken}, status=409)
+
+    email_changed = not клиент.email or клиент.email != client_email
+    if email_changed:
+        if ФизическиеЛица.objects.filter(email=client_email).exclude(pk=клиент.pk).exists():
+            return JsonResponse({'error': f'Email {client_email} уже используется другим клиентом.'}, status=409)
+        клиент.email = client_email
+
+    try:
+        заказ, билеты = _save_order(клиент, email_changed, сеанс, места, client_email)
+    except БДПерегружена:
+        return _db_busy_response()
+    except IntegrityError:
+        seat_conflicts.inc(endpoint='order', reason='sold')
+        return JsonResponse({'error': f'Одно из выбранных мест на сеанс "{сеанс.название_фильма}" уже занято. Заказ не оформлен.'}, status=409)
+
+    заказ.refresh_from_db(fields=['статус', 'ошибка_обработки'])
+    response_data = {
+        'message': f'Заказ успешно оформлен. PDF со всеми билетами будет отправлен на {client_email}.',
+        'order_id': заказ.id,
+        'client': клиент.get_full_name(),
+        'movie': сеанс.название_фильма,
+        'session_time': сеанс.время_начала.isoformat(),
+        'tickets': [{'ticket_id': билет.id, 'seat': билет.место.номер_места, 'seat_label': билет.место.обозначение}
+                    for билет in sorted(билеты, key=lambda б: б.место.номер_места)],
+        'status': заказ.статус,
+        'processing_error': заказ.ошибка_обработки or None,
+        'status_url': request.build_absolute_uri(f'/api/orders/{заказ.id}/'),
+        'pdf_url': request.build_absolute_uri(f'/api/orders/{заказ.id}/pdf/'),
+    }
+    return JsonResponse(response_data, status=201)
+
+@retry_on_lock
+def _save_order(клиент, email_changed, сеанс, места, client_email):
+    # Все места заказа занимаются одной транзакцией: либо все, либо ни одного
+    with transaction.atomic():
+        if email_changed:
+            клиент.save(update_fields=['email'])
+        заказ = Заказы.objects.create(клиент=клиент, сеанс=сеанс, email_получателя=client_email)
+        билеты = КупленныеБилеты.objects.bulk_create([
+            КупленныеБилеты(клиент=клиент, сеанс=сеанс, место=место,
+                            email_получателя=client_email, заказ=заказ)
+            for место in места
+        ])
+        # Один PDF на весь заказ и одно письмо
+        enqueue_order_jobs(заказ, билеты, client_email)
+        # bulk_create не шлет сигналы, поэтому карту мест обновляем явно
+        transaction.on_commit(partial(invalidate_seat_map, сеанс.pk))
+        if getattr(settings, 'TICKET_JOBS_EAGER', False):
+            transaction.on_commit(partial(run_ticket_jobs, min(билет.pk for билет in билеты)))
+    return заказ, билеты
+
+# API View карты занятости мест на сеанс
+# Ответ: bitmap (base64), где бит N (байт N // 8, бит N % 8) означает "место N занято".
+# Поддерживается If-None-Match: при неизменной карте отдается 304 без тела.
+@require_GET
+def session_seats_api(request, session_id):
+    try:
+        version, bitmap = get_seat_map(session_id)
+    except СеансыФильмов.DoesNotExist:
+        raise Http404("Сеанс не найден.")
+    etag = f'"seats-{session_id}-{version}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        occupied = seats_from_bitmap(bitmap)
+        hall_id = get_session_hall_id(session_id)
+        total = get_seat_count(hall_id)
+        response = JsonResponse({
+            'session_id': session_id,
+            'hall_id': hall_id,
+            'total': total,
+            'free': max(total - len(occupied), 0),
+            'occupied': occupied,
+            'bitmap': base64.b64encode(bitmap).decode('ascii'),
+        })
+    response['ETag'] = etag
+    # Клиент может кэшировать, но обязан перепроверять через If-None-Match
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+# API View для опроса статуса заказа
+def get_order_status_api(request, order_id):
+    заказ = get_object_or_404(Заказы, pk=order_id)
+    response_data = {
+        'order_id': заказ.id,
+        'status': заказ.статус,
+        'status_display': заказ.get_статус_display(),
+        'pdf_ready': bool(заказ.pdf_файл),
+        'processing_error': заказ.ошибка_обработки or None,
+        'tickets': list(заказ.билеты.order_by('место__номер_места').values_list('id', flat=True)),
+    }
+    if заказ.pdf_файл:
+        response_data['pdf_url'] = request.build_absolute_uri(f'/api/orders/{заказ.id}/pdf/')
+    return JsonResponse(response_data)
+
+# API View для получения общего PDF заказа
+@require_http_methods(['GET', 'HEAD'])
+def get_order_pdf_api(request, order_id):
+    заказ = get_object_or_404(Заказы, pk=order_id)
+    if not заказ.pdf_файл and pdf_lazy_mode():
+        ensure_order_pdf(заказ)
+    if not заказ.pdf_файл:
+        raise Http404("PDF для этого заказа еще не сгенерирован или отсутствует.")
+    try:
+        return serve_stored_file(request, заказ.pdf_файл, os.path.basename(заказ.pdf_файл.name))
+    except FileNotFoundError:
+        raise Http404(f"Файл PDF для заказа {order_id} не найден на сервере.")
+
+# API View для опроса статуса обработки билета (PDF/email генерируются в фоне)
+def get_ticket_status_api(request, ticket_id):
+    # Билеты прошедших сеансов могут быть уже перенесены в архив (archive.py)
+    билет = find_ticket(ticket_id)
+    if билет is None:
+        raise Http404("Билет не найден.")
+    response_data = {
+        'ticket_id': билет.id,
+        'status': билет.статус,
+        'status_display': билет.get_статус_display(),
+        'pdf_ready': bool(билет.pdf_файл),
+        'processing_error': билет.ошибка_обработки or None,
+        'archived': isinstance(билет, АрхивБилетов),
+    }
+    if билет.pdf_файл:
+        response_data['pdf_url'] = request.build_absolute_uri(f'/api/tickets/{билет.id}/pdf/')
+    return JsonResponse(response_data)
+
+# API View списка билетов клиента, от новых к старым
+# Страницы по курсору: ?after=<next_cursor из предыдущего ответа>&limit=N
+# ?archive=1 - вместе с билетами прошедших сеансов, перенесенными в архив
+@require_GET
+def client_tickets_api(request, client_id):
+    try:
+        limit = int(request.GET.get('limit', 0)) or None
+    except ValueError:
+        return JsonResponse({'error': 'Неверное значение limit.'}, status=400)
+    include_archive = request.GET.get('archive') == '1'
+    try:
+        билеты, next_cursor = client_tickets(client_id, request.GET.get('after'), limit, include_archive)
+    except НеверныйКурсор as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    # Пустая страница - единственный случай, когда нужно проверить, существует ли клиент
+    if not билеты and not ФизическиеЛица.objects.filter(pk=client_id).exists():
+        return JsonResponse({'error': 'Клиент не найден.'}, status=404)
+
+    response_data = {
+        'client_id': client_id,
+        'tickets': [{
+            'ticket_id': билет.id,
+            'purchased_at': билет.дата_покупки.isoformat(),
+            'movie': билет.сеанс.название_фильма,
+            'session_time': билет.сеанс.время_начала.isoformat(),
+            'hall': билет.сеанс.зал.название,
+            'seat': билет.место.номер_места,
+            'seat_label': билет.место.обозначение,
+            'status': билет.статус,
+            'order_id': билет.заказ_id,
+            'pdf_url': request.build_absolute_uri(f'/api/tickets/{билет.id}/pdf/'),
+            'archived': isinstance(билет, АрхивБилетов),
+        } for билет in билеты],
+        'next_cursor': next_cursor,
+    }
+    if next_cursor:
+        response_data['next_url'] = request.build_absolute_uri(
+            f'?after={next_cursor}' + (f'&limit={limit}' if limit else '') + ('&archive=1' if include_archive else ''))
+    return JsonResponse(response_data)
 
 # API View для получения PDF билета
+# Файл стримится, поддерживаются ETag/Last-Modified (ответ 304), Range (ответ 206)
+# и отдача через X-Sendfile/X-Accel-Redirect (настройка TICKET_PDF_SENDFILE)
+@require_http_methods(['GET', 'HEAD'])
 def get_ticket_pdf_api(request, ticket_id):
-    # 1. Найти билет в базе по ID
-    билет = get_object_or_404(КупленныеБилеты, pk=ticket_id)
+    # 1. Найти билет в базе по ID (вместе с заказом - на случай общего PDF),
+    # а если его там нет - в архиве билетов прошедших сеансов
+    билет = find_ticket(ticket_id, related=('заказ',))
+    if билет is None:
+        raise Http404("Билет не найден.")
 
-    # 2. Проверить, был ли PDF сгенерирован и сохранен для этого билета
-    if not билет.pdf_файл:
+    # 2. Проверить, был ли PDF сгенерирован и сохранен для этого билета.
+    # У билетов групповой покупки свой PDF не создается - отдаем общий PDF заказа
+    pdf_файл = билет.pdf_файл
+    if not pdf_файл and билет.заказ_id:
+        pdf_файл = билет.заказ.pdf_файл
+    if not pdf_файл and pdf_lazy_mode():
+        # Ленивый режим: PDF генерируется при первом скачивании (ровно один раз)
+        try:
+            if билет.заказ_id:
+                pdf_файл = ensure_order_pdf(билет.заказ)
+            else:
+                pdf_файл = ensure_ticket_pdf(with_related(билет))
+        except Exception as e:
+            print(f"Ошибка генерации PDF для билета {ticket_id} по запросу: {e}")
+            return HttpResponse("Ошибка при получении файла PDF.", status=500)
+    if not pdf_файл:
         raise Http404("PDF для этого билета еще не сгенерирован или отсутствует.")
 
     try:
-        # 3. Открыть сохраненный файл PDF из поля модели (физически лежит в MEDIA_ROOT)
-        pdf = билет.pdf_файл.open('rb')
-        # 4. Создать HTTP ответ с содержимым файла и правильным типом контента
-        response = HttpResponse(pdf.read(), content_type='application/pdf')
-        response['Content-Disposition'] = f'inline; filename="{os.path.basename(билет.pdf_файл.name)}"'
-        pdf.close() # Не забываем закрыть файл
-        return response
+        # 3. Отдать сохраненный файл PDF потоком, не читая его целиком в память
+        return serve_stored_file(request, pdf_файл, os.path.basename(pdf_файл.name))
     except FileNotFoundError:
          # Если запись в базе есть, а файла на диске нетcd
          raise Http404(f"Файл PDF для билета {ticket_id} не найден на сервере.")
     except Exception as e:
-        print(f"Ошибка при отдаче PDF файла {билет.pdf_файл.name}: {e}")
-        return HttpResponse("Ошибка при получении файла PDF.", status=500)
\ No newline at end of file
+        print(f"Ошибка при отдаче PDF файла {pdf_файл.name}: {e}")
+        return HttpResponse("Ошибка при получении файла PDF.", status=500)
+
+# View прохода по билету на входе в зал (сканер контролера)
+# Ожидает POST запрос с JSON: {"session_id": ID, "code": "TICKET-<id>"}
+# Билет ищется в индексе сеанса в кэше (см. checkin.py), проход отмечается одним условным UPDATE
+@csrf_exempt
+@require_POST
+def checkin_view(request):
+    token = getattr(settings, 'CHECKIN_API_TOKEN', None)
+    if token and request.headers.get('X-Checkin-Token') != token:
+        return JsonResponse({'error': 'Неверный токен сканера.'}, status=403)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Неверный формат JSON в теле запроса.'}, status=400)
+    session_id = data.get('session_id')
+    code = data.get('code')
+    if not isinstance(session_id, int) or not code:
+        return JsonResponse({'error': 'Не все поля предоставлены. Требуются session_id и code.'}, status=400)
+
+    try:
+        проход = check_in(session_id, code)
+    except НеверныйКод as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    checkins.inc(result=проход.result)
+
+    response_data = {'result': проход.result, 'ticket_id': проход.ticket_id}
+    if проход.result == РезультатПрохода.НЕ_НАЙДЕН:
+        response_data['error'] = 'Билет не найден среди билетов этого сеанса.'
+        return JsonResponse(response_data, status=404)
+    response_data['seat'] = проход.seat_number
+    response_data['admitted_at'] = проход.admitted_at.isoformat()
+    try:
+        response_data['seat_label'] = get_seat(get_session_hall_id(session_id), проход.seat_number).обозначение
+    except (СеансыФильмов.DoesNotExist, МестаВЗале.DoesNotExist):
+        response_data['seat_label'] = f'№{проход.seat_number}'
+    if проход.result == РезультатПрохода.УЖЕ_ПРОШЕЛ:
+        response_data['error'] = 'По этому билету уже прошли.'
+        return JsonResponse(response_data, status=409)
+    return JsonResponse(response_data)
+
+# View проверки QR-токена билета (подпись и срок действия), без обращения к БД
+# Ожидает POST запрос с JSON: {"code": "<токен из QR>"}
+@csrf_exempt
+@require_POST
+def verify_ticket_token_view(request):
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Неверный формат JSON в теле запроса.'}, status=400)
+    code = data.get('code')
+    if not code:
+        return JsonResponse({'error': 'Не все поля предоставлены. Требуется code.'}, status=400)
+    try:
+        token = decode_token(code)
+    except ТокенИстек as e:
+        return JsonResponse({'valid': False, 'error': str(e)}, status=410)
+    except НеверныйТокен as e:
+        return JsonResponse({'valid': False, 'error': str(e)}, status=400)
+    return JsonResponse({
+        'valid': True,
+        'ticket_id': token.ticket_id,
+        'session_id': token.session_id,
+        'seat': token.seat_number,
+        'expires_at': token.expires_at.isoformat(),
+    })
+
+# Метрики процесса в текстовом формате Prometheus (см. metrics.py)
+@require_GET
+def metrics_view(request):
+    # Без настройки - только с этой машины; None или пустой список закрывают /metrics для всех
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')) or ()
+    if request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')